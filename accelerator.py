@@ -0,0 +1,385 @@
+import contextvars
+import datetime
+import decimal
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+from sqlalchemy import inspect, text
+
+from connections import database_identity
+from result_stream import DEFAULT_MAX_ROWS, _to_frame
+
+ACCEL_ROOT = Path(tempfile.gettempdir()) / "sql_chat_cache" / "duckdb"
+# Snapshots older than this are refreshed in the background; queries go to the source meanwhile
+DEFAULT_MAX_AGE = 15 * 60
+# Tables larger than this stay on the source database
+MAX_SNAPSHOT_ROWS = 5_000_000
+COPY_CHUNK_ROWS = 50_000
+FETCH_BATCH_ROWS = 10_000
+# Only queries that aggregate are worth routing; point lookups are fast on the source
+ANALYTICAL_PATTERN = re.compile(
+    r"\b(GROUP\s+BY|HAVING|OVER|DISTINCT|COUNT|SUM|AVG|MIN|MAX|MEDIAN|STDDEV\w*|VARIANCE|PERCENTILE\w*)\b", re.IGNORECASE
+)
+# SQLite's LIKE and GLOB ignore case where DuckDB's do not; such queries stay on the source
+SQLITE_ONLY_PATTERN = re.compile(r"\b(LIKE|GLOB)\b", re.IGNORECASE)
+
+SNAPSHOTS_TABLE = "_sql_chat_snapshots"
+
+# Where each source sorts NULLs; DuckDB puts them last both ways unless told otherwise
+NULL_ORDER = {
+    "sqlite": "nulls_first_on_asc_last_on_desc",
+    "mysql": "nulls_first_on_asc_last_on_desc",
+    "mariadb": "nulls_first_on_asc_last_on_desc",
+    "postgresql": "nulls_last_on_asc_first_on_desc",
+}
+
+# Column types by the Python type SQLAlchemy reports; anything else is copied as text
+DUCKDB_TYPES = {
+    bool: "BOOLEAN",
+    int: "BIGINT",
+    float: "DOUBLE",
+    # Streams turn NUMERIC into floats as well (result_stream._to_frame)
+    decimal.Decimal: "DOUBLE",
+    datetime.datetime: "TIMESTAMP",
+    datetime.date: "DATE",
+    datetime.time: "TIME",
+    bytes: "BLOB",
+}
+# SQLite hands dates back as the text it stored, so snapshots keep them as text too
+SQLITE_TEXT_TYPES = {datetime.datetime, datetime.date, datetime.time}
+
+
+@dataclass
+class AccelerationSettings:
+    """One caller's choice of tables to answer from snapshots and how old those may be"""
+    tables: list
+    max_age: float = DEFAULT_MAX_AGE
+
+
+@dataclass
+class Snapshot:
+    table: str
+    rows: int
+    refreshed_at: float
+    duration: float
+
+    @property
+    def age(self):
+        return time.time() - self.refreshed_at
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _duckdb_type(column_type, dialect):
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        return "VARCHAR"
+    if dialect == "sqlite" and python_type in SQLITE_TEXT_TYPES:
+        return "VARCHAR"
+    return DUCKDB_TYPES.get(python_type, "VARCHAR")
+
+
+def _arrow_chunk(frame):
+    """Arrow table for a chunk; columns mixing Python types (SQLite allows that) become text"""
+    try:
+        return pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        for column in frame.columns[frame.dtypes == object]:
+            frame[column] = frame[column].map(lambda value: value if value is None else str(value))
+        return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+class Accelerator:
+    """Columnar DuckDB copy of selected source tables that answers read-only analytical queries
+
+    Tables are copied through SQLAlchemy in Arrow chunks. DuckDB's SQLite and
+    Postgres scanners are not used: they need file and network access on the
+    same DuckDB instance that runs LLM-written SQL, which is locked down here.
+
+    One accelerator serves every session on a database and snapshots every
+    table any of them asked for; each query only uses the tables and
+    freshness of its caller's AccelerationSettings.
+    """
+
+    def __init__(self, db, tables, max_age=DEFAULT_MAX_AGE, root=ACCEL_ROOT):
+        self.db = db
+        self.dialect = db.dialect
+        self.identity = database_identity(db)
+        Path(root).mkdir(parents=True, exist_ok=True)
+        self.path = Path(root) / f"{self.identity[:16]}.duckdb"
+        self.tables = {}
+        self.max_age = max_age
+        self.routed = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="duckdb-refresh")
+        self._conn = duckdb.connect(str(self.path), config={
+            "enable_external_access": False,
+            "autoinstall_known_extensions": False,
+            "autoload_known_extensions": False,
+            # SQLite, Postgres and MySQL all divide integers as integers
+            "integer_division": True,
+            "default_null_order": NULL_ORDER.get(self.dialect, "nulls_last_on_asc_first_on_desc"),
+        })
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {SNAPSHOTS_TABLE} "
+            "(table_name VARCHAR PRIMARY KEY, row_count BIGINT, refreshed_at DOUBLE, duration DOUBLE)"
+        )
+        self.snapshots = {
+            row[0]: Snapshot(*row)
+            for row in self._conn.execute(f"SELECT * FROM {SNAPSHOTS_TABLE}").fetchall()
+        }
+        self.add(tables, max_age)
+
+    def add(self, tables, max_age=DEFAULT_MAX_AGE):
+        """Snapshot tables too; those older than max_age start refreshing"""
+        self.tables.update({name.lower(): name for name in tables})
+        changed_at = self._source_changed_at()
+        self.refresh_async([name for name in tables if not self.is_fresh(name, changed_at, max_age)])
+
+    def _source_changed_at(self):
+        """Last write to a SQLite source file; server databases rely on max_age alone"""
+        if self.dialect != "sqlite":
+            return 0.0
+        try:
+            with self.db._engine.connect() as conn:
+                files = [row[2] for row in conn.exec_driver_sql("PRAGMA database_list") if row[2]]
+            return max((p.stat().st_mtime for f in files for p in (Path(f), Path(f + "-wal")) if p.exists()), default=0.0)
+        except Exception:
+            return 0.0
+
+    def is_fresh(self, table, changed_at=None, max_age=None):
+        snapshot = self.snapshots.get(table)
+        if snapshot is None or snapshot.age > (self.max_age if max_age is None else max_age):
+            return False
+        changed_at = self._source_changed_at() if changed_at is None else changed_at
+        return snapshot.refreshed_at >= changed_at
+
+    def refresh(self, table):
+        """Copy one source table into DuckDB, swapping it in atomically once complete"""
+        started = time.perf_counter()
+        refreshed_at = time.time()
+        staging = _quote(f"{table}__staging")
+        rows, in_transaction = 0, False
+        with self._lock:
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+                # Types come from the source's columns, not the first chunk, where a column may be all NULL
+                types = self._column_types(table)
+                cursor.execute(f"CREATE TABLE {staging} ({', '.join(f'{_quote(c)} {t}' for c, t in types.items())})")
+                with self.db._engine.connect().execution_options(stream_results=True) as conn:
+                    result = conn.execute(text(f"SELECT * FROM {_quote(table)}"))
+                    columns = list(result.keys())
+                    while chunk := result.fetchmany(COPY_CHUNK_ROWS):
+                        rows += len(chunk)
+                        if rows > MAX_SNAPSHOT_ROWS:
+                            raise ValueError(f"{table} has more than {MAX_SNAPSHOT_ROWS:,} rows")
+                        self._insert_chunk(cursor, staging, types, _arrow_chunk(_to_frame(chunk, columns)))
+                duration = time.perf_counter() - started
+                cursor.execute("BEGIN")
+                in_transaction = True
+                cursor.execute(f"DROP TABLE IF EXISTS {_quote(table)}")
+                cursor.execute(f"ALTER TABLE {staging} RENAME TO {_quote(table)}")
+                cursor.execute(
+                    f"INSERT OR REPLACE INTO {SNAPSHOTS_TABLE} VALUES (?, ?, ?, ?)", [table, rows, refreshed_at, duration]
+                )
+                cursor.execute("COMMIT")
+                in_transaction = False
+                self.snapshots[table] = Snapshot(table, rows, refreshed_at, duration)
+            except Exception:
+                if in_transaction:
+                    cursor.execute("ROLLBACK")
+                cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+                raise
+            finally:
+                cursor.close()
+
+    def _column_types(self, table):
+        """{column: DuckDB type} from the source table's declared column types"""
+        columns = inspect(self.db._engine).get_columns(table)
+        return {column["name"]: _duckdb_type(column["type"], self.dialect) for column in columns}
+
+    def _insert_chunk(self, cursor, staging, types, batch):
+        """Append batch to staging; columns holding values their declared type cannot take become text"""
+        cursor.register("chunk", batch)
+        try:
+            try:
+                cursor.execute(f"INSERT INTO {staging} BY NAME SELECT * FROM chunk")
+            except duckdb.ConversionException:
+                # SQLite's dynamic typing lets a column declared INTEGER hold 'n/a'
+                widened = [field.name for field in batch.schema if types.get(field.name) != "VARCHAR"
+                           and (pa.types.is_string(field.type) or pa.types.is_large_string(field.type))]
+                if not widened:
+                    raise
+                for name in widened:
+                    cursor.execute(f"ALTER TABLE {staging} ALTER {_quote(name)} TYPE VARCHAR")
+                    types[name] = "VARCHAR"
+                cursor.execute(f"INSERT INTO {staging} BY NAME SELECT * FROM chunk")
+        finally:
+            cursor.unregister("chunk")
+
+    def _refresh_quietly(self, table):
+        try:
+            self.refresh(table)
+        except Exception as e:
+            print(f"Error snapshotting {table} into DuckDB: {e}")
+        finally:
+            self._refreshing.discard(table)
+
+    def refresh_async(self, tables):
+        for table in tables:
+            if table not in self._refreshing:
+                self._refreshing.add(table)
+                self._executor.submit(self._refresh_quietly, table)
+
+    @property
+    def refreshing(self):
+        return set(self._refreshing)
+
+    def _eligible_tables(self, sql, allowed):
+        """Source tables a single analytical SELECT reads, or None when it should run on the source"""
+        try:
+            statements = duckdb.extract_statements(sql)
+        except duckdb.Error:
+            return None
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            return None
+        if not ANALYTICAL_PATTERN.search(sql):
+            return None
+        if self.dialect == "sqlite" and SQLITE_ONLY_PATTERN.search(sql):
+            return None
+        try:
+            # Binding happens on the locked-down connection, so table functions cannot touch files
+            names = self._conn.cursor().get_table_names(sql)
+        except duckdb.Error:
+            return None
+        tables = [self.tables.get(name.lower()) if name.lower() in allowed else None for name in names]
+        if not tables or None in tables:
+            return None
+        return tables
+
+    def execute(self, sql, settings, max_rows=DEFAULT_MAX_ROWS):
+        """(frame, seconds, truncated) from DuckDB, or None when sql has to run on the source"""
+        tables = self._eligible_tables(sql, {name.lower() for name in settings.tables})
+        if tables is None:
+            return None
+        changed_at = self._source_changed_at()
+        stale = [table for table in tables if not self.is_fresh(table, changed_at, settings.max_age)]
+        if stale:
+            self.refresh_async(stale)
+            self.fallbacks += 1
+            return None
+
+        started = time.perf_counter()
+        cursor = self._conn.cursor()
+        try:
+            reader = cursor.execute(sql).fetch_record_batch(FETCH_BATCH_ROWS)
+            batches, rows, truncated = [], 0, False
+            for batch in reader:
+                batches.append(batch)
+                rows += batch.num_rows
+                if rows > max_rows:
+                    truncated = True
+                    break
+            table = pa.Table.from_batches(batches, reader.schema).slice(0, max_rows)
+            frame = table.to_pandas()
+        except duckdb.Error as e:
+            # Dialect differences (SQLite date functions, MySQL syntax) are answered by the source
+            print(f"DuckDB could not run the query, using the source database: {e}")
+            self.fallbacks += 1
+            return None
+        finally:
+            cursor.close()
+        self.routed += 1
+        return frame, time.perf_counter() - started, truncated
+
+    def status(self, settings):
+        """One row per table settings accelerates, for the app"""
+        changed_at = self._source_changed_at()
+        rows = []
+        for name in (self.tables.get(table.lower(), table) for table in settings.tables):
+            snapshot = self.snapshots.get(name)
+            rows.append({
+                "Table": name,
+                "Rows": snapshot.rows if snapshot else None,
+                "Age (s)": round(snapshot.age) if snapshot else None,
+                "State": "refreshing" if name in self._refreshing
+                         else "fresh" if self.is_fresh(name, changed_at, settings.max_age)
+                         else "stale",
+            })
+        return rows
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._conn.close()
+
+
+_accelerators = {}
+_accelerators_lock = threading.Lock()
+
+
+def enable_acceleration(db, tables, max_age=DEFAULT_MAX_AGE):
+    """Accelerator for db's database, created on first use and shared by every session
+
+    This only makes sure tables are snapshotted; queries are routed to
+    DuckDB in contexts that opted in with use_acceleration.
+    """
+    identity = database_identity(db)
+    with _accelerators_lock:
+        accelerator = _accelerators.get(identity)
+        if accelerator is None:
+            accelerator = _accelerators[identity] = Accelerator(db, tables, max_age)
+        else:
+            accelerator.db = db
+            accelerator.add(tables, max_age)
+    return accelerator
+
+
+_current_acceleration = contextvars.ContextVar("sql_acceleration", default=None)
+
+
+def acceleration_settings():
+    """AccelerationSettings of the current context, or None when its queries go to the source"""
+    return _current_acceleration.get()
+
+
+def use_acceleration(settings):
+    """Route the current context's analytical queries to DuckDB under settings; None turns it off"""
+    return _current_acceleration.set(settings)
+
+
+@contextmanager
+def acceleration_scope(settings):
+    token = _current_acceleration.set(settings)
+    try:
+        yield
+    finally:
+        _current_acceleration.reset(token)
+
+
+def disable_acceleration(db):
+    """Close db's shared accelerator; every session's queries go back to the source"""
+    with _accelerators_lock:
+        accelerator = _accelerators.pop(database_identity(db), None)
+    if accelerator is not None:
+        accelerator.close()
+
+
+def accelerator_for(db):
+    if not _accelerators:
+        return None
+    return _accelerators.get(database_identity(db))
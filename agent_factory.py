@@ -0,0 +1,212 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+import httpx
+from langchain.agents import create_sql_agent
+from langchain.agents.agent_types import AgentType
+
+from agent_runner import runner
+from connections import database_identity
+from llm_gateway import GatewayChatGroq
+from result_capture import CapturingSQLDatabaseToolkit
+from schema_context import AGENT_PREFIX, AGENT_SUFFIX, schema_fingerprint
+from tracing import tracing_handler
+
+# LLM clients and agents kept per process, least recently used dropped first
+MAX_AGENTS = 16
+# Connections to the LLM endpoint stay open between questions so TLS handshakes are not repeated
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=300)
+HTTP_TIMEOUT = httpx.Timeout(120, connect=10)
+TIMING_WINDOW = 100
+
+
+def build_agent(llm, db, verbose=True, **options):
+    """SQL agent with the app's prompts and result-capturing query tool"""
+    toolkit = CapturingSQLDatabaseToolkit(db=db, llm=llm)
+    return create_sql_agent(
+        llm=llm,
+        toolkit=toolkit,
+        verbose=verbose,
+        agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+        prefix=AGENT_PREFIX,
+        suffix=AGENT_SUFFIX,
+        handle_parsing_errors=True,
+        **options,
+    )
+
+
+@dataclass(frozen=True)
+class AgentKey:
+    identity: str
+    schema: str
+    model: str
+    temperature: float
+    api_key: str
+    options: tuple
+
+
+@dataclass
+class AgentEntry:
+    llm: object
+    agent: object
+    built_at: float
+    build_seconds: float
+    hits: int = 0
+
+
+class AgentFactory:
+    """Process-wide cache of LLM clients and SQL agents that share keep-alive HTTP connections
+
+    Entries are keyed by database identity and schema fingerprint, model,
+    temperature, API key and agent options, so a schema change builds a new
+    agent while reruns and other sessions with the same settings reuse one.
+    Sessions hold the key they use; an agent is dropped as soon as its last
+    holder moves to other settings, and unheld ones age out of the LRU.
+    """
+
+    def __init__(self, max_entries=MAX_AGENTS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # key -> Future of the agent being built, so concurrent misses wait for one build
+        self._pending = {}
+        # key -> ids of the sessions currently using it
+        self._holders = {}
+        self._lock = threading.Lock()
+        self._http_client = None
+        self._http_async_client = None
+        self.cold_builds = 0
+        self.warm_hits = 0
+        self.cold = deque(maxlen=TIMING_WINDOW)
+        self.warm = deque(maxlen=TIMING_WINDOW)
+
+    def _http_clients(self):
+        if self._http_client is None:
+            self._http_client = httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+            self._http_async_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        return self._http_client, self._http_async_client
+
+    def key(self, db, model, temperature, api_key, **options):
+        return AgentKey(
+            database_identity(db),
+            schema_fingerprint(db),
+            model,
+            float(temperature),
+            hashlib.sha256((api_key or "").encode()).hexdigest(),
+            tuple(sorted(options.items())),
+        )
+
+    def _build(self, db, model, temperature, api_key, options):
+        http_client, http_async_client = self._http_clients()
+        # Rate limiting, retries and request sharing happen in the gateway, not the Groq client
+        llm = GatewayChatGroq(
+            groq_api_key=api_key,
+            model_name=model,
+            streaming=True,
+            temperature=temperature,
+            callbacks=[tracing_handler],
+            http_client=http_client,
+            http_async_client=http_async_client,
+            max_retries=0,
+        )
+        return llm, build_agent(llm, db, **options)
+
+    def get(self, db, api_key, model, temperature, **options):
+        """(llm, agent) for these settings, built on a miss and reused afterwards"""
+        started = time.perf_counter()
+        key = self.key(db, model, temperature, api_key, **options)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+                self.warm_hits += 1
+                self.warm.append(time.perf_counter() - started)
+                return entry.llm, entry.agent
+            pending = self._pending.get(key)
+            building = pending is None
+            if building:
+                pending = self._pending[key] = Future()
+
+        if not building:
+            return pending.result()
+
+        # Other settings must not wait on this build; the same settings wait on pending
+        try:
+            llm, agent = self._build(db, model, temperature, api_key, options)
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.set_exception(e)
+            raise
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._pending.pop(key, None)
+            self._entries[key] = AgentEntry(llm, agent, time.time(), elapsed)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._holders.pop(evicted, None)
+            self.cold_builds += 1
+            self.cold.append(elapsed)
+        pending.set_result((llm, agent))
+        return llm, agent
+
+    def hold(self, key, holder):
+        """Record that holder (a session id) uses the agent for key"""
+        with self._lock:
+            self._holders.setdefault(key, set()).add(holder)
+
+    def release(self, key, holder):
+        """holder stopped using key; the agent is dropped once no session holds it"""
+        with self._lock:
+            holders = self._holders.get(key)
+            if holders is None:
+                return False
+            holders.discard(holder)
+            if holders:
+                return False
+            del self._holders[key]
+            return self._entries.pop(key, None) is not None
+
+    def invalidate(self, identity=None, model=None, temperature=None):
+        """Drop cached agents matching every given setting (all of them when none is given)"""
+        with self._lock:
+            stale = [
+                key for key in self._entries
+                if (identity is None or key.identity == identity)
+                and (model is None or key.model == model)
+                and (temperature is None or key.temperature == float(temperature))
+            ]
+            for key in stale:
+                del self._entries[key]
+                self._holders.pop(key, None)
+        return len(stale)
+
+    def stats(self):
+        """Cache size and warm/cold construction timings in milliseconds"""
+        def average(values):
+            return 1000 * sum(values) / len(values) if values else None
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "cold_builds": self.cold_builds,
+                "warm_hits": self.warm_hits,
+                "cold_ms": average(self.cold),
+                "last_cold_ms": 1000 * self.cold[-1] if self.cold else None,
+                "warm_ms": average(self.warm),
+            }
+
+    def close(self):
+        """Drop every agent and close the shared HTTP clients"""
+        self.invalidate()
+        if self._http_client is not None:
+            self._http_client.close()
+            # The async client's connections belong to the runner's loop, so it is closed there
+            runner.run_coroutine(self._http_async_client.aclose())
+            self._http_client = self._http_async_client = None
+
+
+agent_factory = AgentFactory()
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from accelerator import acceleration_scope, acceleration_settings
+from llm_gateway import INTERACTIVE, current_priority
+from query_guard import CancelScope, cancel_scope, guard_scope, guard_settings
+from result_cache import caching_enabled, caching_scope
+from result_capture import capture_results
+from tracing import record_trace, start_trace, tracing_handler
+
+MAX_CONCURRENT_RUNS = int(os.environ.get("SQL_CHAT_MAX_CONCURRENT_RUNS", "4"))
+DEFAULT_TIMEOUT = 120
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+
+class AgentRun:
+    """Handle to one question running on the background loop"""
+
+    def __init__(self, question, timeout, trace=None, tags=None):
+        self.id = uuid.uuid4().hex[:8]
+        self.question = question
+        self.timeout = timeout
+        self.trace = trace
+        self.tags = tags or {}
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.steps = []
+        self.answer_text = ""
+        self.future = None
+        self.scope = CancelScope()
+        # The submitter's guard settings; the loop's tasks do not inherit its context
+        self.guard = guard_settings()
+        self.acceleration = acceleration_settings()
+        self.caching = caching_enabled()
+
+    @property
+    def status(self):
+        if self.future.done():
+            return "done"
+        return "running" if self.started_at else "queued"
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        """(output, ResultCapture); raises CancelledError or TimeoutError"""
+        return self.future.result(timeout)
+
+    def cancel(self):
+        """Cancel the run; the asyncio task is cancelled too, aborting any in-flight LLM request,
+        and SQL it is running is stopped on the database server"""
+        self.scope.cancel()
+        return self.future.cancel()
+
+    @property
+    def elapsed(self):
+        end = self.finished_at or time.time()
+        return end - self.submitted_at
+
+
+class RunEventHandler(AsyncCallbackHandler):
+    """Records tool steps and streams the tokens that follow 'Final Answer:'"""
+
+    def __init__(self, run):
+        self.run = run
+        self._buffers = {}
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._buffers[run_id] = ""
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._buffers[run_id] = ""
+
+    async def on_llm_new_token(self, token, *, run_id, **kwargs):
+        before = self._buffers.get(run_id, "")
+        text = before + token
+        self._buffers[run_id] = text
+        marker = text.find(FINAL_ANSWER_MARKER)
+        if marker == -1:
+            return
+        new = text[max(marker + len(FINAL_ANSWER_MARKER), len(before)):]
+        self.run.answer_text += new if self.run.answer_text else new.lstrip()
+
+    async def on_agent_action(self, action, **kwargs):
+        self.run.steps.append(f"🔧 **{action.tool}**: `{str(action.tool_input).strip()[:300]}`")
+
+    async def on_tool_end(self, output, **kwargs):
+        self.run.steps.append(f"↳ {str(output)[:300]}")
+
+    async def on_tool_error(self, error, **kwargs):
+        self.run.steps.append(f"⚠️ {error}")
+
+
+class AgentRunner:
+    """Background asyncio loop that runs agent questions with a process-wide concurrency limit"""
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_RUNS):
+        self.max_concurrent = max_concurrent
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self.active = 0
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name="agent-runner", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _serve(self):
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _execute(self, run, work):
+        async with self._semaphore:
+            run.started_at = time.time()
+            self.active += 1
+            # The run's LLM requests, including those made on worker threads, queue at its priority
+            current_priority.set(run.tags.get("priority", INTERACTIVE))
+            try:
+                with start_trace(run.question, run.trace, **run.tags) as trace, capture_results() as capture, \
+                        cancel_scope(run.scope), guard_scope(run.guard), acceleration_scope(run.acceleration), \
+                        caching_scope(run.caching):
+                    run.trace = trace
+                    try:
+                        output = await asyncio.wait_for(work(RunEventHandler(run)), run.timeout)
+                    except (asyncio.TimeoutError, asyncio.CancelledError):
+                        # Tool threads outlive the task; their statements are stopped on the server
+                        run.scope.cancel()
+                        raise
+                return output, capture
+            finally:
+                self.active -= 1
+                run.finished_at = time.time()
+                if run.trace is not None:
+                    record_trace(run.trace)
+
+    def run_coroutine(self, coro, timeout=None):
+        """Run coro on the background loop from another thread and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def submit(self, question, work, timeout=DEFAULT_TIMEOUT, trace=None, tags=None):
+        """Schedule work(handler) -> awaitable answer text; returns an AgentRun
+
+        The run is traced; pass trace to continue one started by the caller.
+        """
+        run = AgentRun(question, timeout, trace, tags)
+        run.future = asyncio.run_coroutine_threadsafe(self._execute(run, work), self._loop)
+        return run
+
+    def submit_agent(self, agent, question, agent_input=None, timeout=DEFAULT_TIMEOUT, trace=None, tags=None):
+        """Run a LangChain AgentExecutor through its async API with token streaming
+
+        agent_input may be a callable; it is then evaluated on a worker thread
+        as part of the run, so schema retrieval does not block the caller.
+        """
+        async def work(handler):
+            text = agent_input
+            if callable(text):
+                text = await asyncio.to_thread(text)
+            result = await agent.ainvoke({"input": text or question}, config={"callbacks": [handler, tracing_handler]})
+            return result["output"]
+        return self.submit(question, work, timeout, trace, tags)
+
+    def submit_sync(self, question, fn, timeout=DEFAULT_TIMEOUT, trace=None, tags=None):
+        """Run a blocking callable on a worker thread under the same limits"""
+        async def work(handler):
+            return await asyncio.to_thread(fn)
+        return self.submit(question, work, timeout, trace, tags)
+
+
+runner = AgentRunner()
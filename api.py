@@ -0,0 +1,326 @@
+import io
+import json
+import os
+from concurrent.futures import CancelledError
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+
+import pyarrow as pa
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from agent_factory import agent_factory
+from agent_runner import DEFAULT_TIMEOUT, runner
+from engine import AGENT_MODE, DEFAULT_TEMPERATURE, MODELS, SINGLE_SHOT_MODE, connect_from_env, get_engine
+from history_store import PAGE_SIZE
+from llm_gateway import INTERACTIVE, PRIORITIES, gateway
+from result_cache import result_cache
+
+# Rows of an answer's result inlined in a JSON response; use format=arrow for all of them
+ANSWER_JSON_ROWS = 1000
+SQL_MAX_ROWS = 1_000_000
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+# cursor.description type codes with a fixed Arrow type: psycopg2 type OIDs and pymysql FIELD_TYPE codes.
+# NUMERIC/DECIMAL arrive as floats (result_stream._to_frame); SQLite reports no types at all.
+CURSOR_TYPES = {
+    "postgresql": {
+        16: pa.bool_(), 20: pa.int64(), 21: pa.int64(), 23: pa.int64(), 700: pa.float64(), 701: pa.float64(),
+        1700: pa.float64(), 25: pa.string(), 1042: pa.string(), 1043: pa.string(), 1082: pa.date32(),
+        1114: pa.timestamp("us"),
+    },
+    "mysql": {
+        0: pa.float64(), 1: pa.int64(), 2: pa.int64(), 3: pa.int64(), 4: pa.float64(), 5: pa.float64(),
+        8: pa.int64(), 9: pa.int64(), 246: pa.float64(), 10: pa.date32(), 7: pa.timestamp("us"),
+        12: pa.timestamp("us"), 15: pa.string(), 253: pa.string(), 254: pa.string(),
+    },
+}
+
+
+def _error(status, message):
+    return JSONResponse({"error": message}, status_code=status)
+
+
+def _authorized(request):
+    """Bearer token check, enabled by setting SQL_CHAT_API_TOKEN"""
+    token = os.environ.get("SQL_CHAT_API_TOKEN")
+    return not token or request.headers.get("authorization") == f"Bearer {token}"
+
+
+def protected(handler):
+    async def endpoint(request):
+        if not _authorized(request):
+            return _error(401, "Missing or invalid bearer token")
+        try:
+            return await handler(request)
+        except json.JSONDecodeError:
+            return _error(400, "Request body must be JSON")
+        except ValueError as e:
+            return _error(400, str(e))
+    return endpoint
+
+
+def _unique_names(columns):
+    """Column names made unique for Arrow ("id", "id_2"), which rejects SELECT a.id, b.id as is"""
+    names, seen = [], set()
+    for column in map(str, columns):
+        name, n = column, 1
+        while name in seen:
+            n += 1
+            name = f"{column}_{n}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def _cursor_type(dialect, code):
+    """Arrow type for a DB-API type code, or None to infer it from the values"""
+    return CURSOR_TYPES.get(dialect, {}).get(code)
+
+
+def _arrow_schema(columns, types, first_chunk=None):
+    """Schema fixed before any batch is written: cursor types first, then the first chunk's values, else text
+
+    The first chunk alone would give an all-NULL column the null type, which later chunks cannot fill.
+    """
+    inferred = {}
+    if first_chunk is not None:
+        for field in pa.Schema.from_pandas(first_chunk, preserve_index=False):
+            inferred[field.name] = field.type
+    fields = []
+    for name, kind in zip(columns, types):
+        kind = kind or inferred.get(name)
+        fields.append(pa.field(name, pa.string() if kind is None or pa.types.is_null(kind) else kind))
+    return pa.schema(fields)
+
+
+def _conform(chunk, schema):
+    """chunk as a table of schema; text columns take values of any type (SQLite typing is per value)"""
+    try:
+        return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        chunk = chunk.copy()
+        for field in schema:
+            if pa.types.is_string(field.type):
+                chunk[field.name] = chunk[field.name].map(lambda value: value if value is None or value != value else str(value))
+        return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def _arrow_stream(chunks, columns, metadata=None, types=None):
+    """Arrow IPC stream bytes, one record batch per chunk, written as chunks arrive
+
+    types are Arrow types per column (None to infer); the schema cannot change once the
+    response has started, so it is settled before the first batch.
+    """
+    names = _unique_names(columns)
+    types = list(types or []) + [None] * (len(names) - len(types or []))
+    sink, writer, schema = io.BytesIO(), None, None
+    for chunk in chunks:
+        chunk = chunk.set_axis(names, axis=1)
+        if writer is None:
+            schema = _arrow_schema(names, types, chunk).with_metadata(metadata or {})
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_table(_conform(chunk, schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    if writer is None:
+        writer = pa.ipc.new_stream(sink, _arrow_schema(names, types).with_metadata(metadata or {}))
+    writer.close()
+    yield sink.getvalue()
+
+
+def _chunks(stream):
+    """Chunks of a ResultStream, giving its connection back even if the client disconnects early"""
+    try:
+        yield from stream.iter_chunks()
+    finally:
+        stream.close()
+
+
+def _json_stream(stream):
+    """One JSON document whose rows are written chunk by chunk, with totals at the end"""
+    yield '{"columns": ' + json.dumps([str(column) for column in stream.columns]) + ', "rows": ['
+    first = True
+    for chunk in _chunks(stream):
+        rows = chunk.to_json(orient="values", date_format="iso")[1:-1]
+        if rows:
+            yield ("" if first else ",") + rows
+            first = False
+    yield '], ' + json.dumps({
+        "row_count": stream.row_count,
+        "truncated": stream.truncated,
+        "duration": stream.duration,
+        "error": stream.error,
+    })[1:]
+
+
+def _answer_json(answer, max_rows=ANSWER_JSON_ROWS):
+    frame = answer.result.frame if answer.result is not None else None
+    payload = {
+        "question": answer.question,
+        "answer": answer.answer,
+        "sql": answer.sql,
+        "mode": answer.mode,
+        "execution_time": answer.execution_time,
+        "cache_similarity": answer.cache_hit.similarity if answer.cache_hit else None,
+        "trace_id": answer.trace.trace_id if answer.trace else None,
+        "timings": answer.trace.summary() if answer.trace else "",
+        "columns": [],
+        "rows": [],
+        "row_count": 0,
+        "truncated": False,
+    }
+    if frame is not None:
+        payload.update(
+            columns=[str(column) for column in frame.columns],
+            rows=json.loads(frame.head(max_rows).to_json(orient="values", date_format="iso")),
+            row_count=len(frame),
+            truncated=answer.result.truncated or len(frame) > max_rows,
+        )
+    return payload
+
+
+@protected
+async def ask(request):
+    body = await request.json()
+    question = (body.get("question") or "").strip()
+    if not question:
+        raise ValueError("question is required")
+    mode = body.get("mode", AGENT_MODE)
+    if mode not in (AGENT_MODE, SINGLE_SHOT_MODE):
+        raise ValueError(f"mode must be '{AGENT_MODE}' or '{SINGLE_SHOT_MODE}'")
+    priority = body.get("priority", INTERACTIVE)
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    engine = request.app.state.engine
+    if not engine.api_key:
+        return _error(503, "No Groq API key configured; set GROQ_API_KEY")
+
+    try:
+        answer = await run_in_threadpool(
+            engine.ask, question, mode, float(body.get("timeout", DEFAULT_TIMEOUT)), bool(body.get("use_cache", True)), priority
+        )
+    except TimeoutError:
+        return _error(504, "The question timed out")
+    except CancelledError:
+        return _error(503, "The question was cancelled")
+    except Exception as e:
+        return _error(500, f"Error processing query: {e}")
+
+    if body.get("format") == "arrow":
+        frame = answer.result.frame if answer.result is not None else None
+        metadata = {"answer": answer.answer, "sql": json.dumps(answer.sql)}
+        chunks = [frame] if frame is not None else []
+        columns = frame.columns if frame is not None else []
+        return StreamingResponse(_arrow_stream(chunks, columns, metadata), media_type=ARROW_MIME)
+    return JSONResponse(_answer_json(answer))
+
+
+@protected
+async def run_sql(request):
+    body = await request.json()
+    sql = (body.get("sql") or "").strip()
+    if not sql:
+        raise ValueError("sql is required")
+    max_rows = min(int(body.get("max_rows", SQL_MAX_ROWS)), SQL_MAX_ROWS)
+    engine = request.app.state.engine
+    # Opening runs the statement; rejections and errors surface before any bytes are sent
+    stream = await run_in_threadpool(engine.run_sql, sql, max_rows)
+    if stream.error:
+        return _error(400, stream.error)
+    if body.get("format") == "arrow":
+        types = [_cursor_type(stream.db.dialect, code) for code in stream.type_codes]
+        return StreamingResponse(_arrow_stream(_chunks(stream), stream.columns, types=types), media_type=ARROW_MIME)
+    return StreamingResponse(_json_stream(stream), media_type="application/json")
+
+
+@protected
+async def explain(request):
+    body = await request.json()
+    sql = (body.get("sql") or "").strip()
+    if not sql:
+        raise ValueError("sql is required")
+    report = await run_in_threadpool(request.app.state.engine.explain, sql, bool(body.get("analyze", False)))
+    if report.error:
+        return _error(400, report.error)
+    return JSONResponse(asdict(report))
+
+
+@protected
+async def indexes(request):
+    candidates = await run_in_threadpool(request.app.state.engine.index_candidates)
+    return JSONResponse([{
+        "table": candidate.table,
+        "columns": list(candidate.columns),
+        "ddl": candidate.ddl,
+        "runs": candidate.runs,
+        "total_time": candidate.total_time,
+        "table_rows": candidate.table_rows,
+        "reasons": candidate.reasons,
+        "statements": candidate.statements,
+    } for candidate in candidates])
+
+
+@protected
+async def stats(request):
+    return JSONResponse(await run_in_threadpool(request.app.state.engine.statistics))
+
+
+@protected
+async def history(request):
+    params = request.query_params
+    entries = await run_in_threadpool(
+        request.app.state.engine.history,
+        params.get("q"),
+        params.get("favorites") in ("1", "true"),
+        min(int(params.get("limit", PAGE_SIZE)), 100),
+        int(params.get("offset", 0)),
+    )
+    return JSONResponse([asdict(entry) for entry in entries])
+
+
+async def health(request):
+    engine = request.app.state.engine
+    return JSONResponse({
+        "status": "ok",
+        "pid": os.getpid(),
+        "dialect": engine.db.dialect,
+        "model": engine.model,
+        "llm_configured": bool(engine.api_key),
+        "active_runs": runner.active,
+        "max_concurrent_runs": runner.max_concurrent,
+        "agent_factory": agent_factory.stats(),
+        "llm_gateway": gateway.stats(),
+        "result_cache": result_cache.stats(engine.db),
+    })
+
+
+def create_engine_from_env():
+    """Engine for the database and model named in the environment, shared by this worker's requests"""
+    model = os.environ.get("SQL_CHAT_MODEL", MODELS[0])
+    temperature = float(os.environ.get("SQL_CHAT_TEMPERATURE", DEFAULT_TEMPERATURE))
+    return get_engine(connect_from_env(), os.environ.get("GROQ_API_KEY"), model, temperature, verbose=False)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Each worker process connects once at startup; requests share its pools and caches
+    app.state.engine = await run_in_threadpool(create_engine_from_env)
+    yield
+    await run_in_threadpool(agent_factory.close)
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health),
+        Route("/ask", ask, methods=["POST"]),
+        Route("/sql", run_sql, methods=["POST"]),
+        Route("/explain", explain, methods=["POST"]),
+        Route("/indexes", indexes),
+        Route("/stats", stats),
+        Route("/history", history),
+    ],
+    lifespan=lifespan,
+)
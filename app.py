@@ -1,27 +1,36 @@
 import streamlit as st
-from pathlib import Path
-from langchain.agents import create_sql_agent
-from langchain.sql_database import SQLDatabase
-from langchain.agents.agent_types import AgentType
-from langchain.callbacks import StreamlitCallbackHandler
-from langchain.agents.agent_toolkits import SQLDatabaseToolkit
-from sqlalchemy import create_engine, text
-import sqlite3
-from langchain_groq import ChatGroq
+from sqlalchemy import text
 import psycopg2
 import os
-import tempfile
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import json
 import time
-from datetime import datetime
-import re
-import io
-import base64
+import uuid
+from concurrent.futures import CancelledError
 from urllib.parse import urlparse
+from connections import DEFAULT_POOL_SETTINGS, database_identity
+from sample_db import BASE_STUDENTS, SCALE_FACTORS
+from db_stats import stats_cache
+from agent_runner import runner
+from batch import BatchResult, iter_batch, parse_batch
+from direct_sql import explain_result, open_readonly_stream
+from result_stream import DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS
+from exports import EXCEL_MAX_ROWS, ExportStore, available_formats
+from message_store import MessageStore
+from history_store import PAGE_SIZE as HISTORY_PAGE_SIZE, history_store
+from tracing import record_trace, start_trace, to_otlp_json, trace_store
+from visualization import build_visualization
+from schema_context import get_schema_snapshot
+from accelerator import DEFAULT_MAX_AGE as SNAPSHOT_MAX_AGE, AccelerationSettings, enable_acceleration, use_acceleration
+from agent_factory import agent_factory
+from llm_gateway import BATCH, INTERACTIVE, gateway
+from query_guard import DEFAULT_GUARD_ROWS, DEFAULT_STATEMENT_TIMEOUT, LIMIT, REFUSE, GuardSettings, use_guard_settings
+from result_cache import result_cache
+from optimizer import explain as explain_plan, suggest_indexes, trial_index
+from engine import AGENT_MODE, LOCALDB, MODELS, MYSQL, POSTGRES, POSTGRES_URL, SINGLE_SHOT_MODE, SQLITE_FILE, connect_database, get_engine
 
 # Page configuration
 st.set_page_config(
@@ -79,24 +88,22 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Database connection constants
-POSTGRES = "POSTGRES"
-POSTGRES_URL = "POSTGRES_URL"
-LOCALDB = "USE_LOCALDB"
-MYSQL = "USE_MYSQL"
-SQLITE_FILE = "SQLITE_FILE"
+# Chat turns rendered on each rerun; older turns load on request
+VISIBLE_MESSAGES = 20
 
 # Initialize session state
 if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "query_history" not in st.session_state:
-    st.session_state.query_history = []
+    st.session_state.messages = MessageStore()
+if "visible_messages" not in st.session_state:
+    st.session_state.visible_messages = VISIBLE_MESSAGES
 if "db_stats" not in st.session_state:
     st.session_state.db_stats = {}
-if "favorite_queries" not in st.session_state:
-    st.session_state.favorite_queries = []
-if "export_data" not in st.session_state:
-    st.session_state.export_data = []
+if "export_store" not in st.session_state:
+    st.session_state.export_store = ExportStore()
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "connected_identities" not in st.session_state:
+    st.session_state.connected_identities = []
 
 # Sidebar configuration
 with st.sidebar:
@@ -163,14 +170,31 @@ with st.sidebar:
     elif "Upload SQLite" in selected_opt:
         db_uri = SQLITE_FILE
         uploaded_file = st.file_uploader("Upload SQLite Database", type=['db', 'sqlite', 'sqlite3'])
+        st.caption("Uploaded databases are opened read-only")
         mysql_host = mysql_user = mysql_password = mysql_db = mysql_port = None
         postgres_url = None
         
     else:  # Sample SQLite
         db_uri = LOCALDB
+        sample_scale = st.selectbox(
+            "Sample Data Scale",
+            SCALE_FACTORS,
+            format_func=lambda scale: f"{scale}x ({scale * BASE_STUDENTS:,} students)",
+            help="Larger scales generate proportionally more students, enrollments and payments for load testing"
+        )
         mysql_host = mysql_user = mysql_password = mysql_db = mysql_port = None
         postgres_url = None
     
+    pool_settings = None
+    if db_uri in [MYSQL, POSTGRES, POSTGRES_URL]:
+        with st.expander("🏊 Connection Pool Settings"):
+            pool_settings = {
+                "pool_size": st.number_input("Pool Size", 1, 50, DEFAULT_POOL_SETTINGS["pool_size"], help="Connections kept open in the pool"),
+                "max_overflow": st.number_input("Max Overflow", 0, 100, DEFAULT_POOL_SETTINGS["max_overflow"], help="Extra connections allowed above the pool size"),
+                "pool_pre_ping": st.checkbox("Pre-ping Connections", DEFAULT_POOL_SETTINGS["pool_pre_ping"], help="Test connections before use (recommended for Neon, which sleeps when idle)"),
+                "pool_recycle": st.number_input("Recycle After (seconds)", -1, 86400, DEFAULT_POOL_SETTINGS["pool_recycle"], help="Replace connections older than this; -1 disables recycling"),
+            }
+    
     st.divider()
     
     # Connection examples
@@ -201,17 +225,31 @@ with st.sidebar:
     st.subheader("🤖 AI Configuration")
     api_key = st.text_input("Groq API Key", type="password", help="Get your API key from https://console.groq.com/")
     
-    model_options = ["llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768"]
-    selected_model = st.selectbox("Select Model", model_options)
+    selected_model = st.selectbox("Select Model", MODELS)
     
     temperature = st.slider("Response Creativity", 0.0, 1.0, 0.1, 0.1, help="Higher values make responses more creative")
     
+    answer_modes = ["Agent (multi-step)", "Single-shot SQL (fastest)"]
+    query_timeout = st.number_input("Query Timeout (seconds)", 10, 600, 120, 10, help="Questions still running after this are cancelled")
+    answer_mode = st.selectbox("Answer Mode", answer_modes, help="Single-shot writes the SQL in one LLM call from the cached schema and runs it once; the agent can explore and self-correct over several steps")
+    
     st.divider()
     
     st.subheader("🎯 Features")
     auto_visualize = st.checkbox("Auto-generate Charts", True, help="Automatically create visualizations for numeric data")
     show_sql = st.checkbox("Show Generated SQL", False, help="Display the SQL queries generated by AI")
     enable_exports = st.checkbox("Enable Data Export", True, help="Allow exporting query results")
+    result_memory_budget = st.number_input("Result Memory Budget (MB)", 16, 4096, DEFAULT_MAX_BYTES // (1024 * 1024), 16, help="Direct SQL stops fetching rows once a result uses this much memory")
+    result_row_budget = st.number_input("Result Row Budget", 1000, 10_000_000, DEFAULT_MAX_ROWS, 1000, help="Direct SQL stops fetching rows after this many")
+    use_query_cache = st.checkbox("Use Query Cache", True, help="Answer repeated or near-identical questions from cache by re-running their stored SQL, without calling the LLM")
+    accelerate = st.checkbox("Accelerate Analytics with DuckDB", False, help="Answer read-only aggregate queries from a local columnar DuckDB snapshot of the selected tables; other queries still go to the database")
+    snapshot_max_age = st.number_input("Snapshot Max Age (minutes)", 1, 1440, SNAPSHOT_MAX_AGE // 60, 1, help="Older snapshots are refreshed in the background and queries use the database until they are ready", disabled=not accelerate)
+    guard_queries = st.checkbox("Guard Expensive Queries", True, help="Estimate every SELECT with the database's EXPLAIN before running it, and limit or refuse those above the thresholds")
+    guard_actions = ["Add a LIMIT", "Refuse"]
+    guard_action = st.selectbox("Over the Row Threshold", guard_actions, disabled=not guard_queries)
+    guard_max_rows = st.number_input("Row Threshold", 100, 10_000_000, DEFAULT_GUARD_ROWS, 1000, help="Queries estimated to return more rows than this are limited or refused", disabled=not guard_queries)
+    guard_max_cost = st.number_input("Max Estimated Cost", 0, 10_000_000_000, 0, 1_000_000, help="Queries whose planner cost is above this are refused (rows visited on SQLite); 0 uses the database's default", disabled=not guard_queries)
+    statement_timeout = st.number_input("Statement Timeout (seconds)", 0, 3600, int(DEFAULT_STATEMENT_TIMEOUT), 5, help="The database stops any single SQL statement running longer than this; 0 disables it")
     
     st.subheader("📝 Quick Templates")
     templates = {
@@ -243,249 +281,10 @@ if db_uri == SQLITE_FILE and not uploaded_file:
     st.warning("⚠️ Please upload a SQLite database file")
     st.stop()
 
-def create_enhanced_sample_db():
-    """Create a comprehensive sample database with multiple tables and realistic data"""
-    db_path = Path(tempfile.gettempdir()) / "enhanced_sample.db"
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Students table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS students (
-            student_id INTEGER PRIMARY KEY,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            email TEXT UNIQUE,
-            phone TEXT,
-            date_of_birth DATE,
-            enrollment_date DATE,
-            gpa REAL,
-            major TEXT,
-            year_level INTEGER,
-            status TEXT DEFAULT 'Active',
-            address TEXT,
-            city TEXT,
-            state TEXT,
-            zip_code TEXT
-        )
-    ''')
-    
-    # Courses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS courses (
-            course_id INTEGER PRIMARY KEY,
-            course_code TEXT UNIQUE NOT NULL,
-            course_name TEXT NOT NULL,
-            department TEXT,
-            credits INTEGER,
-            instructor_id INTEGER,
-            semester TEXT,
-            year INTEGER,
-            capacity INTEGER,
-            enrolled_count INTEGER DEFAULT 0,
-            course_fee REAL
-        )
-    ''')
-    
-    # Instructors table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS instructors (
-            instructor_id INTEGER PRIMARY KEY,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            email TEXT UNIQUE,
-            department TEXT,
-            hire_date DATE,
-            salary REAL,
-            office_location TEXT
-        )
-    ''')
-    
-    # Enrollments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS enrollments (
-            enrollment_id INTEGER PRIMARY KEY,
-            student_id INTEGER,
-            course_id INTEGER,
-            enrollment_date DATE,
-            grade TEXT,
-            points REAL,
-            status TEXT DEFAULT 'Enrolled',
-            FOREIGN KEY (student_id) REFERENCES students (student_id),
-            FOREIGN KEY (course_id) REFERENCES courses (course_id)
-        )
-    ''')
-    
-    # Payments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payments (
-            payment_id INTEGER PRIMARY KEY,
-            student_id INTEGER,
-            amount REAL,
-            payment_date DATE,
-            payment_method TEXT,
-            semester TEXT,
-            year INTEGER,
-            status TEXT DEFAULT 'Completed',
-            FOREIGN KEY (student_id) REFERENCES students (student_id)
-        )
-    ''')
-    
-    import random
-    from datetime import date, timedelta
-    
-    # Insert sample data
-    instructors_data = [
-        ('Dr. Sarah', 'Johnson', 'sarah.johnson@university.edu', 'Computer Science', '2018-08-15', 75000, 'CS-201'),
-        ('Prof. Michael', 'Brown', 'michael.brown@university.edu', 'Mathematics', '2015-01-10', 68000, 'MATH-105'),
-        ('Dr. Emily', 'Davis', 'emily.davis@university.edu', 'Physics', '2019-09-01', 72000, 'PHYS-301'),
-        ('Prof. James', 'Wilson', 'james.wilson@university.edu', 'Chemistry', '2016-03-20', 70000, 'CHEM-202'),
-        ('Dr. Lisa', 'Anderson', 'lisa.anderson@university.edu', 'English', '2017-08-25', 65000, 'ENG-101')
-    ]
-    cursor.executemany('INSERT OR REPLACE INTO instructors (first_name, last_name, email, department, hire_date, salary, office_location) VALUES (?, ?, ?, ?, ?, ?, ?)', instructors_data)
-    
-    majors = ['Computer Science', 'Mathematics', 'Physics', 'Chemistry', 'English', 'Biology', 'Economics', 'Psychology']
-    states = ['CA', 'NY', 'TX', 'FL', 'IL', 'PA', 'OH', 'GA', 'NC', 'MI']
-    
-    students_data = []
-    for i in range(1, 51):
-        first_names = ['Alice', 'Bob', 'Carol', 'David', 'Eve', 'Frank', 'Grace', 'Henry', 'Iris', 'Jack']
-        last_names = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez']
-        
-        first_name = random.choice(first_names) + str(i)
-        last_name = random.choice(last_names)
-        email = f"{first_name.lower()}.{last_name.lower()}@student.edu"
-        phone = f"555-{random.randint(100, 999)}-{random.randint(1000, 9999)}"
-        birth_date = date(2000 + random.randint(-2, 2), random.randint(1, 12), random.randint(1, 28))
-        enrollment_date = date(2020 + random.randint(0, 4), random.choice([1, 8]), random.randint(15, 30))
-        gpa = round(random.uniform(2.0, 4.0), 2)
-        major = random.choice(majors)
-        year_level = random.randint(1, 4)
-        address = f"{random.randint(100, 9999)} {random.choice(['Main', 'Oak', 'Pine', 'Elm'])} St"
-        city = random.choice(['Springfield', 'Riverside', 'Franklin', 'Georgetown', 'Madison'])
-        state = random.choice(states)
-        zip_code = f"{random.randint(10000, 99999)}"
-        
-        students_data.append((i, first_name, last_name, email, phone, birth_date, enrollment_date, 
-                           gpa, major, year_level, 'Active', address, city, state, zip_code))
-    
-    cursor.executemany('INSERT OR REPLACE INTO students VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', students_data)
-    
-    courses_data = [
-        (1, 'CS101', 'Introduction to Programming', 'Computer Science', 3, 1, 'Fall', 2024, 30, 25, 1200),
-        (2, 'MATH201', 'Calculus II', 'Mathematics', 4, 2, 'Fall', 2024, 25, 20, 800),
-        (3, 'PHYS301', 'Quantum Physics', 'Physics', 3, 3, 'Spring', 2024, 20, 15, 1000),
-        (4, 'CHEM202', 'Organic Chemistry', 'Chemistry', 4, 4, 'Fall', 2024, 28, 22, 1100),
-        (5, 'ENG101', 'English Composition', 'English', 3, 5, 'Fall', 2024, 35, 30, 600),
-        (6, 'CS301', 'Data Structures', 'Computer Science', 3, 1, 'Spring', 2024, 25, 18, 1200),
-        (7, 'MATH301', 'Linear Algebra', 'Mathematics', 3, 2, 'Spring', 2024, 20, 16, 800),
-        (8, 'PHYS201', 'Classical Mechanics', 'Physics', 4, 3, 'Fall', 2024, 22, 19, 1000)
-    ]
-    cursor.executemany('INSERT OR REPLACE INTO courses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', courses_data)
-    
-    # Generate enrollments and payments data
-    enrollments_data = []
-    grades = ['A', 'A-', 'B+', 'B', 'B-', 'C+', 'C', 'C-', 'D+', 'D']
-    grade_points = {'A': 4.0, 'A-': 3.7, 'B+': 3.3, 'B': 3.0, 'B-': 2.7, 'C+': 2.3, 'C': 2.0, 'C-': 1.7, 'D+': 1.3, 'D': 1.0}
-    
-    enrollment_id = 1
-    for student_id in range(1, 51):
-        num_courses = random.randint(3, 5)
-        enrolled_courses = random.sample(range(1, 9), num_courses)
-        
-        for course_id in enrolled_courses:
-            enrollment_date = date(2024, random.choice([1, 8]), random.randint(10, 20))
-            grade = random.choice(grades)
-            points = grade_points[grade]
-            
-            enrollments_data.append((enrollment_id, student_id, course_id, enrollment_date, grade, points, 'Completed'))
-            enrollment_id += 1
-    
-    cursor.executemany('INSERT OR REPLACE INTO enrollments VALUES (?, ?, ?, ?, ?, ?, ?)', enrollments_data)
-    
-    payments_data = []
-    payment_methods = ['Credit Card', 'Bank Transfer', 'Cash', 'Check', 'Financial Aid']
-    
-    for i, student_id in enumerate(range(1, 51)):
-        num_payments = random.randint(2, 4)
-        for j in range(num_payments):
-            payment_id = i * 4 + j + 1
-            amount = random.uniform(500, 2000)
-            payment_date = date(2024, random.randint(1, 12), random.randint(1, 28))
-            method = random.choice(payment_methods)
-            semester = random.choice(['Fall', 'Spring', 'Summer'])
-            year = 2024
-            
-            payments_data.append((payment_id, student_id, amount, payment_date, method, semester, year, 'Completed'))
-    
-    cursor.executemany('INSERT OR REPLACE INTO payments VALUES (?, ?, ?, ?, ?, ?, ?, ?)', payments_data)
-    
-    conn.commit()
-    conn.close()
-    return db_path
-
-def validate_postgres_url(url):
-    """Validate PostgreSQL connection URL format"""
-    try:
-        parsed = urlparse(url)
-        if parsed.scheme not in ['postgresql', 'postgres']:
-            return False, "URL must start with 'postgresql://' or 'postgres://'"
-        if not parsed.hostname:
-            return False, "Missing hostname in URL"
-        if not parsed.username:
-            return False, "Missing username in URL"
-        if not parsed.password:
-            return False, "Missing password in URL"
-        return True, "Valid PostgreSQL URL"
-    except Exception as e:
-        return False, f"Invalid URL format: {str(e)}"
-
 def configure_database(db_uri, **kwargs):
-    """Enhanced database configuration with better error handling and URL support"""
+    """Connect through the engine, reporting failures in the page"""
     try:
-        if db_uri == LOCALDB:
-            dbfilepath = create_enhanced_sample_db()
-            creator = lambda: sqlite3.connect(f"file:{dbfilepath}?mode=rw", uri=True)
-            return SQLDatabase(create_engine("sqlite:///", creator=creator))
-        
-        elif db_uri == SQLITE_FILE:
-            uploaded_file = kwargs.get('uploaded_file')
-            if uploaded_file:
-                temp_path = Path(tempfile.gettempdir()) / f"uploaded_{uploaded_file.name}"
-                with open(temp_path, 'wb') as f:
-                    f.write(uploaded_file.read())
-                
-                creator = lambda: sqlite3.connect(f"file:{temp_path}?mode=rw", uri=True)
-                return SQLDatabase(create_engine("sqlite:///", creator=creator))
-        
-        elif db_uri == MYSQL:
-            connection_string = f"mysql+pymysql://{kwargs['mysql_user']}:{kwargs['mysql_password']}@{kwargs['mysql_host']}:{kwargs.get('mysql_port', 3306)}/{kwargs['mysql_db']}"
-            return SQLDatabase(create_engine(connection_string))
-        
-        elif db_uri == POSTGRES:
-            connection_string = f"postgresql+psycopg2://{kwargs['mysql_user']}:{kwargs['mysql_password']}@{kwargs['mysql_host']}:{kwargs.get('mysql_port', 5432)}/{kwargs['mysql_db']}"
-            return SQLDatabase(create_engine(connection_string))
-        
-        elif db_uri == POSTGRES_URL:
-            postgres_url = kwargs.get('postgres_url')
-            if not postgres_url:
-                raise Exception("PostgreSQL URL is required")
-            
-            # Validate URL format
-            is_valid, message = validate_postgres_url(postgres_url)
-            if not is_valid:
-                raise Exception(message)
-            
-            # Handle both 'postgres://' and 'postgresql://' schemes
-            if postgres_url.startswith('postgres://'):
-                postgres_url = postgres_url.replace('postgres://', 'postgresql://', 1)
-            
-            # Use psycopg2 driver
-            if '+psycopg2' not in postgres_url:
-                postgres_url = postgres_url.replace('postgresql://', 'postgresql+psycopg2://', 1)
-            
-            return SQLDatabase(create_engine(postgres_url))
-            
+        return connect_database(db_uri, **kwargs)
     except Exception as e:
         st.error(f"Database connection error: {str(e)}")
         return None
@@ -493,153 +292,219 @@ def configure_database(db_uri, **kwargs):
 def get_database_statistics(db):
     """Get comprehensive database statistics"""
     try:
-        stats = {}
-        table_names = db.get_usable_table_names()
-        stats['table_count'] = len(table_names)
-        stats['tables'] = {}
-        
-        for table in table_names:
-            try:
-                result = db.run(f"SELECT COUNT(*) FROM {table}")
-                if result:
-                    lines = result.strip().split('\n')
-                    row_count = 0
-                    for line in lines:
-                        import re
-                        numbers = re.findall(r'\d+', line)
-                        if numbers:
-                            row_count = int(numbers[0])
-                            break
-                else:
-                    row_count = 0
-                
-                try:
-                    if 'sqlite' in str(db._engine.url):
-                        columns_result = db.run(f"PRAGMA table_info({table})")
-                    else:
-                        columns_result = db.run(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table}'")
-                    
-                    if columns_result:
-                        column_count = len([line for line in columns_result.split('\n') if line.strip() and ('|' in line or column_count == 0)])
-                        column_count = max(0, column_count - 1 if column_count > 0 else 0)
-                    else:
-                        column_count = 0
-                except:
-                    column_count = 0
-                
-                stats['tables'][table] = {
-                    'row_count': max(0, row_count),
-                    'columns': max(0, column_count)
-                }
-            except Exception as e:
-                print(f"Error getting stats for table {table}: {e}")
-                stats['tables'][table] = {'row_count': 0, 'columns': 0}
-        
-        return stats
+        return stats_cache.get(db).to_dict()
     except Exception as e:
         print(f"Error getting database statistics: {e}")
         return {'table_count': 0, 'tables': {}}
 
-def create_visualization(query_result, query_text):
+def create_visualization(df, query_text):
     """Create intelligent visualizations based on query results"""
-    if not query_result or not auto_visualize:
+    if not auto_visualize:
         return None
-    
+    return build_visualization(df, query_text)
+
+def create_export(source, name):
+    """Spill a result to the session's export directory once; returns an ExportFile or None"""
     try:
-        lines = query_result.strip().split('\n')
-        if len(lines) < 3:
-            return None
-            
-        rows = []
-        headers = None
-        
-        for line in lines[1:]:
-            if line.strip() and '|' in line:
-                row = [cell.strip() for cell in line.split('|') if cell.strip()]
-                if headers is None:
-                    headers = row
-                else:
-                    rows.append(row)
-        
-        if not headers or not rows or len(rows) == 0:
-            return None
-            
-        df = pd.DataFrame(rows, columns=headers)
-        
-        # Convert numeric columns
-        for col in df.columns:
-            try:
-                df[col] = pd.to_numeric(df[col])
-            except:
-                pass
-        
-        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-        categorical_cols = df.select_dtypes(include=['object']).columns.tolist()
-        
-        fig = None
-        
-        if len(numeric_cols) >= 1 and len(categorical_cols) >= 1:
-            fig = px.bar(df, x=categorical_cols[0], y=numeric_cols[0], 
-                        title=f"{numeric_cols[0]} by {categorical_cols[0]}")
-            fig.update_layout(
-                height=400, 
-                showlegend=True,
-                xaxis_tickangle=45 if len(df) > 5 else 0
-            )
-        elif len(numeric_cols) >= 2:
-            fig = px.scatter(df, x=numeric_cols[0], y=numeric_cols[1],
-                           title=f"{numeric_cols[1]} vs {numeric_cols[0]}")
-            fig.update_layout(height=400, showlegend=True)
-        elif len(numeric_cols) == 1:
-            fig = px.histogram(df, x=numeric_cols[0], title=f"Distribution of {numeric_cols[0]}")
-            fig.update_layout(height=400, showlegend=True)
-        else:
-            if categorical_cols and len(categorical_cols) > 0:
-                value_counts = df[categorical_cols[0]].value_counts()
-                if len(value_counts) > 0:
-                    fig = px.bar(x=value_counts.index, y=value_counts.values,
-                               title=f"Count of {categorical_cols[0]}")
-                    fig.update_layout(
-                        height=400, 
-                        showlegend=True,
-                        xaxis_tickangle=45 if len(value_counts) > 5 else 0,
-                        xaxis_title=categorical_cols[0],
-                        yaxis_title="Count"
-                    )
-        
-        return fig
-        
+        return st.session_state.export_store.spill(source, name)
     except Exception as e:
+        st.warning(f"⚠️ Could not prepare export: {str(e)}")
         return None
 
-def export_to_csv(data, filename):
-    """Export data to CSV format"""
-    try:
-        df = pd.read_csv(io.StringIO(data))
-        csv = df.to_csv(index=False)
-        b64 = base64.b64encode(csv.encode()).decode()
-        href = f'<a href="data:file/csv;base64,{b64}" download="{filename}">📥 Download CSV</a>'
-        return href
-    except:
-        return None
+def render_downloads(export, reload=None):
+    """Download buttons that read the spilled file only when clicked
 
-def save_query_to_history(query, response, execution_time):
-    """Save query to history with metadata"""
-    history_item = {
-        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'query': query,
-        'response': response[:500] + "..." if len(response) > 500 else response,
-        'execution_time': execution_time,
-        'favorited': False
-    }
-    st.session_state.query_history.append(history_item)
+    reload() returns the result again if the spilled file has expired.
+    """
+    store = st.session_state.export_store
+    if not store.exists(export):
+        source = reload() if reload else None
+        try:
+            if source is None:
+                raise FileNotFoundError
+            store.restore(export, source)
+        except Exception:
+            st.caption("⌛ This export has expired; run the query again to download it")
+            return
+    formats = available_formats()
+    st.markdown(f"**📥 Export Options** ({export.rows:,} rows)")
+    columns = st.columns(len(formats))
+    for column, (key, fmt) in zip(columns, formats.items()):
+        with column:
+            st.download_button(
+                f"📥 {fmt.label}",
+                data=store.reader(export, key),
+                file_name=f"{export.name}{fmt.extension}",
+                mime=fmt.mime,
+                key=f"download_{export.export_id}_{key}",
+                on_click="ignore",
+                disabled=key == "xlsx" and export.rows > EXCEL_MAX_ROWS,
+                use_container_width=True,
+            )
+
+def render_stream_page(stream, key, page_sizes=(25, 50, 100, 500)):
+    """Show one page of a ResultStream, fetching further rows from the database only when paged to"""
+    size_col, page_col = st.columns([1, 1])
+    with size_col:
+        page_size = st.selectbox("Rows per page", page_sizes, key=f"{key}_page_size")
+    with page_col:
+        if stream.exhausted:
+            pages = max(1, -(-stream.row_count // page_size))
+            page = st.number_input(f"Page (of {pages})", 1, pages, 1, key=f"{key}_page")
+        else:
+            page = st.number_input("Page", 1, None, 1, key=f"{key}_page")
+    rows = stream.page(page - 1, page_size)
+    st.dataframe(rows, use_container_width=True)
+    
+    first = (page - 1) * page_size
+    total = f"{stream.row_count:,}" if stream.exhausted else f"{stream.row_count:,}+"
+    note = f"Rows {first + 1:,}–{first + len(rows):,} of {total}" if len(rows) else f"No rows on this page ({total} rows)"
+    note += f" · {stream.memory_bytes / 1024 / 1024:.1f} MB buffered · {stream.duration:.3f} seconds"
+    if stream.truncated:
+        note += " · stopped at the result budget"
+    st.caption(note)
+
+def save_query_to_history(query, response, execution_time, statements=None):
+    """Save query to the persistent history with metadata"""
+    engine.save_history(query, response, execution_time, statements)
+
+def render_history_page(key, favorites_only=False):
+    """Search box and one page of history entries from the history store"""
+    search_col, scope_col = st.columns([3, 1])
+    with search_col:
+        search_text = st.text_input("🔍 Search questions and SQL", key=f"{key}_search")
+    with scope_col:
+        this_db_only = st.checkbox(
+            "This database only", True, key=f"{key}_scope",
+            help="Untick to include every database connected in this session",
+        )
+    identity = db_identity if this_db_only else tuple(st.session_state.connected_identities)
     
-    if len(st.session_state.query_history) > 50:
-        st.session_state.query_history.pop(0)
+    if favorites_only and not search_text:
+        total = history_store.favorite_count(identity)
+    else:
+        total = history_store.count(search_text, identity, favorites_only)
+    if not total:
+        return [], 0
+    pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+    page = st.number_input(f"Page (of {pages}, {total:,} entries)", 1, pages, 1, key=f"{key}_page")
+    offset = (page - 1) * HISTORY_PAGE_SIZE
+    if favorites_only and not search_text:
+        return history_store.favorites(identity, HISTORY_PAGE_SIZE, offset), total
+    return history_store.search(search_text, identity, favorites_only, HISTORY_PAGE_SIZE, offset), total
+
+def render_answer(user_query, response, result, statements, execution_time, cache_hit=None, trace=None):
+    """Render an assistant answer with its data, chart and export, and record it in the chat"""
+    result_df = result.frame if result else None
+    
+    if cache_hit and not (cache_hit.similarity == 1.0 and result is not None and result.cached):
+        # The stored prose described another question or older rows; only the re-queried rows are current
+        rows = len(result_df) if result_df is not None else 0
+        response = f"Showing {rows} row(s) from the query cached for \"{cache_hit.question}\"."
+    
+    st.write("**Answer:**")
+    st.write(response)
+    if cache_hit:
+        if result is not None and result.cached:
+            st.caption(f"⚡ Answered from cache (similarity {cache_hit.similarity:.2f}); the tables behind the results below have not changed since they were cached")
+        else:
+            st.caption(f"⚡ Answered from cache (similarity {cache_hit.similarity:.2f}); the results below were re-queried just now")
+    
+    message_data = {"role": "assistant", "content": response}
+    if statements:
+        message_data["sql"] = statements
+        if show_sql:
+            for statement in statements:
+                st.code(statement, language='sql')
+    
+    if result_df is not None:
+        st.dataframe(result_df, use_container_width=True)
+        message_data["data"] = result_df
+    
+    # Create visualization
+    viz = create_visualization(result_df, user_query)
+    
+    if viz:
+        st.subheader("📊 Data Visualization")
+        st.plotly_chart(viz, use_container_width=True)
+        message_data["visualization"] = viz
+    
+    # Export option
+    if enable_exports and result_df is not None:
+        export = create_export(result_df, f"query_result_{int(time.time())}")
+        if export:
+            render_downloads(export)
+            message_data["export"] = export
+    
+    save_query_to_history(user_query, response, execution_time, statements)
+    st.info(f"⏱️ Query executed in {execution_time:.2f} seconds")
+    if trace and trace.summary():
+        st.caption(f"🔍 {trace.summary()}")
+    
+    st.session_state.messages.append(message_data)
+
+def start_agent_run(user_query, trace=None, priority=INTERACTIVE):
+    """Submit a question to the background agent runner"""
+    mode = SINGLE_SHOT_MODE if answer_mode == answer_modes[1] else AGENT_MODE
+    return engine.submit(user_query, mode, query_timeout, trace, priority=priority)
+
+def follow_agent_run(run):
+    """Stream progress of a background run into the page, then render its answer"""
+    cancel_slot = st.empty()
+    if cancel_slot.button("⏹️ Cancel", key=f"cancel_{run.id}"):
+        run.cancel()
+    
+    status = st.status("🤖 AI is analyzing your query...", expanded=False)
+    answer_slot = st.empty()
+    shown_steps = 0
+    while True:
+        finished = run.done()
+        for step in run.steps[shown_steps:]:
+            status.markdown(step)
+        shown_steps = len(run.steps)
+        if run.status == "queued":
+            status.update(label="⏳ Waiting for a free agent slot...")
+        else:
+            status.update(label=f"🤖 AI is analyzing your query... ({run.elapsed:.0f}s)")
+        if run.answer_text:
+            answer_slot.markdown(run.answer_text + "▌")
+        if finished:
+            break
+        time.sleep(0.1)
+    
+    cancel_slot.empty()
+    answer_slot.empty()
+    del st.session_state.active_run
+    
+    try:
+        response, capture = run.result()
+    except CancelledError:
+        status.update(label="Cancelled", state="error")
+        st.session_state.messages.append({"role": "assistant", "content": "⏹️ Query cancelled."})
+        st.warning("⏹️ Query cancelled.")
+        return
+    except TimeoutError:
+        status.update(label="Timed out", state="error")
+        error_message = f"❌ Query timed out after {run.timeout} seconds"
+        st.error(error_message)
+        st.session_state.messages.append({"role": "assistant", "content": error_message})
+        return
+    except Exception as e:
+        status.update(label="Failed", state="error")
+        error_message = f"❌ Error processing query: {str(e)}"
+        st.error(error_message)
+        st.session_state.messages.append({"role": "assistant", "content": error_message})
+        return
+    
+    status.update(label=f"✅ Analysis complete ({run.elapsed:.1f}s)", state="complete")
+    result = capture.last_result
+    if use_query_cache and result:
+        engine.cache_answer(run.question, result, response)
+    render_answer(run.question, response, result, capture.statements, run.elapsed, trace=run.trace)
 
 # Database connection setup
 with st.spinner("🔄 Connecting to database..."):
-    db_kwargs = {}
+    db_kwargs = {'pool_settings': pool_settings}
     if db_uri in [MYSQL, POSTGRES]:
         db_kwargs.update({
             'mysql_host': mysql_host,
@@ -652,6 +517,8 @@ with st.spinner("🔄 Connecting to database..."):
         db_kwargs['postgres_url'] = postgres_url
     elif db_uri == SQLITE_FILE:
         db_kwargs['uploaded_file'] = uploaded_file
+    elif db_uri == LOCALDB:
+        db_kwargs['sample_scale'] = sample_scale
     
     db = configure_database(db_uri, **db_kwargs)
 
@@ -659,26 +526,50 @@ if not db:
     st.error("❌ Failed to connect to database")
     st.stop()
 
+db_identity = database_identity(db)
+# The history store is shared by every session; unscoped history views only reach databases this session opened
+if db_identity not in st.session_state.connected_identities:
+    st.session_state.connected_identities.append(db_identity)
+
 # Initialize AI agent
 try:
-    llm = ChatGroq(
-        groq_api_key=api_key,
-        model_name=selected_model,
-        streaming=True,
-        temperature=temperature
-    )
+    # Reruns and sessions with the same settings reuse the LLM client, its HTTP connections and the agent
+    engine = get_engine(db, api_key, selected_model, temperature)
+    llm = engine.llm
     
-    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-    agent = create_sql_agent(
-        llm=llm,
-        toolkit=toolkit,
-        verbose=True,
-        agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-        handle_parsing_errors=True
-    )
+    # Changed sidebar settings release this session's previous agent; it is dropped once no other session holds it
+    agent_key = engine.agent_key
+    previous_key = st.session_state.get("agent_key")
+    if previous_key != agent_key:
+        if previous_key is not None:
+            agent_factory.release(previous_key, st.session_state.session_id)
+        agent_factory.hold(agent_key, st.session_state.session_id)
+        st.session_state.agent_key = agent_key
     
     with st.spinner("📊 Analyzing database structure..."):
         st.session_state.db_stats = get_database_statistics(db)
+        get_schema_snapshot(db)
+    
+    # The DuckDB snapshots are shared; whether and for which tables they answer is this session's choice
+    accelerator = acceleration = None
+    usable_tables = db.get_usable_table_names()
+    if accelerate:
+        accelerated_tables = [t for t in st.session_state.get("accelerated_tables", usable_tables) if t in usable_tables]
+        try:
+            accelerator = enable_acceleration(db, accelerated_tables, snapshot_max_age * 60)
+            acceleration = AccelerationSettings(accelerated_tables, snapshot_max_age * 60)
+        except Exception as e:
+            st.warning(f"⚠️ DuckDB acceleration unavailable, queries use the database: {e}")
+    use_acceleration(acceleration)
+    
+    # Only this session's statements and the runs it submits follow its guard settings
+    use_guard_settings(GuardSettings(
+        enabled=guard_queries,
+        max_rows=guard_max_rows,
+        max_cost=guard_max_cost or None,
+        action=LIMIT if guard_action == guard_actions[0] else REFUSE,
+        timeout=statement_timeout,
+    ))
     
     st.success("✅ Successfully connected and ready!")
     
@@ -706,6 +597,11 @@ with col1:
             connection_status = "🟢 Neon" if db_uri == POSTGRES_URL else "🟢 Active"
             st.metric("Connection Status", connection_status)
         
+        if stats_cache.is_refreshing(db):
+            st.caption("🔄 Refreshing statistics in the background...")
+        elif stats.get('estimated'):
+            st.caption("Row counts are estimates from the database catalog")
+        
         if stats.get('tables'):
             st.subheader("📋 Table Details")
             table_df = pd.DataFrame([
@@ -717,23 +613,37 @@ with col1:
                 for table, info in stats['tables'].items()
             ])
             st.dataframe(table_df, use_container_width=True)
+    
+    if accelerator is not None:
+        with st.expander("⚡ DuckDB Acceleration"):
+            st.multiselect("Accelerated Tables", usable_tables, default=usable_tables, key="accelerated_tables",
+                           help="Snapshots of these tables answer aggregate queries locally")
+            st.dataframe(pd.DataFrame(accelerator.status(acceleration)), use_container_width=True, hide_index=True)
+            accel_cols = st.columns(3)
+            accel_cols[0].metric("Routed to DuckDB", accelerator.routed)
+            accel_cols[1].metric("Fell Back to Database", accelerator.fallbacks)
+            if accel_cols[2].button("🔄 Refresh Snapshots", use_container_width=True):
+                accelerator.refresh_async(acceleration.tables)
+                st.rerun()
+            if accelerator.refreshing:
+                st.caption("🔄 Snapshotting tables in the background; queries use the database until they are ready")
 
 with col2:
     st.subheader("⚡ Quick Actions")
     
     if st.button("🔍 Explore Schema", use_container_width=True):
         schema_query = "Show me the schema and structure of all tables"
-        st.session_state.messages.append({"role": "user", "content": schema_query})
+        st.session_state.pending_query = schema_query
         st.rerun()
     
     if st.button("📈 Generate Summary Report", use_container_width=True):
         summary_query = "Generate a comprehensive summary report of the database including key statistics and insights"
-        st.session_state.messages.append({"role": "user", "content": summary_query})
+        st.session_state.pending_query = summary_query
         st.rerun()
     
     if st.button("🔎 Data Quality Check", use_container_width=True):
         quality_query = "Check for data quality issues like missing values, duplicates, and inconsistencies"
-        st.session_state.messages.append({"role": "user", "content": quality_query})
+        st.session_state.pending_query = quality_query
         st.rerun()
 
 st.divider()
@@ -746,26 +656,39 @@ if not st.session_state.messages:
         welcome_message += " 🎉 Great choice using Neon PostgreSQL!"
     welcome_message += " What would you like to explore?"
     
-    st.session_state.messages = [
-        {
-            "role": "assistant", 
-            "content": welcome_message
-        }
-    ]
+    st.session_state.messages.append({"role": "assistant", "content": welcome_message})
+
+# Display chat messages; only the most recent turns are rendered, older ones load on request
+messages = list(st.session_state.messages)
+hidden_count = max(0, len(messages) - st.session_state.visible_messages)
+if hidden_count:
+    if st.button(f"⬆️ Show {min(hidden_count, VISIBLE_MESSAGES)} earlier messages ({hidden_count} hidden)"):
+        st.session_state.visible_messages += VISIBLE_MESSAGES
+        st.rerun()
 
-# Display chat messages
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.write(msg["content"])
+for msg in messages[hidden_count:]:
+    with st.chat_message(msg.role):
+        st.write(st.session_state.messages.content(msg))
         
-        if "visualization" in msg:
-            st.plotly_chart(msg["visualization"], use_container_width=True)
+        if msg.sql and show_sql:
+            for statement in msg.sql:
+                st.code(statement, language='sql')
         
-        if "export_data" in msg and enable_exports:
-            st.markdown(msg["export_data"], unsafe_allow_html=True)
+        if msg.data_ref:
+            data = st.session_state.messages.data(msg)
+            if data is not None:
+                st.dataframe(data, use_container_width=True)
+        
+        if msg.figure_ref:
+            figure = st.session_state.messages.figure(msg)
+            if figure is not None:
+                st.plotly_chart(figure, use_container_width=True, key=f"chart_{msg.id}")
+        
+        if msg.export and enable_exports:
+            render_downloads(msg.export, (lambda: st.session_state.messages.data(msg)) if msg.data_ref else None)
 
 # Handle user input
-user_query = st.chat_input("Ask anything about your database...")
+user_query = st.chat_input("Ask anything about your database...") or st.session_state.pop("pending_query", None)
 
 if selected_template != "Custom Query" and selected_template in templates:
     user_query = templates[selected_template]
@@ -777,52 +700,29 @@ if user_query:
     with st.chat_message("user"):
         st.write(user_query)
     
+    start_time = time.time()
+    cache_hit = None
+    # The trace starts here so cache time is counted; a cache miss continues it in the agent run
+    with start_trace(user_query, db_identity=db_identity, model=selected_model) as trace:
+        if use_query_cache:
+            cache_hit, result = engine.lookup_cache(user_query)
+    
+    if cache_hit:
+        trace.tags["mode"] = "cache"
+        record_trace(trace)
+        with st.chat_message("assistant"):
+            render_answer(user_query, cache_hit.answer, result, [cache_hit.sql], time.time() - start_time, cache_hit, trace)
+    
+    if not cache_hit:
+        previous_run = st.session_state.get("active_run")
+        if previous_run is not None and not previous_run.done():
+            previous_run.cancel()
+        st.session_state.active_run = start_agent_run(user_query, trace)
+
+# Follow the in-flight question; it keeps running on the background loop across reruns
+if st.session_state.get("active_run") is not None:
     with st.chat_message("assistant"):
-        try:
-            start_time = time.time()
-            
-            with st.spinner("🤖 AI is analyzing your query..."):
-                response_container = st.empty()
-                streamlit_callback = StreamlitCallbackHandler(st.container())
-                
-                response = agent.run(user_query, callbacks=[streamlit_callback])
-            
-            execution_time = time.time() - start_time
-            
-            st.write("**Answer:**")
-            st.write(response)
-            
-            if show_sql:
-                sql_match = re.search(r'```sql\n(.*?)\n```', response, re.DOTALL)
-                if sql_match:
-                    st.code(sql_match.group(1), language='sql')
-            
-            # Create visualization
-            viz = create_visualization(response, user_query)
-            message_data = {"role": "assistant", "content": response}
-            
-            if viz:
-                st.subheader("📊 Data Visualization")
-                st.plotly_chart(viz, use_container_width=True)
-                message_data["visualization"] = viz
-            
-            # Export option
-            if enable_exports and len(response.split('\n')) > 5:  # If response looks like tabular data
-                export_link = export_to_csv(response, f"query_result_{int(time.time())}.csv")
-                if export_link:
-                    st.markdown("**📥 Export Options:**")
-                    st.markdown(export_link, unsafe_allow_html=True)
-                    message_data["export_data"] = export_link
-            
-            save_query_to_history(user_query, response, execution_time)
-            st.info(f"⏱️ Query executed in {execution_time:.2f} seconds")
-            
-            st.session_state.messages.append(message_data)
-            
-        except Exception as e:
-            error_message = f"❌ Error processing query: {str(e)}"
-            st.error(error_message)
-            st.session_state.messages.append({"role": "assistant", "content": error_message})
+        follow_agent_run(st.session_state.active_run)
 
 st.divider()
 
@@ -831,42 +731,45 @@ tab1, tab2, tab3, tab4 = st.tabs(["📚 Query History", "⭐ Favorites", "📊 A
 
 with tab1:
     st.subheader("Recent Queries")
-    if st.session_state.query_history:
-        for i, item in enumerate(reversed(st.session_state.query_history[-10:])):  # Show last 10
-            with st.expander(f"🕐 {item['timestamp']} - {item['query'][:50]}..."):
-                st.write("**Query:**", item['query'])
-                st.write("**Response:**", item['response'])
-                st.write("**Execution Time:**", f"{item['execution_time']:.2f}s")
+    history_entries, history_total = render_history_page("history")
+    if history_entries:
+        for item in history_entries:
+            with st.expander(f"{'⭐' if item.favorited else '🕐'} {item.timestamp} - {item.query[:50]}..."):
+                st.write("**Query:**", item.query)
+                st.write("**Response:**", item.response)
+                if item.sql and show_sql:
+                    st.code(item.sql, language='sql')
+                st.write("**Execution Time:**", f"{item.execution_time:.2f}s")
                 
                 col1, col2 = st.columns([1, 1])
                 with col1:
-                    if st.button("🔄 Run Again", key=f"rerun_{i}"):
-                        st.session_state.messages.append({"role": "user", "content": item['query']})
+                    if st.button("🔄 Run Again", key=f"rerun_{item.id}"):
+                        st.session_state.pending_query = item.query
                         st.rerun()
                 with col2:
-                    if st.button("⭐ Add to Favorites", key=f"fav_{i}"):
-                        if item not in st.session_state.favorite_queries:
-                            st.session_state.favorite_queries.append(item)
-                            st.success("Added to favorites!")
+                    if not item.favorited and st.button("⭐ Add to Favorites", key=f"fav_{item.id}"):
+                        history_store.set_favorite(item)
+                        st.success("Added to favorites!")
     else:
         st.info("No query history yet. Start asking questions about your database!")
 
 with tab2:
     st.subheader("Favorite Queries")
-    if st.session_state.favorite_queries:
-        for i, item in enumerate(st.session_state.favorite_queries):
-            with st.expander(f"⭐ {item['query'][:60]}..."):
-                st.write("**Query:**", item['query'])
-                st.write("**Last Used:**", item['timestamp'])
+    favorite_entries, favorite_total = render_history_page("favorites", favorites_only=True)
+    if favorite_entries:
+        for item in favorite_entries:
+            with st.expander(f"⭐ {item.query[:60]}..."):
+                st.write("**Query:**", item.query)
+                st.write("**Last Used:**", item.timestamp)
                 
                 col1, col2 = st.columns([1, 1])
                 with col1:
-                    if st.button("🔄 Run Query", key=f"fav_run_{i}"):
-                        st.session_state.messages.append({"role": "user", "content": item['query']})
+                    if st.button("🔄 Run Query", key=f"fav_run_{item.id}"):
+                        st.session_state.pending_query = item.query
                         st.rerun()
                 with col2:
-                    if st.button("🗑️ Remove", key=f"fav_remove_{i}"):
-                        st.session_state.favorite_queries.pop(i)
+                    if st.button("🗑️ Remove", key=f"fav_remove_{item.id}"):
+                        history_store.set_favorite(item, False)
                         st.rerun()
     else:
         st.info("No favorite queries yet. Add queries from your history!")
@@ -906,15 +809,16 @@ with tab3:
             st.info("No data available for visualization")
         
         # Query performance analytics
-        if st.session_state.query_history:
+        recent_queries = history_store.search(db_identity=db_identity, limit=20)  # Last 20 queries
+        if recent_queries:
             st.subheader("⚡ Query Performance")
             perf_data = [
                 {
-                    'Query': item['query'][:30] + "...",
-                    'Execution Time': item['execution_time'],
-                    'Timestamp': item['timestamp']
+                    'Query': item.query[:30] + "...",
+                    'Execution Time': item.execution_time,
+                    'Timestamp': item.timestamp
                 }
-                for item in st.session_state.query_history[-20:]  # Last 20 queries
+                for item in reversed(recent_queries)
             ]
             
             perf_df = pd.DataFrame(perf_data)
@@ -933,13 +837,46 @@ with tab3:
                     st.error(f"Error creating performance chart: {str(e)}")
                     try:
                         chart_data = pd.DataFrame({
-                            'Execution Time': [item['execution_time'] for item in st.session_state.query_history[-20:]]
+                            'Execution Time': [item.execution_time for item in reversed(recent_queries)]
                         })
                         st.line_chart(chart_data)
                     except:
                         st.write("Performance data:", perf_df)
             else:
                 st.info("No query performance data available")
+    
+    # Per-phase latency from traced questions
+    st.subheader("⏱️ Latency Breakdown")
+    percentiles = trace_store.percentiles(db_identity)
+    if not percentiles.empty:
+        st.dataframe(percentiles.style.format({"p50": "{:.3f}s", "p95": "{:.3f}s", "p99": "{:.3f}s"}),
+                     use_container_width=True, hide_index=True)
+        fig = px.bar(percentiles.melt(id_vars=["Phase", "Count"], var_name="Percentile", value_name="Seconds"),
+                     x="Phase", y="Seconds", color="Percentile", barmode="group",
+                     title="Latency Percentiles by Phase")
+        fig.update_layout(height=400)
+        st.plotly_chart(fig, use_container_width=True)
+        
+        breakdown = trace_store.breakdown(db_identity, limit=20)
+        phases = [phase for phase in ("llm", "sql", "schema", "cache") if phase in breakdown.columns]
+        if phases:
+            breakdown["label"] = breakdown["question"].str[:30] + "..."
+            fig = px.bar(breakdown, x="label", y=phases, title="Time per Phase (last 20 questions)",
+                         hover_data={"duration": ":.2f"})
+            fig.update_layout(height=400, xaxis_tickangle=45, xaxis_title="Question",
+                              yaxis_title="Seconds", legend_title="Phase")
+            st.plotly_chart(fig, use_container_width=True)
+        st.caption("Tool spans include the SQL they run, so phases can add up to more than the question total.")
+        
+        st.download_button(
+            "📤 Export Traces (OTLP JSON)",
+            data=lambda: to_otlp_json(trace_store.load(db_identity, limit=100)),
+            file_name="sql_chat_traces.json",
+            mime="application/json",
+            on_click="ignore",
+        )
+    else:
+        st.info("No traced questions yet")
 
 with tab4:
     st.subheader("Advanced Features")
@@ -950,39 +887,174 @@ with tab4:
         placeholder="SELECT COUNT(*) FROM students;\nSELECT * FROM courses LIMIT 5;\nSELECT AVG(gpa) FROM students;"
     )
     
+    st.caption("Lines written as SQL (uppercase keyword, or ending in ';') run directly as read-only queries; other lines are asked to the AI agent.")
+    
     if st.button("▶️ Execute Batch Queries"):
         if batch_queries:
-            queries = [q.strip() for q in batch_queries.split('\n') if q.strip()]
-            for query in queries:
-                st.session_state.messages.append({"role": "user", "content": query})
-            st.rerun()
+            queries = parse_batch(batch_queries)
+            progress = st.progress(0.0, text=f"Running {len(queries)} queries...")
+            start_time = time.time()
+            items = []
+            for item in iter_batch(db, queries, ask=lambda question: start_agent_run(question, priority=BATCH).result()):
+                items.append(item)
+                progress.progress(len(items) / len(queries), text=f"{len(items)} / {len(queries)} done")
+            progress.empty()
+            items.sort(key=lambda item: item.index)
+            st.session_state.batch_result = BatchResult(items, time.time() - start_time)
+            st.session_state.pop("batch_export", None)
+            for item in items:
+                if item.status == "ok":
+                    save_query_to_history(item.query, item.answer or f"{item.row_count} rows", item.duration, item.sql)
+    
+    batch_result = st.session_state.get("batch_result")
+    if batch_result:
+        st.success(f"✅ {len(batch_result.items) - len(batch_result.failed)} of {len(batch_result.items)} queries succeeded in {batch_result.duration:.2f} seconds")
+        st.dataframe(batch_result.summary_frame(), use_container_width=True, hide_index=True)
+        for item in batch_result.items:
+            if item.frame is not None or item.answer:
+                with st.expander(f"{item.index + 1}. {item.query[:80]}"):
+                    if item.answer:
+                        st.write(item.answer)
+                    if show_sql and item.kind == "question":
+                        for statement in item.sql:
+                            st.code(statement, language='sql')
+                    if item.frame is not None:
+                        st.dataframe(item.frame, use_container_width=True)
+        if enable_exports and "batch_export" not in st.session_state:
+            combined = batch_result.combined_frame()
+            st.session_state.batch_export = None if combined is None else create_export(combined, f"batch_results_{int(time.time())}")
+        if enable_exports and st.session_state.get("batch_export"):
+            render_downloads(st.session_state.batch_export)
     
     st.divider()
     
     st.write("**💾 Database Export**")
     if st.button("📤 Export Database Schema"):
         schema_query = "Show me the complete database schema with all table structures, relationships, and constraints"
-        st.session_state.messages.append({"role": "user", "content": schema_query})
+        st.session_state.pending_query = schema_query
         st.rerun()
     
     st.divider()
     
     st.write("**⚡ Query Optimization**")
-    optimization_query = st.text_input("Enter a query to optimize:", placeholder="SELECT * FROM students WHERE...")
+    optimization_query = st.text_area("Enter a query to optimize:", placeholder="SELECT * FROM students WHERE...")
+    analyze_plan = st.checkbox("Run the query to measure actual rows and times (EXPLAIN ANALYZE)", value=False)
     
-    if st.button("🔧 Get Optimization Suggestions") and optimization_query:
+    plan_col, suggest_col = st.columns(2)
+    if plan_col.button("🔍 Explain Query Plan") and optimization_query:
+        with st.spinner("Reading the query plan..."):
+            st.session_state.plan_report = explain_plan(db, optimization_query, analyze_plan)
+    plan_report = st.session_state.get("plan_report")
+    
+    if suggest_col.button("🔧 Get Optimization Suggestions") and optimization_query:
         opt_query = f"Analyze this query for optimization opportunities and suggest improvements: {optimization_query}"
-        st.session_state.messages.append({"role": "user", "content": opt_query})
+        # The plan and its hot spots give the AI something better than the SQL text to reason about
+        if plan_report is not None and plan_report.root is not None and plan_report.sql in optimization_query:
+            opt_query += f"\n\nIts {plan_report.dialect} query plan:\n{plan_report.text()}"
+        st.session_state.pending_query = opt_query
         st.rerun()
     
+    if plan_report:
+        if plan_report.error:
+            st.error(f"❌ {plan_report.error}")
+        else:
+            root = plan_report.root
+            cost_col, rows_col, time_col = st.columns(3)
+            cost_col.metric("Estimated Cost", f"{root.cost:,.0f}" if root.cost is not None else "n/a")
+            rows_col.metric("Estimated Rows", f"{root.rows:,.0f}" if root.rows is not None else "n/a")
+            time_col.metric("Measured Time", f"{root.time_ms:,.1f} ms" if root.time_ms is not None else "not run")
+            st.dataframe(plan_report.frame(), use_container_width=True, hide_index=True)
+            if plan_report.note:
+                st.caption(plan_report.note)
+            for spot in plan_report.hotspots:
+                st.warning(f"🔥 **{spot.kind.capitalize()}** · `{spot.node}`: {spot.message}")
+            if not plan_report.hotspots:
+                st.success("✅ No hot spots in this plan")
+    
+    st.write("**📇 Index Candidates**")
+    st.caption("Proposed from the filter, join and sort columns of the SQL recorded in the query history, weighted by how often and how long it ran.")
+    if st.button("🧮 Suggest Indexes"):
+        with st.spinner("Analyzing the recorded workload..."):
+            st.session_state.index_candidates = suggest_indexes(db, history_store.workload(db_identity))
+        st.session_state.pop("index_trial", None)
+    
+    index_candidates = st.session_state.get("index_candidates")
+    if index_candidates:
+        st.dataframe(pd.DataFrame([{
+            "Table": candidate.table,
+            "Columns": ", ".join(candidate.columns),
+            "Used For": ", ".join(candidate.reasons),
+            "Runs": candidate.runs,
+            "Total Time (s)": round(candidate.total_time, 2),
+            "Table Rows": candidate.table_rows,
+            "DDL": candidate.ddl,
+        } for candidate in index_candidates]), use_container_width=True, hide_index=True)
+        if db.dialect == "sqlite":
+            chosen = st.selectbox("Candidate to test:", index_candidates, format_func=lambda candidate: candidate.ddl)
+            st.caption("The query above is timed if given, otherwise the heaviest recorded query that wants the index.")
+            if st.button("🧪 Test on a Scratch Copy"):
+                with st.spinner("Copying the database and timing the query..."):
+                    st.session_state.index_trial = trial_index(db, chosen, optimization_query or None)
+        else:
+            st.caption("Index trials run on a scratch copy and are available for SQLite databases.")
+    elif index_candidates is not None:
+        st.info("No index candidates: the recorded queries' filter, join and sort columns are already indexed, or no SQL has been recorded yet")
+    
+    index_trial = st.session_state.get("index_trial")
+    if index_trial:
+        if index_trial.error:
+            st.error(f"❌ {index_trial.error}")
+        else:
+            timeout_label = "timed out"
+            before_col, after_col, speedup_col = st.columns(3)
+            before_col.metric("Without Index", f"{index_trial.before * 1000:,.2f} ms" if index_trial.before is not None else timeout_label)
+            after_col.metric("With Index", f"{index_trial.after * 1000:,.2f} ms" if index_trial.after is not None else timeout_label)
+            speedup_col.metric("Speedup", f"{index_trial.speedup:,.1f}x" if index_trial.speedup else "n/a")
+            if not index_trial.used:
+                st.warning("⚠️ SQLite did not use the index for this query")
+            plan_before, plan_after = st.columns(2)
+            plan_before.code("\n".join(index_trial.before_plan), language="text")
+            plan_after.code("\n".join(index_trial.after_plan), language="text")
+            st.caption(f"Median of several runs over {index_trial.rows:,} rows: {index_trial.sql}")
+    
     st.divider()
     st.write("**⚙️ Direct SQL Execution**")
     custom_sql = st.text_area("Execute custom SQL:", placeholder="SELECT * FROM table_name LIMIT 10;")
     
     if st.button("🔄 Execute SQL") and custom_sql:
-        sql_query = f"Execute this SQL query and show results: {custom_sql}"
-        st.session_state.messages.append({"role": "user", "content": sql_query})
-        st.rerun()
+        previous = st.session_state.pop("direct_stream", None)
+        if previous is not None:
+            previous.close()
+        stream = open_readonly_stream(db, custom_sql, max_rows=result_row_budget, max_bytes=result_memory_budget * 1024 * 1024)
+        stream.fetch_until(100)
+        st.session_state.direct_stream = stream
+        st.session_state.pop("direct_explanation", None)
+        st.session_state.pop("direct_export", None)
+        if stream.error is None:
+            save_query_to_history(custom_sql, f"{stream.row_count}{'' if stream.exhausted else '+'} rows returned", stream.duration, [stream.sql])
+    
+    direct_stream = st.session_state.get("direct_stream")
+    if direct_stream:
+        if direct_stream.error:
+            st.error(f"❌ {direct_stream.error}")
+        else:
+            if direct_stream.limit is not None:
+                st.warning(f"🛡️ About {direct_stream.estimate.rows:,.0f} rows were estimated, so the query was limited to {direct_stream.limit:,} rows")
+            render_stream_page(direct_stream, key="direct_sql")
+            if enable_exports and direct_stream.row_count:
+                if st.session_state.get("direct_export") is None and st.button("📥 Prepare Export"):
+                    with st.spinner("Fetching all rows..."):
+                        st.session_state.direct_export = create_export(direct_stream.fetch_all().chunks, f"sql_result_{int(time.time())}")
+                if st.session_state.get("direct_export"):
+                    render_downloads(st.session_state.direct_export)
+            if direct_stream.row_count and st.button("💡 Explain this result"):
+                with st.spinner("🤖 AI is reading the result..."):
+                    try:
+                        st.session_state.direct_explanation = explain_result(llm, direct_stream)
+                    except Exception as e:
+                        st.error(f"❌ Could not explain the result: {str(e)}")
+            if st.session_state.get("direct_explanation"):
+                st.write(st.session_state.direct_explanation)
 
 st.divider()
 
@@ -991,36 +1063,49 @@ footer_col1, footer_col2, footer_col3 = st.columns([1, 1, 1])
 
 with footer_col1:
     if st.button("🗑️ Clear Chat History", use_container_width=True):
-        st.session_state.messages = [
-            {
-                "role": "assistant", 
-                "content": "Chat history cleared! How can I help you with your database?"
-            }
-        ]
+        st.session_state.messages.clear()
+        st.session_state.messages.append({"role": "assistant", "content": "Chat history cleared! How can I help you with your database?"})
+        st.session_state.visible_messages = VISIBLE_MESSAGES
         st.rerun()
 
 with footer_col2:
+    exact_counts = st.checkbox("Exact row counts", False, help="Count every row instead of using catalog estimates (slower on large tables)")
     if st.button("📊 Refresh Database Stats", use_container_width=True):
-        with st.spinner("Refreshing database statistics..."):
-            st.session_state.db_stats = get_database_statistics(db)
-        st.success("Database statistics refreshed!")
+        stats_cache.refresh(db, exact=exact_counts)
+        st.toast("Refreshing database statistics in the background...")
         st.rerun()
 
 with footer_col3:
     if st.button("💡 Get Query Suggestions", use_container_width=True):
         suggestion_query = "Suggest 5 interesting and useful queries I can run on this database based on its structure and data"
-        st.session_state.messages.append({"role": "user", "content": suggestion_query})
+        st.session_state.pending_query = suggestion_query
         st.rerun()
 
 # Enhanced sidebar information
 with st.sidebar:
     st.divider()
     st.markdown("### 📈 Session Statistics")
-    st.metric("Queries Executed", len(st.session_state.query_history))
-    st.metric("Favorites Saved", len(st.session_state.favorite_queries))
+    query_count, avg_time = history_store.summary(db_identity)
+    st.metric("Queries Executed", query_count)
+    st.metric("Favorites Saved", history_store.favorite_count(db_identity))
+    st.metric("Active Agent Runs", f"{runner.active} / {runner.max_concurrent}")
+    factory_stats = agent_factory.stats()
+    st.metric("Cached Agents", factory_stats["entries"],
+              help=f"{factory_stats['cold_builds']} cold builds (avg {factory_stats['cold_ms'] or 0:.0f} ms), "
+                   f"{factory_stats['warm_hits']} warm reuses (avg {factory_stats['warm_ms'] or 0:.2f} ms)")
+    gateway_stats = gateway.stats()
+    interactive_wait = gateway_stats["waits"][INTERACTIVE]["p95_ms"]
+    batch_wait = gateway_stats["waits"][BATCH]["p95_ms"]
+    st.metric("LLM Requests Queued", gateway_stats["queued"],
+              help=f"p95 queue wait: {interactive_wait or 0:.0f} ms interactive, {batch_wait or 0:.0f} ms batch; "
+                   f"{gateway_stats['upstream_calls']} upstream calls, {gateway_stats['coalesced']} shared, "
+                   f"{gateway_stats['retries']} retries ({gateway_stats['rate_limited']} rate limited)")
+    result_cache_stats = result_cache.stats(db)
+    st.metric("Cached Results", result_cache_stats["entries"],
+              help=f"{result_cache_stats['bytes'] / (1024 * 1024):.1f} MB on disk; {result_cache_stats['hits']} hits, "
+                   f"{result_cache_stats['misses']} misses, {result_cache_stats['invalidated']} dropped after their tables changed")
     
-    if st.session_state.query_history:
-        avg_time = sum(q['execution_time'] for q in st.session_state.query_history) / len(st.session_state.query_history)
+    if query_count:
         st.metric("Avg Query Time", f"{avg_time:.2f}s")
     
     st.divider()
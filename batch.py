@@ -0,0 +1,126 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from direct_sql import looks_like_sql, run_readonly
+
+# Stay below the default pool size so a batch never waits on its own connections
+DEFAULT_BATCH_WORKERS = 4
+DEFAULT_LLM_CONCURRENCY = 2
+
+
+def parse_batch(text):
+    """Non-empty lines of the batch text area"""
+    return [line.strip() for line in text.split('\n') if line.strip()]
+
+
+@dataclass
+class BatchItem:
+    index: int
+    query: str
+    kind: str
+    status: str = "pending"
+    duration: float = 0.0
+    row_count: int = 0
+    error: str = None
+    answer: str = None
+    sql: list = field(default_factory=list)
+    frame: pd.DataFrame = None
+
+
+@dataclass
+class BatchResult:
+    items: list
+    duration: float = 0.0
+
+    @property
+    def failed(self):
+        return [item for item in self.items if item.status != "ok"]
+
+    def summary_frame(self):
+        """One row per batch line with timing, row count and error status"""
+        return pd.DataFrame([{
+            '#': item.index + 1,
+            'Query': item.query,
+            'Type': "SQL" if item.kind == "sql" else "Question",
+            'Status': "✅ ok" if item.status == "ok" else "❌ error",
+            'Rows': item.row_count,
+            'Seconds': round(item.duration, 3),
+            'Error': item.error or "",
+        } for item in self.items])
+
+    def combined_frame(self):
+        """All result sets stacked into one frame, tagged with the line they came from"""
+        frames = []
+        for item in self.items:
+            if item.frame is None or item.frame.empty:
+                continue
+            frame = item.frame.copy()
+            frame.insert(0, 'batch_query', item.query)
+            frame.insert(0, 'batch_index', item.index + 1)
+            frames.append(frame)
+        if not frames:
+            return None
+        return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def _run_sql(db, item):
+    result = run_readonly(db, item.query)
+    item.duration = result.duration
+    item.sql = [item.query]
+    if result.error:
+        item.status, item.error = "error", result.error
+    else:
+        item.status, item.frame, item.row_count = "ok", result.frame, result.row_count
+    return item
+
+
+def _run_question(ask, llm_slots, item):
+    start = time.perf_counter()
+    try:
+        with llm_slots:
+            answer, capture = ask(item.query)
+    except Exception as e:
+        item.status, item.error = "error", str(e) or type(e).__name__
+    else:
+        result = capture.last_result
+        item.status, item.answer, item.sql = "ok", answer, capture.statements
+        if result is not None:
+            item.frame, item.row_count = result.frame, result.row_count
+    item.duration = time.perf_counter() - start
+    return item
+
+
+def iter_batch(db, queries, ask=None, max_workers=DEFAULT_BATCH_WORKERS, llm_concurrency=DEFAULT_LLM_CONCURRENCY):
+    """Run queries concurrently, yielding each BatchItem as it finishes
+
+    Raw SQL goes straight to the pooled engine (read-only statements only);
+    other lines are passed to ask(question) -> (answer, ResultCapture), at
+    most llm_concurrency at a time.
+    """
+    items = [BatchItem(i, query, "sql" if looks_like_sql(query) else "question") for i, query in enumerate(queries)]
+    llm_slots = threading.Semaphore(llm_concurrency)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch") as pool:
+        futures = []
+        for item in items:
+            if item.kind == "sql":
+                # Each task runs in a copy of the caller's context, so its guard settings apply
+                futures.append(pool.submit(contextvars.copy_context().run, _run_sql, db, item))
+            elif ask is None:
+                item.status, item.error = "error", "Natural-language questions need an agent"
+                yield item
+            else:
+                futures.append(pool.submit(contextvars.copy_context().run, _run_question, ask, llm_slots, item))
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def run_batch(db, queries, ask=None, max_workers=DEFAULT_BATCH_WORKERS, llm_concurrency=DEFAULT_LLM_CONCURRENCY):
+    """Run a whole batch and return a BatchResult in input order"""
+    start = time.perf_counter()
+    items = sorted(iter_batch(db, queries, ask, max_workers, llm_concurrency), key=lambda item: item.index)
+    return BatchResult(items, time.perf_counter() - start)
@@ -0,0 +1,335 @@
+import argparse
+import json
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from agent_factory import build_agent
+from agent_runner import runner
+from connections import get_sql_database
+from db_stats import collect_statistics
+from exports import ExportStore
+from result_cache import caching_scope
+from result_capture import capture_results
+from sample_db import build_sample_db
+from schema_context import answer_single_shot, get_schema_snapshot, question_with_context
+from tracing import Trace, start_trace, tracing_handler
+from visualization import build_visualization
+
+APP_PATH = Path(__file__).with_name("app.py")
+DEFAULT_BASELINE = Path(__file__).with_name("benchmark_baseline.json")
+DEFAULT_SCALES = [1, 10]
+MODES = ["agent", "single"]
+# A metric regresses when it is this much slower than the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and the difference is larger than timer and allocator noise
+NOISE_FLOOR = {"seconds": 0.005, "mb": 1.0}
+METRICS = ["wall_seconds", "llm_calls", "db_seconds", "schema_seconds", "viz_seconds", "export_seconds", "peak_memory_mb"]
+
+
+@dataclass
+class Scenario:
+    """A question with the SQL the scripted model answers it with, failed attempts first"""
+    question: str
+    sql: list
+    answer: str
+
+
+SCENARIOS = [
+    Scenario("How many students are there?",
+             ["SELECT COUNT(*) AS student_count FROM students"],
+             "The database holds the counted number of students."),
+    Scenario("What is the average GPA by major?",
+             ["SELECT major, ROUND(AVG(gpa), 2) AS avg_gpa FROM students GROUP BY major ORDER BY avg_gpa DESC"],
+             "Average GPA per major is shown in the table."),
+    Scenario("Which courses have the most enrollments?",
+             ["SELECT c.course_name, COUNT(*) AS enrollments FROM enrollments e "
+              "JOIN courses c ON c.course_id = e.course_id GROUP BY c.course_name ORDER BY enrollments DESC LIMIT 10"],
+             "The most popular courses are listed with their enrollment counts."),
+    Scenario("What is the total amount paid per payment method?",
+             ["SELECT payment_method, SUM(amount) AS total_paid FROM payments GROUP BY payment_method ORDER BY total_paid DESC"],
+             "Totals per payment method are shown."),
+    Scenario("Who are the five students with the highest GPA?",
+             ["SELECT name, gpa FROM students ORDER BY gpa DESC LIMIT 5",
+              "SELECT first_name, last_name, gpa FROM students ORDER BY gpa DESC LIMIT 5"],
+             "The top five students by GPA are listed."),
+    Scenario("Show every enrollment with its grade points",
+             ["SELECT enrollment_id, student_id, course_id, grade, points FROM enrollments"],
+             "All enrollments are listed with their grade points."),
+]
+
+
+class ScriptedChatModel(GenericFakeChatModel):
+    """Deterministic chat model replaying canned replies, optionally with a fixed per-call latency"""
+    latency: float = 0.0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def agent_script(scenario):
+    """ReAct turns: one sql_db_query action per statement, then the final answer"""
+    replies = [
+        f"Thought: I should query the database.\nAction: sql_db_query\nAction Input: {sql}"
+        for sql in scenario.sql
+    ]
+    replies.append(f"Thought: I now know the final answer\nFinal Answer: {scenario.answer}")
+    return replies
+
+
+def single_shot_script(scenario):
+    return [f"```sql\n{sql}\n```" for sql in scenario.sql]
+
+
+def scripted_llm(replies, latency=0.0):
+    messages = iter([AIMessage(content=reply) for reply in replies])
+    return ScriptedChatModel(messages=messages, latency=latency, callbacks=[tracing_handler])
+
+
+@dataclass
+class QuestionResult:
+    scale: int
+    mode: str
+    question: str
+    status: str = "ok"
+    rows: int = 0
+    wall_seconds: float = 0.0
+    llm_calls: int = 0
+    db_seconds: float = 0.0
+    schema_seconds: float = 0.0
+    viz_seconds: float = 0.0
+    export_seconds: float = 0.0
+    peak_memory_mb: float = 0.0
+    error: str = None
+
+
+@dataclass
+class SetupResult:
+    scale: int
+    build_seconds: float
+    connect_seconds: float
+    stats_seconds: float
+    snapshot_seconds: float
+    tables: dict = field(default_factory=dict)
+
+
+def _timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return value, time.perf_counter() - started
+
+
+def setup_database(scale):
+    """Same connection path as the app's sample database, timing each step"""
+    path, build_seconds = _timed(build_sample_db, scale)
+    creator = lambda: sqlite3.connect(f"file:{path}?mode=rw", uri=True)
+    handle, connect_seconds = _timed(get_sql_database, "sqlite:///", creator=creator, path=str(path))
+    db = handle.db
+    stats, stats_seconds = _timed(collect_statistics, db, exact=True)
+    _, snapshot_seconds = _timed(get_schema_snapshot, db)
+    tables = {table.name: table.row_count for table in stats.tables}
+    return db, SetupResult(scale, build_seconds, connect_seconds, stats_seconds, snapshot_seconds, tables)
+
+
+def _ask(db, snapshot, scenario, mode, latency, scale):
+    """Run one scenario the way the chat tab does; returns (output, ResultCapture, Trace)"""
+    tags = {"db_identity": f"benchmark:{scale}", "mode": mode, "benchmark": True}
+    if mode == "agent":
+        agent = build_agent(scripted_llm(agent_script(scenario), latency), db, verbose=False)
+        run = runner.submit_agent(
+            agent, scenario.question, lambda: question_with_context(db, snapshot, scenario.question),
+            trace=Trace(scenario.question, persist=False), tags=tags,
+        )
+        output, capture = run.result()
+        return output, capture, run.trace
+    llm = scripted_llm(single_shot_script(scenario), latency)
+    with start_trace(scenario.question, **tags) as trace, capture_results() as capture:
+        output = answer_single_shot(llm, db, scenario.question)
+    return output, capture, trace
+
+
+def run_question(db, snapshot, scenario, mode, scale, exports, latency=0.0):
+    result = QuestionResult(scale, mode, scenario.question)
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        output, capture, trace = _ask(db, snapshot, scenario, mode, latency, scale)
+        result.wall_seconds = time.perf_counter() - started
+        result.llm_calls = sum(1 for span in trace.spans if span.kind == "llm")
+        totals = trace.phase_totals()
+        result.db_seconds = totals["sql"]
+        result.schema_seconds = totals["schema"]
+        if output.startswith("❌"):
+            result.status, result.error = "failed", output
+
+        last = capture.last_result
+        if last is not None:
+            result.rows = last.row_count
+            _, result.viz_seconds = _timed(build_visualization, last.frame, scenario.question)
+            export, spill_seconds = _timed(exports.spill, last.frame, "benchmark")
+            _, csv_seconds = _timed(exports.path_for, export, "csv")
+            result.export_seconds = spill_seconds + csv_seconds
+    except Exception as e:
+        result.wall_seconds = time.perf_counter() - started
+        result.status, result.error = "error", str(e)
+    result.peak_memory_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    return result
+
+
+def measure_rerun(scale, messages, repeats=3):
+    """Median seconds for one Streamlit rerun of app.py with a chat history of the given length"""
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return None
+
+    at = AppTest.from_file(str(APP_PATH), default_timeout=120)
+    at.run()
+    next(w for w in at.text_input if w.label == "Groq API Key").set_value("gsk_benchmark")
+    scale_box = next((w for w in at.selectbox if w.label == "Sample Data Scale"), None)
+    if scale_box is not None and scale in scale_box.options:
+        scale_box.set_value(scale)
+    _, cold_seconds = _timed(at.run)
+    if at.exception:
+        raise RuntimeError(f"app.py raised during the benchmark: {at.exception[0].value}")
+
+    db, _ = setup_database(scale)
+    # A realistic grouped result with a chart for every stored turn
+    frame = pd.read_sql("SELECT major, AVG(gpa) AS avg_gpa, COUNT(*) AS students FROM students GROUP BY major", db._engine)
+    figure = build_visualization(frame, "average gpa by major")
+    store = at.session_state["messages"]
+    for i in range(messages):
+        store.append({"role": "user", "content": f"Question {i}"})
+        store.append({"role": "assistant", "content": "Answer", "sql": ["SELECT 1"], "data": frame, "visualization": figure})
+
+    timings = []
+    for _ in range(repeats):
+        _, seconds = _timed(at.run)
+        timings.append(seconds)
+    return {"scale": scale, "messages": messages, "cold_seconds": cold_seconds,
+            "rerun_seconds": statistics.median(timings)}
+
+
+def summarize(results):
+    """Median of each metric per scale and mode"""
+    groups = {}
+    for result in results:
+        groups.setdefault(f"{result.scale}/{result.mode}", []).append(result)
+    return {
+        key: {metric: statistics.median(getattr(r, metric) for r in group) for metric in METRICS}
+        | {"failures": sum(r.status != "ok" for r in group)}
+        for key, group in groups.items()
+    }
+
+
+def compare(summary, baseline, tolerance=DEFAULT_TOLERANCE):
+    """One row per metric present in both; regression when slower beyond tolerance and noise"""
+    rows = []
+    for key, metrics in summary.items():
+        for metric, value in metrics.items():
+            base = baseline.get(key, {}).get(metric)
+            if base is None:
+                continue
+            if metric in ("llm_calls", "failures"):
+                regression = value > base
+            else:
+                floor = NOISE_FLOOR["mb" if metric.endswith("_mb") else "seconds"]
+                regression = value > base * (1 + tolerance) and value - base > floor
+            rows.append({
+                "key": key, "metric": metric, "value": value, "baseline": base,
+                "ratio": value / base if base else None, "regression": regression,
+            })
+    return rows
+
+
+def run_benchmark(scales=DEFAULT_SCALES, modes=MODES, repeat=1, latency=0.0, rerun_messages=None):
+    results, setups, reruns = [], [], []
+    exports = ExportStore(root=Path(tempfile.gettempdir()) / "sql_chat_benchmark")
+    tracemalloc.start()
+    try:
+        # Cached results would hide the database time the benchmark is there to measure
+        with caching_scope(False):
+            for scale in scales:
+                db, setup = setup_database(scale)
+                setups.append(setup)
+                snapshot = get_schema_snapshot(db)
+                for mode in modes:
+                    for scenario in SCENARIOS:
+                        for _ in range(repeat):
+                            results.append(run_question(db, snapshot, scenario, mode, scale, exports, latency))
+    finally:
+        tracemalloc.stop()
+        exports.clear()
+    if rerun_messages is not None:
+        for scale in scales:
+            rerun = measure_rerun(scale, rerun_messages)
+            if rerun is not None:
+                reruns.append(rerun)
+    return results, setups, reruns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline SQL Chat benchmark with a scripted chat model")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Sample database scale factors")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per question; medians are reported")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per LLM call")
+    parser.add_argument("--rerun", type=int, metavar="MESSAGES", default=None,
+                        help="Also time Streamlit reruns with this many stored chat turns")
+    parser.add_argument("--report", default="benchmark_report.json", help="Where to write the JSON report")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run's summary as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results, setups, reruns = run_benchmark(args.scales, args.modes, args.repeat, args.llm_latency, args.rerun)
+    summary = summarize(results)
+    baseline_path = Path(args.baseline)
+    comparison = []
+    if baseline_path.exists() and not args.save_baseline:
+        comparison = compare(summary, json.loads(baseline_path.read_text())["summary"], args.tolerance)
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "llm_latency": args.llm_latency,
+        "setup": [asdict(setup) for setup in setups],
+        "results": [asdict(result) for result in results],
+        "rerun": reruns,
+        "summary": summary,
+        "comparison": comparison,
+        "regressions": [row for row in comparison if row["regression"]],
+    }
+    Path(args.report).write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps({"created_at": report["created_at"], "summary": summary}, indent=2))
+
+    for key, metrics in summary.items():
+        print(f"{key:>12}  wall {metrics['wall_seconds']:.3f}s  llm {metrics['llm_calls']:.0f}  "
+              f"db {metrics['db_seconds']:.3f}s  viz {metrics['viz_seconds']:.3f}s  "
+              f"export {metrics['export_seconds']:.3f}s  peak {metrics['peak_memory_mb']:.1f}MB  "
+              f"failures {metrics['failures']}")
+    for rerun in reruns:
+        print(f"rerun scale {rerun['scale']} with {rerun['messages']} turns: "
+              f"{rerun['rerun_seconds']:.3f}s (cold {rerun['cold_seconds']:.3f}s)")
+    for row in report["regressions"]:
+        print(f"REGRESSION {row['key']} {row['metric']}: {row['value']:.4f} vs baseline {row['baseline']:.4f}")
+    return 1 if report["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+from langchain.sql_database import SQLDatabase
+from sqlalchemy import create_engine
+
+# Pool defaults for server databases (MySQL / PostgreSQL)
+DEFAULT_POOL_SETTINGS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+
+# Entries unused for this many seconds are disposed
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+DEFAULT_MAX_ENTRIES = 16
+
+
+def connection_key(**params):
+    """Stable hash of the connection parameters used to key the registry"""
+    payload = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ConnectionEntry:
+    """Engine and reflected SQLDatabase shared by every rerun and session"""
+
+    def __init__(self, key, engine, db, identity=None):
+        self.key = key
+        self.identity = identity or key
+        self.engine = engine
+        self.db = db
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.hits = 0
+
+    def touch(self):
+        self.last_used = time.time()
+        self.hits += 1
+
+
+class ConnectionRegistry:
+    """Process-wide cache of engines keyed by a hash of their connection parameters"""
+
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, max_entries=DEFAULT_MAX_ENTRIES):
+        self.idle_timeout = idle_timeout
+        self.max_entries = max_entries
+        self._entries = {}
+        # key -> Future of the entry being built, so concurrent misses wait for one build
+        self._pending = {}
+        # Engines evicted while sessions still held their SQLDatabase -> identity
+        self._retired = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, key, factory, identity=None):
+        """Return the cached entry for key, building it with factory() on a miss"""
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.touch()
+                return entry
+            pending = self._pending.get(key)
+            building = pending is None
+            if building:
+                pending = self._pending[key] = Future()
+
+        if not building:
+            entry = pending.result()
+            with self._lock:
+                entry.touch()
+            return entry
+
+        # Engine creation and schema reflection hit the network; other keys must not wait on them
+        try:
+            engine, db = factory()
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            pending.set_exception(e)
+            raise
+        entry = ConnectionEntry(key, engine, db, identity)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._entries[key] = entry
+            self._evict_overflow()
+            entry.touch()
+        pending.set_result(entry)
+        return entry
+
+    def dispose(self, key):
+        """Drop one entry and close its pooled connections"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry:
+            entry.engine.dispose()
+
+    def find(self, engine):
+        """Entry owning engine, if it was created by this registry"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.engine is engine:
+                    return entry
+        return None
+
+    def in_use(self, identity):
+        """True while a cached entry, or an evicted one a session still holds, points at identity"""
+        with self._lock:
+            return (any(entry.identity == identity for entry in self._entries.values())
+                    or identity in self._retired.values())
+
+    def retired_identity(self, engine):
+        """Identity of an evicted engine that a session is still using, else None"""
+        with self._lock:
+            return self._retired.get(engine)
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.engine.dispose()
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "key": entry.key[:12],
+                    "dialect": entry.engine.dialect.name,
+                    "hits": entry.hits,
+                    "idle_seconds": round(time.time() - entry.last_used, 1),
+                    "pool": entry.engine.pool.status(),
+                }
+                for entry in self._entries.values()
+            ]
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_timeout
+        for key in [k for k, e in self._entries.items() if e.last_used < cutoff]:
+            self._retire(self._entries.pop(key))
+
+    def _evict_overflow(self):
+        while len(self._entries) > self.max_entries:
+            oldest = min(self._entries.values(), key=lambda e: e.last_used)
+            self._retire(self._entries.pop(oldest.key))
+
+    def _retire(self, entry):
+        """Forget entry; its engine is disposed once the last session lets go of the SQLDatabase"""
+        self._retired[entry.engine] = entry.identity
+        weakref.finalize(entry.db, entry.engine.dispose)
+
+
+registry = ConnectionRegistry()
+
+
+def get_sql_database(url, creator=None, pool_settings=None, **key_params):
+    """Return a cached SQLDatabase for url, creating the engine and reflecting the schema once"""
+    engine_kwargs = {}
+    if creator is not None:
+        engine_kwargs["creator"] = creator
+    if pool_settings:
+        engine_kwargs.update(pool_settings)
+
+    key = connection_key(url=url, pool_settings=pool_settings, **key_params)
+    # Pool tuning does not change which database we talk to
+    identity = connection_key(url=url, **key_params)
+
+    def factory():
+        engine = create_engine(url, **engine_kwargs)
+        return engine, SQLDatabase(engine)
+
+    return registry.get(key, factory, identity)
+
+
+def database_identity(db):
+    """Stable id of the database behind db, independent of pool settings"""
+    entry = registry.find(db._engine)
+    if entry is not None:
+        return entry.identity
+    identity = registry.retired_identity(db._engine)
+    if identity is not None:
+        return identity
+    return connection_key(url=db._engine.url.render_as_string(hide_password=False))
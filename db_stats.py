@@ -0,0 +1,227 @@
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import text
+
+DEFAULT_STATS_TTL = 300
+
+POSTGRES_STATS_SQL = text("""
+    SELECT c.relname AS table_name,
+           CASE WHEN c.reltuples >= 0 THEN c.reltuples::bigint
+                ELSE COALESCE(s.n_live_tup, 0) END AS row_count,
+           (SELECT count(*) FROM pg_attribute a
+             WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped) AS column_count,
+           pg_total_relation_size(c.oid) AS size_bytes
+      FROM pg_class c
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+      LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+     WHERE c.relkind IN ('r', 'p')
+       AND n.nspname = COALESCE(:schema, current_schema())
+""")
+
+MYSQL_STATS_SQL = text("""
+    SELECT t.TABLE_NAME AS table_name,
+           COALESCE(t.TABLE_ROWS, 0) AS row_count,
+           COUNT(c.COLUMN_NAME) AS column_count,
+           COALESCE(t.DATA_LENGTH, 0) + COALESCE(t.INDEX_LENGTH, 0) AS size_bytes
+      FROM information_schema.TABLES t
+      LEFT JOIN information_schema.COLUMNS c
+        ON c.TABLE_SCHEMA = t.TABLE_SCHEMA AND c.TABLE_NAME = t.TABLE_NAME
+     WHERE t.TABLE_SCHEMA = COALESCE(:schema, DATABASE())
+       AND t.TABLE_TYPE = 'BASE TABLE'
+     GROUP BY t.TABLE_NAME, t.TABLE_ROWS, t.DATA_LENGTH, t.INDEX_LENGTH
+""")
+
+SQLITE_COLUMNS_SQL = text("""
+    SELECT m.name AS table_name, COUNT(p.name) AS column_count
+      FROM sqlite_master m
+      JOIN pragma_table_info(m.name) p
+     WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+     GROUP BY m.name
+""")
+
+# The first integer of a sqlite_stat1 entry is the row count of the table
+SQLITE_STAT1_SQL = text("SELECT tbl, MAX(CAST(stat AS INTEGER)) FROM sqlite_stat1 GROUP BY tbl")
+
+SQLITE_DBSTAT_SQL = text("""
+    SELECT name, SUM(CASE WHEN pagetype = 'leaf' THEN ncell ELSE 0 END), SUM(pgsize)
+      FROM dbstat
+     GROUP BY name
+""")
+
+
+@dataclass
+class TableStats:
+    name: str
+    row_count: int
+    columns: int
+    size_bytes: int = None
+    estimated: bool = True
+
+
+@dataclass
+class DatabaseStats:
+    tables: list
+    collected_at: float
+    duration: float
+    exact: bool = False
+
+    def to_dict(self):
+        """Shape consumed by the Database Overview and Analytics views"""
+        return {
+            'table_count': len(self.tables),
+            'tables': {
+                table.name: {k: v for k, v in asdict(table).items() if k != 'name'}
+                for table in self.tables
+            },
+            'collected_at': self.collected_at,
+            'duration': self.duration,
+            'estimated': any(table.estimated for table in self.tables),
+        }
+
+
+def _schema(db):
+    return getattr(db, '_schema', None)
+
+
+def _postgres_stats(conn, db, exact):
+    rows = conn.execute(POSTGRES_STATS_SQL, {'schema': _schema(db)})
+    return [TableStats(name, int(count), int(cols), int(size)) for name, count, cols, size in rows]
+
+
+def _mysql_stats(conn, db, exact):
+    rows = conn.execute(MYSQL_STATS_SQL, {'schema': _schema(db)})
+    return [TableStats(name, int(count), int(cols), int(size)) for name, count, cols, size in rows]
+
+
+def _exact_sqlite_counts(conn, tables):
+    if not tables:
+        return {}
+    union = " UNION ALL ".join(
+        f"SELECT '{name.replace(chr(39), chr(39) * 2)}', COUNT(*) FROM \"{name.replace(chr(34), chr(34) * 2)}\""
+        for name in tables
+    )
+    return {name: count for name, count in conn.execute(text(union))}
+
+
+def _sqlite_rowid_estimates(conn, tables):
+    """MAX(rowid) per table: one b-tree descent each, exact unless rows were deleted"""
+    estimates = {}
+    for name in tables:
+        try:
+            estimates[name] = conn.execute(
+                text(f"SELECT COALESCE(MAX(rowid), 0) FROM \"{name.replace(chr(34), chr(34) * 2)}\"")
+            ).scalar()
+        except Exception:
+            pass  # WITHOUT ROWID table; counted below
+    return estimates
+
+
+def _sqlite_stats(conn, db, exact):
+    columns = {name: count for name, count in conn.execute(SQLITE_COLUMNS_SQL)}
+
+    estimates, counts, sizes = {}, {}, {}
+    if exact:
+        try:
+            # Leaf cells of a table b-tree are its rows, so dbstat gives exact counts and sizes.
+            # It reads every page of the file, which is why estimate mode never uses it.
+            for name, cells, size in conn.execute(SQLITE_DBSTAT_SQL):
+                sizes[name] = size
+                if name in columns:
+                    counts[name] = cells
+        except Exception:
+            pass  # SQLite built without the dbstat virtual table
+    else:
+        try:
+            estimates = {tbl: count for tbl, count in conn.execute(SQLITE_STAT1_SQL) if tbl in columns}
+        except Exception:
+            pass  # ANALYZE has never been run
+        estimates.update(_sqlite_rowid_estimates(conn, [name for name in columns if name not in estimates]))
+
+    # Anything still unknown is counted directly, in a single statement
+    missing = [name for name in columns if name not in estimates and name not in counts]
+    counts.update(_exact_sqlite_counts(conn, missing))
+
+    return [
+        TableStats(
+            name,
+            int(counts[name] if name in counts else estimates[name]),
+            cols,
+            sizes.get(name),
+            estimated=name not in counts,
+        )
+        for name, cols in columns.items()
+    ]
+
+
+PROVIDERS = {
+    'postgresql': _postgres_stats,
+    'mysql': _mysql_stats,
+    'mariadb': _mysql_stats,
+    'sqlite': _sqlite_stats,
+}
+
+
+def collect_statistics(db, exact=False):
+    """Fetch row and column counts for every usable table from the catalog in one or two round trips"""
+    engine = db._engine
+    provider = PROVIDERS.get(engine.dialect.name)
+    if provider is None:
+        raise ValueError(f"No statistics provider for dialect '{engine.dialect.name}'")
+
+    start = time.perf_counter()
+    with engine.connect() as conn:
+        tables = provider(conn, db, exact)
+    usable = set(db.get_usable_table_names())
+    tables = sorted((t for t in tables if t.name in usable), key=lambda t: t.name)
+    return DatabaseStats(tables, time.time(), time.perf_counter() - start, exact)
+
+
+class StatsCache:
+    """TTL cache of DatabaseStats per engine with background refresh"""
+
+    def __init__(self, ttl=DEFAULT_STATS_TTL, max_workers=2):
+        self.ttl = ttl
+        self._entries = weakref.WeakKeyDictionary()
+        self._pending = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-stats")
+
+    def get(self, db, exact=False):
+        """Cached stats for db; collects synchronously only when nothing is cached yet"""
+        engine = db._engine
+        with self._lock:
+            stats = self._entries.get(engine)
+        if stats is None or (exact and not stats.exact):
+            stats = self._collect(db, exact)
+        elif time.time() - stats.collected_at > self.ttl:
+            self.refresh(db, exact)
+        return stats
+
+    def refresh(self, db, exact=False):
+        """Recollect stats in the background; returns the pending future"""
+        engine = db._engine
+        with self._lock:
+            future = self._pending.get(engine)
+            if future is not None and not future.done():
+                return future
+            future = self._executor.submit(self._collect, db, exact)
+            self._pending[engine] = future
+            return future
+
+    def is_refreshing(self, db):
+        with self._lock:
+            future = self._pending.get(db._engine)
+        return future is not None and not future.done()
+
+    def _collect(self, db, exact):
+        stats = collect_statistics(db, exact)
+        with self._lock:
+            self._entries[db._engine] = stats
+        return stats
+
+
+stats_cache = StatsCache()
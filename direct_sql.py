@@ -0,0 +1,148 @@
+import re
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import duckdb
+
+from result_capture import QueryResult
+from result_stream import DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS, ResultStream, open_stream
+
+EXPLAIN_SAMPLE_ROWS = 20
+
+READ_ONLY_KEYWORDS = {"SELECT", "WITH", "SHOW", "EXPLAIN", "DESCRIBE", "DESC", "PRAGMA", "VALUES", "TABLE"}
+WRITE_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "MERGE", "UPSERT", "REPLACE", "CREATE", "ALTER", "DROP", "TRUNCATE",
+    "GRANT", "REVOKE", "ATTACH", "DETACH", "VACUUM", "REINDEX", "ANALYZE", "COPY", "CALL", "EXEC",
+    "EXECUTE", "LOCK", "SET", "BEGIN", "COMMIT", "ROLLBACK", "LOAD", "USE",
+}
+# Anywhere in a statement these turn an otherwise read-only query into a write:
+# data-modifying CTEs, SELECT ... INTO, SELECT ... FOR UPDATE and friends
+WRITE_PATTERN = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|ALTER|DROP|TRUNCATE|GRANT|REVOKE|ATTACH|DETACH|COPY|CALL|INTO)\b",
+    re.IGNORECASE,
+)
+# Characters English questions rarely contain but SQL nearly always does
+SQL_PUNCTUATION = re.compile(r"[*(),=<>;.']")
+# Fallback for dialects DuckDB cannot parse: keywords written as SQL, not as a sentence
+SQL_SHAPE = re.compile(r"^(SELECT\b.+\bFROM|WITH\b.+\bAS\s*\(|SHOW|DESCRIBE|EXPLAIN|PRAGMA)\b", re.DOTALL)
+
+_parser = None
+_parser_lock = threading.Lock()
+
+EXPLAIN_RESULT_PROMPT = """You are a data analyst. Explain what the result of this SQL query shows, in a few sentences for a non-technical reader.
+Point out notable values, trends or outliers visible in the rows. Do not invent values that are not shown.
+
+SQL:
+{sql}
+
+The query returned {row_count} rows with columns: {columns}
+First rows:
+{sample}"""
+
+
+@dataclass
+class StatementCheck:
+    sql: str
+    keyword: str
+    read_only: bool
+    reason: str = None
+
+
+def _mask_literals(sql):
+    """SQL with comments removed and string literals / quoted identifiers blanked out"""
+    sql = re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    return re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`", "''", sql)
+
+
+def classify_statement(sql):
+    """Decide whether sql is a single read-only statement that can run without the agent"""
+    statements = [part for part in _mask_literals(sql).split(";") if part.strip()]
+    if not statements:
+        return StatementCheck("", "", False, "No SQL statement given")
+    if len(statements) > 1:
+        return StatementCheck(sql, "", False, "Only one statement can be executed at a time")
+
+    statement = sql.strip().rstrip(";").strip()
+    masked = statements[0]
+    keyword = masked.split()[0].upper()
+    if keyword not in READ_ONLY_KEYWORDS:
+        return StatementCheck(statement, keyword, False, f"{keyword} statements are not allowed; only read-only queries can be executed")
+    match = WRITE_PATTERN.search(masked)
+    if match:
+        return StatementCheck(statement, keyword, False, f"{match.group(1).upper()} is not allowed in a read-only query")
+    if keyword == "PRAGMA" and "=" in masked:
+        return StatementCheck(statement, keyword, False, "PRAGMA assignments are not allowed")
+    return StatementCheck(statement, keyword, True)
+
+
+@contextmanager
+def sql_parser():
+    """Shared in-memory DuckDB connection used only to parse SQL, held under a lock"""
+    global _parser
+    with _parser_lock:
+        if _parser is None:
+            _parser = duckdb.connect(config={
+                "enable_external_access": False,
+                "autoinstall_known_extensions": False,
+                "autoload_known_extensions": False,
+            })
+        yield _parser
+
+
+def _parses(text):
+    try:
+        with sql_parser() as parser:
+            return bool(parser.extract_statements(text.replace("`", '"')))
+    except duckdb.Error:
+        return False
+
+
+def looks_like_sql(text):
+    """Batch lines: SQL rather than an English question that happens to start with 'Show' or 'Select'
+
+    A line must parse as SQL and carry some SQL signal (uppercase keyword or
+    SQL punctuation), since "Select the students from Boston" parses too.
+    Lines in a dialect DuckDB cannot parse need uppercase SQL keyword structure.
+    """
+    words = _mask_literals(text).split()
+    if not words or text.rstrip().endswith("?"):
+        return False
+    if words[0].upper() not in READ_ONLY_KEYWORDS | WRITE_KEYWORDS:
+        return False
+    if _parses(text):
+        return words[0].isupper() or bool(SQL_PUNCTUATION.search(text))
+    return bool(SQL_SHAPE.match(text.strip()))
+
+
+def open_readonly_stream(db, sql, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES):
+    """ResultStream over sql if it is a single read-only statement, else a stream carrying the rejection"""
+    check = classify_statement(sql)
+    if not check.read_only:
+        return ResultStream(db, sql, error=check.reason)
+    return open_stream(db, check.sql, max_rows, max_bytes, read_only=True)
+
+
+def run_readonly(db, sql, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES):
+    """Execute one read-only statement on the pooled engine and return a typed QueryResult"""
+    stream = open_readonly_stream(db, sql, max_rows, max_bytes).fetch_all()
+    if stream.error:
+        return QueryResult(stream.sql, duration=stream.duration, error=stream.error)
+    return QueryResult(stream.sql, stream.frame(), stream.duration, truncated=stream.truncated)
+
+
+def explain_result(llm, stream, sample_rows=EXPLAIN_SAMPLE_ROWS):
+    """Ask the LLM for a plain-language reading of a result it did not produce"""
+    frame = stream.rows(0, sample_rows)
+    if stream.exhausted:
+        row_count = f"{stream.row_count:,}" + (" or more" if stream.truncated else "")
+    else:
+        row_count = f"at least {stream.row_count:,}"
+    prompt = EXPLAIN_RESULT_PROMPT.format(
+        sql=stream.sql,
+        row_count=row_count,
+        columns=", ".join(map(str, frame.columns)),
+        sample=frame.to_string(index=False),
+    )
+    reply = llm.invoke(prompt)
+    return getattr(reply, "content", reply)
@@ -0,0 +1,50 @@
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_encoders = {}
+_failed = set()
+_lock = threading.Lock()
+
+
+def get_sentence_encoder(model_name=EMBEDDING_MODEL):
+    """Process-wide SentenceTransformer, or None when sentence-transformers is unavailable"""
+    with _lock:
+        if model_name in _failed:
+            return None
+        encoder = _encoders.get(model_name)
+        if encoder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+                encoder = SentenceTransformer(model_name)
+            except Exception as e:
+                print(f"Local embeddings disabled ({model_name}): {e}")
+                _failed.add(model_name)
+                return None
+            _encoders[model_name] = encoder
+        return encoder
+
+
+def encode(texts, model_name=EMBEDDING_MODEL):
+    """Unit-length float32 embeddings for texts, or None without a local model"""
+    encoder = get_sentence_encoder(model_name)
+    if encoder is None:
+        return None
+    vectors = encoder.encode(texts, normalize_embeddings=True, batch_size=64)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+class LocalEmbeddings(Embeddings):
+    """LangChain adapter over the shared local sentence-transformers model"""
+
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        return encode(list(texts), self.model_name).tolist()
+
+    def embed_query(self, text):
+        return encode([text], self.model_name)[0].tolist()
@@ -0,0 +1,260 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+from agent_factory import agent_factory
+from agent_runner import DEFAULT_TIMEOUT, runner
+from connections import database_identity, get_sql_database
+from db_stats import stats_cache
+from direct_sql import open_readonly_stream
+from history_store import PAGE_SIZE, history_store
+from llm_gateway import INTERACTIVE
+from optimizer import explain as explain_plan, suggest_indexes
+from query_cache import query_cache
+from result_cache import caching_enabled
+from result_capture import execute_query
+from result_stream import DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS
+from sample_db import build_sample_db
+from schema_context import answer_single_shot, get_schema_snapshot, question_with_context
+from tracing import record_trace, start_trace, trace_span
+from uploads import readonly_creator, store_upload
+
+# Database connection types
+POSTGRES = "POSTGRES"
+POSTGRES_URL = "POSTGRES_URL"
+LOCALDB = "USE_LOCALDB"
+MYSQL = "USE_MYSQL"
+SQLITE_FILE = "SQLITE_FILE"
+
+MODELS = ["llama3-8b-8192", "llama3-70b-8192", "mixtral-8x7b-32768"]
+DEFAULT_TEMPERATURE = 0.1
+AGENT_MODE = "agent"
+SINGLE_SHOT_MODE = "single"
+# Engines kept per process; each holds an LLM client and an agent
+MAX_ENGINES = 16
+
+
+def validate_postgres_url(url):
+    """Validate PostgreSQL connection URL format"""
+    try:
+        parsed = urlparse(url)
+        if parsed.scheme not in ['postgresql', 'postgres']:
+            return False, "URL must start with 'postgresql://' or 'postgres://'"
+        if not parsed.hostname:
+            return False, "Missing hostname in URL"
+        if not parsed.username:
+            return False, "Missing username in URL"
+        if not parsed.password:
+            return False, "Missing password in URL"
+        return True, "Valid PostgreSQL URL"
+    except Exception as e:
+        return False, f"Invalid URL format: {str(e)}"
+
+
+def connect_database(db_uri, **kwargs):
+    """SQLDatabase for one of the connection types; raises when the settings are incomplete or invalid"""
+    pool_settings = kwargs.get('pool_settings')
+    if db_uri == LOCALDB:
+        dbfilepath = build_sample_db(kwargs.get('sample_scale', 1))
+        creator = lambda: sqlite3.connect(f"file:{dbfilepath}?mode=rw", uri=True)
+        return get_sql_database("sqlite:///", creator=creator, path=str(dbfilepath)).db
+
+    elif db_uri == SQLITE_FILE:
+        uploaded_file = kwargs.get('uploaded_file')
+        stored_path = store_upload(uploaded_file) if uploaded_file else kwargs.get('sqlite_path')
+        if not stored_path:
+            raise Exception("A SQLite file is required")
+        return get_sql_database("sqlite:///", creator=readonly_creator(stored_path), path=str(stored_path)).db
+
+    elif db_uri == MYSQL:
+        connection_string = f"mysql+pymysql://{kwargs['mysql_user']}:{kwargs['mysql_password']}@{kwargs['mysql_host']}:{kwargs.get('mysql_port', 3306)}/{kwargs['mysql_db']}"
+        return get_sql_database(connection_string, pool_settings=pool_settings).db
+
+    elif db_uri == POSTGRES:
+        connection_string = f"postgresql+psycopg2://{kwargs['mysql_user']}:{kwargs['mysql_password']}@{kwargs['mysql_host']}:{kwargs.get('mysql_port', 5432)}/{kwargs['mysql_db']}"
+        return get_sql_database(connection_string, pool_settings=pool_settings).db
+
+    elif db_uri == POSTGRES_URL:
+        postgres_url = kwargs.get('postgres_url')
+        if not postgres_url:
+            raise Exception("PostgreSQL URL is required")
+
+        # Validate URL format
+        is_valid, message = validate_postgres_url(postgres_url)
+        if not is_valid:
+            raise Exception(message)
+
+        # Handle both 'postgres://' and 'postgresql://' schemes
+        if postgres_url.startswith('postgres://'):
+            postgres_url = postgres_url.replace('postgres://', 'postgresql://', 1)
+
+        # Use psycopg2 driver
+        if '+psycopg2' not in postgres_url:
+            postgres_url = postgres_url.replace('postgresql://', 'postgresql+psycopg2://', 1)
+
+        return get_sql_database(postgres_url, pool_settings=pool_settings).db
+
+    raise Exception(f"Unknown database type: {db_uri}")
+
+
+def connect_from_env(pool_settings=None):
+    """Database named by SQL_CHAT_DATABASE_URL, or the sample database at SQL_CHAT_SAMPLE_SCALE"""
+    url = os.environ.get("SQL_CHAT_DATABASE_URL")
+    if not url:
+        return connect_database(LOCALDB, sample_scale=int(os.environ.get("SQL_CHAT_SAMPLE_SCALE", "1")))
+    if url.startswith(("postgres://", "postgresql://")):
+        return connect_database(POSTGRES_URL, postgres_url=url, pool_settings=pool_settings)
+    if url.startswith("sqlite:///"):
+        return connect_database(SQLITE_FILE, sqlite_path=url[len("sqlite:///"):])
+    return get_sql_database(url, pool_settings=pool_settings).db
+
+
+@dataclass
+class Answer:
+    """Outcome of one question, whichever path answered it"""
+    question: str
+    answer: str
+    sql: list
+    result: object
+    execution_time: float
+    mode: str
+    cache_hit: object = None
+    trace: object = None
+
+
+class Engine:
+    """A connected database with its LLM and agent, shared by every caller in the process
+
+    The LLM client and agent come from the process-wide agent factory on
+    use, so SQL, statistics and history work without an API key.
+    """
+
+    def __init__(self, db, api_key=None, model=MODELS[0], temperature=DEFAULT_TEMPERATURE, verbose=True):
+        self.db = db
+        self.identity = database_identity(db)
+        self.api_key = api_key
+        self.model = model
+        self.temperature = temperature
+        self.verbose = verbose
+
+    @property
+    def agent_key(self):
+        """Agent factory key this engine's agent is cached under"""
+        return agent_factory.key(self.db, self.model, self.temperature, self.api_key, verbose=self.verbose)
+
+    def _agent_pair(self):
+        if not self.api_key:
+            raise ValueError("A Groq API key is required to answer questions")
+        return agent_factory.get(self.db, self.api_key, self.model, self.temperature, verbose=self.verbose)
+
+    @property
+    def llm(self):
+        return self._agent_pair()[0]
+
+    @property
+    def agent(self):
+        return self._agent_pair()[1]
+
+    @property
+    def schema(self):
+        return get_schema_snapshot(self.db)
+
+    def statistics(self):
+        return stats_cache.get(self.db).to_dict()
+
+    def lookup_cache(self, question):
+        """(CacheHit, fresh QueryResult) for a cached question, else (None, None)"""
+        if not caching_enabled():
+            return None, None
+        with trace_span("cache", "lookup"):
+            try:
+                hit = query_cache.lookup(self.db, question, self.model)
+            except Exception as e:
+                print(f"Query cache lookup failed: {e}")
+                hit = None
+        if hit is None:
+            return None, None
+        # Skip the LLM and only re-run the stored SQL against current data
+        result = execute_query(self.db, hit.sql)
+        if result.error:
+            return None, None
+        return hit, result
+
+    def submit(self, question, mode=AGENT_MODE, timeout=DEFAULT_TIMEOUT, trace=None, tags=None, priority=INTERACTIVE):
+        """Start a question on the background runner and return its AgentRun"""
+        tags = {"db_identity": self.identity, "mode": mode, "model": self.model, "priority": priority, **(tags or {})}
+        if mode == SINGLE_SHOT_MODE:
+            return runner.submit_sync(question, lambda: answer_single_shot(self.llm, self.db, question), timeout, trace, tags)
+        agent_input = lambda: question_with_context(self.db, self.schema, question)
+        return runner.submit_agent(self.agent, question, agent_input, timeout, trace, tags)
+
+    def cache_answer(self, question, result, answer):
+        if not caching_enabled():
+            return
+        try:
+            query_cache.store(self.db, question, self.model, result.sql, answer)
+        except Exception as e:
+            print(f"Query cache store failed: {e}")
+
+    def save_history(self, question, answer, execution_time, statements=None):
+        try:
+            history_store.record(self.identity, question, answer, execution_time, ";\n".join(statements or []))
+        except Exception as e:
+            print(f"Error saving query history: {e}")
+
+    def ask(self, question, mode=AGENT_MODE, timeout=DEFAULT_TIMEOUT, use_cache=True, priority=INTERACTIVE):
+        """Answer a question end to end, blocking until done; raises CancelledError or TimeoutError"""
+        start_time = time.time()
+        hit = None
+        # The trace starts here so cache time is counted; a cache miss continues it in the agent run
+        with start_trace(question, db_identity=self.identity, model=self.model) as trace:
+            if use_cache:
+                hit, result = self.lookup_cache(question)
+        if hit:
+            trace.tags["mode"] = "cache"
+            record_trace(trace)
+            answer = Answer(question, hit.answer, [hit.sql], result, time.time() - start_time, "cache", hit, trace)
+        else:
+            run = self.submit(question, mode, timeout, trace, priority=priority)
+            response, capture = run.result()
+            result = capture.last_result
+            if use_cache and result:
+                self.cache_answer(question, result, response)
+            answer = Answer(question, response, capture.statements, result, run.elapsed, mode, trace=run.trace)
+        self.save_history(question, answer.answer, answer.execution_time, answer.sql)
+        return answer
+
+    def run_sql(self, sql, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES):
+        """ResultStream over one read-only statement; rejected statements carry the reason as error"""
+        return open_readonly_stream(self.db, sql, max_rows, max_bytes)
+
+    def explain(self, sql, analyze=False):
+        """PlanReport for one read-only SELECT; analyze runs it to measure actual rows and times"""
+        return explain_plan(self.db, sql, analyze)
+
+    def index_candidates(self):
+        """Indexes the recorded query history would use, heaviest first"""
+        return suggest_indexes(self.db, history_store.workload(self.identity))
+
+    def history(self, text=None, favorites_only=False, limit=PAGE_SIZE, offset=0):
+        return history_store.search(text, self.identity, favorites_only, limit, offset)
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db, api_key=None, model=MODELS[0], temperature=DEFAULT_TEMPERATURE, verbose=True):
+    """Engine for these settings, built once per process so reruns and requests reuse the agent"""
+    key = (database_identity(db), model, temperature, hashlib.sha256((api_key or "").encode()).hexdigest())
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None or engine.db is not db:
+            engine = _engines[key] = Engine(db, api_key, model, temperature, verbose)
+            while len(_engines) > MAX_ENGINES:
+                _engines.pop(next(iter(_engines)))
+        return engine
@@ -0,0 +1,221 @@
+import importlib.util
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+import pandas as pd
+
+EXPORT_ROOT = Path(tempfile.gettempdir()) / "sql_chat_exports"
+# Spilled results and converted downloads per session; oldest files go first beyond this
+SESSION_QUOTA_BYTES = 512 * 1024 * 1024
+# Session directories untouched for this long are removed
+MAX_SESSION_AGE = 24 * 60 * 60
+CHUNK_ROWS = 50_000
+EXCEL_MAX_ROWS = 1_048_575
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    label: str
+    extension: str
+    mime: str
+    requires: str = None
+
+    @property
+    def available(self):
+        return self.requires is None or importlib.util.find_spec(self.requires) is not None
+
+
+FORMATS = {
+    "csv": ExportFormat("CSV", ".csv", "text/csv"),
+    "parquet": ExportFormat("Parquet", ".parquet", "application/vnd.apache.parquet", "pyarrow"),
+    "xlsx": ExportFormat("Excel", ".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "openpyxl"),
+}
+
+
+def available_formats():
+    return {key: fmt for key, fmt in FORMATS.items() if fmt.available}
+
+
+@dataclass
+class ExportFile:
+    """A result spilled to disk once; other formats are converted from it on demand"""
+    export_id: str
+    name: str
+    path: Path
+    fmt: str
+    rows: int
+    size: int
+
+
+def _chunks(source):
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, max(len(source), 1), CHUNK_ROWS):
+            yield source.iloc[start:start + CHUNK_ROWS]
+    else:
+        yield from source
+
+
+def _write_csv(path, chunks):
+    rows = 0
+    with open(path, "w", newline="", encoding="utf-8") as out:
+        for chunk in chunks:
+            chunk.to_csv(out, index=False, header=rows == 0)
+            rows += len(chunk)
+    return rows
+
+
+def _write_parquet(path, chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows, writer = 0, None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def _excel_value(value):
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.tz_localize(None).to_pydatetime() if value.tzinfo else value.to_pydatetime()
+    return value
+
+
+def _write_excel(path, chunks):
+    from openpyxl import Workbook
+
+    # Write-only workbooks stream rows to disk instead of holding every cell in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    rows = 0
+    for chunk in chunks:
+        if rows + len(chunk) > EXCEL_MAX_ROWS:
+            raise ValueError(f"Excel sheets hold at most {EXCEL_MAX_ROWS:,} rows")
+        if rows == 0:
+            sheet.append([str(column) for column in chunk.columns])
+        for row in chunk.astype(object).itertuples(index=False, name=None):
+            sheet.append([_excel_value(value) for value in row])
+        rows += len(chunk)
+    workbook.save(path)
+    return rows
+
+
+_WRITERS = {"csv": _write_csv, "parquet": _write_parquet, "xlsx": _write_excel}
+
+
+def _read_chunks(path, fmt):
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=CHUNK_ROWS):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=CHUNK_ROWS)
+
+
+def cleanup_exports(root=EXPORT_ROOT, max_age=MAX_SESSION_AGE):
+    """Remove session directories that have not been written to for max_age seconds"""
+    root = Path(root)
+    if not root.exists():
+        return
+    cutoff = time.time() - max_age
+    for directory in root.iterdir():
+        try:
+            if directory.is_dir() and directory.stat().st_mtime < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+        except OSError:
+            continue
+
+
+class ExportStore:
+    """Per-session spill directory for exported query results, bounded by a storage quota"""
+
+    def __init__(self, session_id=None, root=EXPORT_ROOT, quota=SESSION_QUOTA_BYTES):
+        cleanup_exports(root)
+        self.directory = Path(root) / (session_id or uuid.uuid4().hex)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.quota = quota
+        self._lock = threading.Lock()
+
+    def _write(self, path, fmt, chunks):
+        part = path.with_suffix(path.suffix + ".part")
+        try:
+            rows = _WRITERS[fmt](part, chunks)
+            part.replace(path)
+        finally:
+            part.unlink(missing_ok=True)
+        self._enforce_quota(keep=path)
+        return rows
+
+    def _enforce_quota(self, keep):
+        files = sorted((p for p in self.directory.iterdir() if p.is_file()), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in files)
+        for path in files:
+            if total <= self.quota:
+                break
+            if path != keep:
+                total -= path.stat().st_size
+                path.unlink(missing_ok=True)
+        if total > self.quota:
+            keep.unlink(missing_ok=True)
+            raise ValueError(f"Export is larger than the {self.quota // (1024 * 1024)} MB session quota")
+
+    def spill(self, source, name):
+        """Write a DataFrame or an iterable of DataFrame chunks to disk once and return an ExportFile"""
+        fmt = "parquet" if FORMATS["parquet"].available else "csv"
+        export_id = uuid.uuid4().hex[:12]
+        path = self.directory / f"{export_id}{FORMATS[fmt].extension}"
+        with self._lock:
+            rows = self._write(path, fmt, _chunks(source))
+        return ExportFile(export_id, name, path, fmt, rows, path.stat().st_size)
+
+    def exists(self, export):
+        """Whether the spilled copy of export is still on disk (quota and age cleanup remove it)"""
+        return export.path.exists()
+
+    def restore(self, export, source):
+        """Spill source again under export's id after its file expired, updating export in place"""
+        with self._lock:
+            for stale in self.directory.glob(f"{export.export_id}.*"):
+                stale.unlink(missing_ok=True)
+            export.rows = self._write(export.path, export.fmt, _chunks(source))
+        export.size = export.path.stat().st_size
+        return export
+
+    def path_for(self, export, fmt):
+        """File holding export in fmt, converting from the spilled copy the first time it is asked for"""
+        target = self.directory / f"{export.export_id}{FORMATS[fmt].extension}"
+        with self._lock:
+            if not target.exists():
+                if not export.path.exists():
+                    raise FileNotFoundError("This export has expired; run the query again")
+                self._write(target, fmt, _read_chunks(export.path, export.fmt))
+        return target
+
+    def reader(self, export, fmt):
+        """Callable for st.download_button that reads the file only when the download is requested"""
+        return lambda: self.path_for(export, fmt).read_bytes()
+
+    def usage(self):
+        return sum(p.stat().st_size for p in self.directory.iterdir() if p.is_file())
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory.mkdir(parents=True, exist_ok=True)
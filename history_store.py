@@ -0,0 +1,221 @@
+import os
+import re
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+HISTORY_PATH = Path(os.environ.get(
+    "SQL_CHAT_HISTORY_PATH", Path(tempfile.gettempdir()) / "sql_chat_cache" / "history.db"
+))
+PAGE_SIZE = 10
+# Distinct recorded statements read when mining the workload for index suggestions
+WORKLOAD_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_history (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    db_identity TEXT NOT NULL,
+    query TEXT NOT NULL,
+    sql TEXT NOT NULL DEFAULT '',
+    response TEXT NOT NULL DEFAULT '',
+    execution_time REAL NOT NULL DEFAULT 0,
+    favorited INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_history_created ON query_history (created_at);
+-- execution_time makes this covering for the per-database summary
+CREATE INDEX IF NOT EXISTS idx_history_db_created ON query_history (db_identity, created_at, execution_time);
+CREATE INDEX IF NOT EXISTS idx_history_query ON query_history (db_identity, query);
+CREATE INDEX IF NOT EXISTS idx_history_favorites ON query_history (db_identity, query, created_at) WHERE favorited = 1;
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS query_history_fts USING fts5(
+    query, sql, content='query_history', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS query_history_ai AFTER INSERT ON query_history BEGIN
+    INSERT INTO query_history_fts (rowid, query, sql) VALUES (new.id, new.query, new.sql);
+END;
+CREATE TRIGGER IF NOT EXISTS query_history_ad AFTER DELETE ON query_history BEGIN
+    INSERT INTO query_history_fts (query_history_fts, rowid, query, sql) VALUES ('delete', old.id, old.query, old.sql);
+END;
+CREATE TRIGGER IF NOT EXISTS query_history_au AFTER UPDATE OF query, sql ON query_history BEGIN
+    INSERT INTO query_history_fts (query_history_fts, rowid, query, sql) VALUES ('delete', old.id, old.query, old.sql);
+    INSERT INTO query_history_fts (rowid, query, sql) VALUES (new.id, new.query, new.sql);
+END;
+"""
+
+COLUMNS = "h.id, h.created_at, h.db_identity, h.query, h.sql, h.response, h.execution_time, h.favorited"
+
+
+@dataclass
+class HistoryEntry:
+    id: int
+    created_at: float
+    db_identity: str
+    query: str
+    sql: str
+    response: str
+    execution_time: float
+    favorited: bool
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.created_at).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _fts_query(text):
+    """Prefix match on every word, quoted so user input cannot inject FTS syntax"""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def _identity_filter(db_identity, column="db_identity"):
+    """Condition on one database identity or any of a collection of them"""
+    if isinstance(db_identity, str):
+        return f"{column} = ?", [db_identity]
+    identities = list(db_identity)
+    return f"{column} IN ({', '.join('?' * len(identities))})", identities
+
+
+class HistoryStore:
+    """Query history and favorites in a local SQLite file, searchable with FTS5"""
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            try:
+                conn.executescript(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                # SQLite built without FTS5; search falls back to LIKE
+                print(f"History full-text search unavailable: {e}")
+                self.fts = False
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, db_identity, query, response, execution_time, sql=""):
+        """Add one executed query; returns its id. Re-runs of a favorite stay favorited"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO query_history (created_at, db_identity, query, sql, response, execution_time, favorited) "
+                "VALUES (?, ?, ?, ?, ?, ?, EXISTS (SELECT 1 FROM query_history "
+                "WHERE favorited = 1 AND db_identity = ? AND query = ?))",
+                (time.time(), db_identity, query, sql or "", response or "", execution_time, db_identity, query),
+            )
+            return cursor.lastrowid
+
+    def _filters(self, text, db_identity, favorites_only):
+        where, params = [], []
+        if text and _fts_query(text):
+            if self.fts:
+                # A subquery keeps the FTS index as the driver; a join lets the planner re-run MATCH per row
+                where.append("h.id IN (SELECT rowid FROM query_history_fts WHERE query_history_fts MATCH ?)")
+                params.append(_fts_query(text))
+            else:
+                where.append("(h.query LIKE ? OR h.sql LIKE ?)")
+                params += [f"%{text}%"] * 2
+        if db_identity is not None:
+            condition, identities = _identity_filter(db_identity, "h.db_identity")
+            where.append(condition)
+            params += identities
+        if favorites_only:
+            where.append("h.favorited = 1")
+        return (" WHERE " + " AND ".join(where)) if where else "", params
+
+    def search(self, text=None, db_identity=None, favorites_only=False, limit=PAGE_SIZE, offset=0):
+        """Newest-first page of entries matching text in the question or SQL
+
+        db_identity is one identity or a collection of them; None searches every database
+        """
+        where, params = self._filters(text, db_identity, favorites_only)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {COLUMNS} FROM query_history h{where} ORDER BY h.created_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return [HistoryEntry(*row) for row in rows]
+
+    def count(self, text=None, db_identity=None, favorites_only=False):
+        where, params = self._filters(text, db_identity, favorites_only)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM query_history h{where}", params).fetchone()[0]
+
+    def favorites(self, db_identity=None, limit=PAGE_SIZE, offset=0):
+        """Most recent run of each favorited question"""
+        where, params = self._favorite_filter(db_identity)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {COLUMNS} FROM query_history h WHERE h.id IN ("
+                f"SELECT MAX(id) FROM query_history WHERE favorited = 1 {where} GROUP BY db_identity, query"
+                ") ORDER BY h.created_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return [HistoryEntry(*row) for row in rows]
+
+    @staticmethod
+    def _favorite_filter(db_identity):
+        if db_identity is None:
+            return "", []
+        condition, params = _identity_filter(db_identity)
+        return f"AND {condition}", params
+
+    def favorite_count(self, db_identity=None):
+        where, params = self._favorite_filter(db_identity)
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM query_history WHERE favorited = 1 {where} "
+                "GROUP BY db_identity, query)",
+                params,
+            ).fetchone()[0]
+
+    def set_favorite(self, entry, favorited=True):
+        """Flag every run of entry's question on its database"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE query_history SET favorited = ? WHERE db_identity = ? AND query = ?",
+                (int(favorited), entry.db_identity, entry.query),
+            )
+
+    def workload(self, db_identity=None, limit=WORKLOAD_SIZE):
+        """(sql, runs, total execution time) of the most-run recorded SQL, heaviest first"""
+        where, params = ("AND db_identity = ?", [db_identity]) if db_identity else ("", [])
+        with self._connect() as conn:
+            return conn.execute(
+                f"SELECT sql, COUNT(*), SUM(execution_time) FROM query_history WHERE sql != '' {where} "
+                "GROUP BY sql ORDER BY COUNT(*) DESC, SUM(execution_time) DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+
+    def summary(self, db_identity=None):
+        """(query count, average execution time) for the Analytics tab and sidebar"""
+        where, params = ("WHERE db_identity = ?", [db_identity]) if db_identity else ("", [])
+        with self._connect() as conn:
+            count, average = conn.execute(
+                f"SELECT COUNT(*), AVG(execution_time) FROM query_history {where}", params
+            ).fetchone()
+        return count, average or 0.0
+
+    def clear(self, db_identity=None):
+        with self._connect() as conn:
+            if db_identity is None:
+                conn.execute("DELETE FROM query_history")
+            else:
+                conn.execute("DELETE FROM query_history WHERE db_identity = ?", (db_identity,))
+
+
+history_store = HistoryStore()
@@ -0,0 +1,412 @@
+import asyncio
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+import groq
+from langchain_core.language_models.chat_models import agenerate_from_stream, generate_from_stream
+from langchain_groq import ChatGroq
+
+# Request priorities; interactive questions are always granted before queued batch ones
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+# Groq free-tier limits as (requests, tokens) per minute; SQL_CHAT_LLM_RPM / SQL_CHAT_LLM_TPM override them
+MODEL_LIMITS = {
+    "llama3-8b-8192": (30, 30_000),
+    "llama3-70b-8192": (30, 6_000),
+    "mixtral-8x7b-32768": (30, 5_000),
+}
+DEFAULT_LIMITS = (30, 6_000)
+# Completion tokens reserved when a request sets no max_tokens; corrected once usage is reported
+DEFAULT_COMPLETION_TOKENS = 512
+CHARS_PER_TOKEN = 4
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+# Capacity and gateway errors worth retrying; other 4xx responses fail straight away
+RETRY_STATUSES = {429, 498, 500, 502, 503, 504}
+# How often a request that is not at the head of its queue checks again
+QUEUE_POLL = 0.05
+WAIT_WINDOW = 500
+
+current_priority = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+
+class TokenBucket:
+    """Budget refilled continuously at a per-minute rate, up to one minute's worth"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available; requests larger than the bucket wait for a full one"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def pause(self, seconds):
+        """Hold back every request for seconds, as after a 429 from upstream"""
+        self._refill(time.monotonic())
+        self.level = min(self.level, 1 - seconds * self.rate)
+
+
+@dataclass(order=True)
+class _Ticket:
+    rank: int
+    seq: int
+    tokens: int = field(compare=False)
+    priority: str = field(compare=False)
+    enqueued: float = field(compare=False, default_factory=time.monotonic)
+
+
+class _Lane:
+    """Buckets and waiting requests for one model under one API key"""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.queue = []
+
+
+class _Abandoned(Exception):
+    """The request a caller was sharing went away before finishing"""
+
+
+def model_limits(model):
+    rpm, tpm = MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+    return int(os.environ.get("SQL_CHAT_LLM_RPM", rpm)), int(os.environ.get("SQL_CHAT_LLM_TPM", tpm))
+
+
+def api_key_hash(api_key):
+    """Short digest of an API key; each key has its own limits and its own answers"""
+    if api_key is None:
+        return ""
+    if hasattr(api_key, "get_secret_value"):
+        api_key = api_key.get_secret_value()
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def _retryable(error):
+    if isinstance(error, (groq.RateLimitError, groq.APIConnectionError)):
+        return True
+    return isinstance(error, groq.APIStatusError) and error.status_code in RETRY_STATUSES
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LLMGateway:
+    """Process-wide scheduler in front of the LLM endpoint
+
+    Each (model, API key) pair has a request bucket and a token bucket sized
+    from the model's per-minute limits. Callers queue by priority and are
+    granted in order once both buckets allow; 429s and capacity errors are
+    retried with jittered exponential backoff (or the server's Retry-After)
+    and pause that queue. Concurrent identical requests share one upstream call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._lanes = {}
+        self._flights = {}
+        self._seq = itertools.count()
+        self.waits = {name: deque(maxlen=WAIT_WINDOW) for name in PRIORITIES}
+        self.requests = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+    def _lane(self, model, account=""):
+        lane = self._lanes.get((model, account))
+        if lane is None:
+            lane = self._lanes[(model, account)] = _Lane(*model_limits(model))
+        return lane
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _enqueue(self, model, account, tokens, priority_name):
+        with self._lock:
+            lane = self._lane(model, account)
+            ticket = _Ticket(PRIORITIES.get(priority_name, 0), next(self._seq), tokens, priority_name)
+            heapq.heappush(lane.queue, ticket)
+            return lane, ticket
+
+    def _try_grant(self, lane, ticket):
+        """0 once ticket is granted, else seconds to wait before trying again; called under the lock"""
+        if lane.queue[0] is not ticket:
+            return QUEUE_POLL
+        now = time.monotonic()
+        wait = max(lane.requests.wait_time(1, now), lane.tokens.wait_time(ticket.tokens, now))
+        if wait:
+            return wait
+        lane.requests.take(1)
+        lane.tokens.take(ticket.tokens)
+        heapq.heappop(lane.queue)
+        self.waits.setdefault(ticket.priority, deque(maxlen=WAIT_WINDOW)).append(now - ticket.enqueued)
+        self.upstream_calls += 1
+        self._lock.notify_all()
+        return 0.0
+
+    def _withdraw(self, lane, ticket):
+        with self._lock:
+            if ticket in lane.queue:
+                lane.queue.remove(ticket)
+                heapq.heapify(lane.queue)
+                self._lock.notify_all()
+
+    def acquire(self, model, tokens, priority_name=None, account=""):
+        """Block until the model's limits allow a request of this many tokens"""
+        lane, ticket = self._enqueue(model, account, tokens, priority_name or current_priority.get())
+        try:
+            with self._lock:
+                while wait := self._try_grant(lane, ticket):
+                    self._lock.wait(wait)
+        except BaseException:
+            self._withdraw(lane, ticket)
+            raise
+
+    async def aacquire(self, model, tokens, priority_name=None, account=""):
+        """acquire without blocking the event loop; a cancelled caller leaves the queue"""
+        lane, ticket = self._enqueue(model, account, tokens, priority_name or current_priority.get())
+        try:
+            while True:
+                with self._lock:
+                    wait = self._try_grant(lane, ticket)
+                if not wait:
+                    return
+                await asyncio.sleep(min(wait, 1.0))
+        except BaseException:
+            self._withdraw(lane, ticket)
+            raise
+
+    def _backoff(self, model, account, attempt, error):
+        """Seconds to wait before retrying; rate limits also hold back the rest of the model's queue"""
+        delay = _retry_after(error)
+        if delay is None:
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        with self._lock:
+            self.retries += 1
+            if isinstance(error, groq.RateLimitError):
+                self.rate_limited += 1
+                self._lane(model, account).requests.pause(delay)
+        return delay
+
+    def _settle(self, model, account, reserved, chunks):
+        """Give back reserved tokens the request did not use, once upstream reports usage"""
+        used = sum((getattr(chunk.message, "usage_metadata", None) or {}).get("total_tokens", 0) for chunk in chunks)
+        if used:
+            with self._lock:
+                self._lane(model, account).tokens.level += reserved - used
+
+    def _join(self, key):
+        """(flight, leading): the in-flight request for key, started by this caller if leading"""
+        with self._lock:
+            self.requests += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Future()
+            return flight, True
+
+    def _land(self, key, flight):
+        if not flight.done():
+            flight.set_exception(_Abandoned())
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stream(self, model, key, tokens, open_stream, account=""):
+        """Chunks of open_stream(), scheduled, retried and shared with identical concurrent requests
+
+        Only requests that failed before their first chunk are retried.
+        """
+        while True:
+            flight, leading = self._join(key)
+            if leading:
+                break
+            try:
+                chunks = flight.result()
+            except _Abandoned:
+                continue
+            self._count("coalesced")
+            for chunk in chunks:
+                yield chunk.model_copy(deep=True)
+            return
+
+        chunks = []
+        try:
+            for attempt in itertools.count():
+                self.acquire(model, tokens, account=account)
+                try:
+                    for chunk in open_stream():
+                        chunks.append(chunk)
+                        yield chunk
+                    break
+                except Exception as e:
+                    if chunks or attempt >= MAX_RETRIES or not _retryable(e):
+                        raise
+                    time.sleep(self._backoff(model, account, attempt, e))
+            self._settle(model, account, tokens, chunks)
+            flight.set_result(chunks)
+        except Exception as e:
+            self._count("failures")
+            flight.set_exception(e)
+            raise
+        finally:
+            self._land(key, flight)
+
+    async def astream(self, model, key, tokens, open_stream, account=""):
+        """Async stream(); open_stream() returns an async iterator"""
+        while True:
+            flight, leading = self._join(key)
+            if leading:
+                break
+            try:
+                # Shielded so a cancelled follower does not cancel the shared request
+                chunks = await asyncio.shield(asyncio.wrap_future(flight))
+            except _Abandoned:
+                continue
+            self._count("coalesced")
+            for chunk in chunks:
+                yield chunk.model_copy(deep=True)
+            return
+
+        chunks = []
+        try:
+            for attempt in itertools.count():
+                await self.aacquire(model, tokens, account=account)
+                try:
+                    async for chunk in open_stream():
+                        chunks.append(chunk)
+                        yield chunk
+                    break
+                except Exception as e:
+                    if chunks or attempt >= MAX_RETRIES or not _retryable(e):
+                        raise
+                    await asyncio.sleep(self._backoff(model, account, attempt, e))
+            self._settle(model, account, tokens, chunks)
+            flight.set_result(chunks)
+        except Exception as e:
+            self._count("failures")
+            flight.set_exception(e)
+            raise
+        finally:
+            self._land(key, flight)
+
+    def stats(self):
+        """Queue depth, call counts and queue wait percentiles in milliseconds per priority"""
+        with self._lock:
+            waits = {}
+            for name, values in self.waits.items():
+                waits[name] = {
+                    "count": len(values),
+                    "p50_ms": 1000 * _percentile(values, 0.5) if values else None,
+                    "p95_ms": 1000 * _percentile(values, 0.95) if values else None,
+                    "max_ms": 1000 * max(values) if values else None,
+                }
+            return {
+                "queued": sum(len(lane.queue) for lane in self._lanes.values()),
+                "in_flight": len(self._flights),
+                "requests": self.requests,
+                "upstream_calls": self.upstream_calls,
+                "coalesced": self.coalesced,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "failures": self.failures,
+                "waits": waits,
+            }
+
+
+gateway = LLMGateway()
+
+
+def request_key(model, temperature, messages, stop, options, account=""):
+    """Fingerprint of an LLM request; equal keys get the same upstream call"""
+    payload = json.dumps(
+        [model, account, temperature, stop, [(m.type, m.content) for m in messages], options],
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def estimate_tokens(messages, max_tokens=None):
+    """Prompt tokens from message length plus the completion budget, reserved before sending"""
+    prompt = sum(len(str(message.content)) for message in messages) // CHARS_PER_TOKEN
+    return prompt + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+class GatewayChatGroq(ChatGroq):
+    """ChatGroq whose requests go through the process-wide gateway
+
+    Upstream requests always stream so tokens reach callbacks as they
+    arrive; callers sharing a request get its chunks replayed once it ends.
+    Retries are left to the gateway, so build it with max_retries=0.
+    """
+
+    def _gateway_request(self, messages, stop, kwargs):
+        account = api_key_hash(self.groq_api_key)
+        key = request_key(self.model_name, self.temperature, messages, stop, kwargs, account)
+        return key, estimate_tokens(messages, kwargs.get("max_tokens", self.max_tokens)), account
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # Token callbacks come from LangChain's streaming path or from _generate below
+        key, tokens, account = self._gateway_request(messages, stop, kwargs)
+        upstream = super(GatewayChatGroq, self)._stream
+        yield from gateway.stream(self.model_name, key, tokens, lambda: upstream(messages, stop, **kwargs), account)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        key, tokens, account = self._gateway_request(messages, stop, kwargs)
+        upstream = super(GatewayChatGroq, self)._astream
+        async for chunk in gateway.astream(self.model_name, key, tokens, lambda: upstream(messages, stop, **kwargs), account):
+            yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        def chunks():
+            for chunk in self._stream(messages, stop, **kwargs):
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        return generate_from_stream(chunks())
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async def chunks():
+            async for chunk in self._astream(messages, stop, **kwargs):
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        return await agenerate_from_stream(chunks())
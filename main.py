@@ -1,5 +1,18 @@
+import argparse
+import os
+
+import uvicorn
+
+
 def main():
-    print("Hello from sql-chat!")
+    parser = argparse.ArgumentParser(description="Serve the SQL Chat HTTP API")
+    parser.add_argument("--host", default=os.environ.get("SQL_CHAT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("SQL_CHAT_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "2")),
+                        help="Worker processes; each holds its own engine, connection pools and caches")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+import hashlib
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+import plotly.io as pio
+
+from exports import cleanup_exports
+
+MESSAGE_ROOT = Path(tempfile.gettempdir()) / "sql_chat_messages"
+# Loaded frames, figures and long texts kept in memory, least recently used evicted first
+MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+# Answers longer than this keep only a preview in session state
+CONTENT_PREVIEW_CHARS = 2000
+
+
+@dataclass
+class StoredMessage:
+    """Lightweight chat turn kept in session state; heavy payloads are referenced by id"""
+    id: str
+    role: str
+    content: str
+    sql: list = field(default_factory=list)
+    export: object = None
+    content_ref: str = None
+    data_ref: str = None
+    data_shape: tuple = None
+    figure_ref: str = None
+
+
+class PayloadCache:
+    """Byte-bounded LRU over payloads loaded from disk"""
+
+    def __init__(self, max_bytes=MEMORY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes and len(self._items) > 1:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class MessageStore:
+    """Chat history whose frames, figures and long answers live on disk
+
+    Behaves like the list of message dicts it replaces: append() takes the
+    same {"role", "content", "sql", "data", "visualization", "export"} dicts
+    and iterating yields StoredMessage records.
+    """
+
+    def __init__(self, session_id=None, root=MESSAGE_ROOT, cache_bytes=MEMORY_CACHE_BYTES):
+        # Same age-based cleanup as export spill directories
+        cleanup_exports(root)
+        self.directory = Path(root) / (session_id or uuid.uuid4().hex)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.cache = PayloadCache(cache_bytes)
+        self._messages = []
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(list(self._messages))
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def _store_frame(self, frame):
+        ref = uuid.uuid4().hex
+        frame.to_pickle(self.directory / f"{ref}.pkl")
+        self.cache.put(ref, frame, int(frame.memory_usage(deep=True).sum()))
+        return ref
+
+    def _store_figure(self, figure):
+        spec = figure.to_json()
+        ref = hashlib.sha1(spec.encode()).hexdigest()
+        path = self.directory / f"{ref}.json"
+        # Identical charts share one spec file
+        if not path.exists():
+            path.write_text(spec)
+        self.cache.put(ref, figure, len(spec))
+        return ref
+
+    def _store_text(self, text):
+        ref = uuid.uuid4().hex
+        (self.directory / f"{ref}.txt").write_text(text, encoding="utf-8")
+        self.cache.put(ref, text, len(text))
+        return ref
+
+    def append(self, message):
+        content = message.get("content", "")
+        stored = StoredMessage(uuid.uuid4().hex[:12], message["role"], content,
+                               list(message.get("sql") or []), message.get("export"))
+        if len(content) > CONTENT_PREVIEW_CHARS:
+            stored.content = content[:CONTENT_PREVIEW_CHARS] + "…"
+            stored.content_ref = self._store_text(content)
+        data = message.get("data")
+        if data is not None:
+            stored.data_ref = self._store_frame(data)
+            stored.data_shape = data.shape
+        figure = message.get("visualization")
+        if figure is not None:
+            stored.figure_ref = self._store_figure(figure)
+        self._messages.append(stored)
+        return stored
+
+    def _load(self, ref, suffix, reader):
+        value = self.cache.get(ref)
+        if value is None:
+            path = self.directory / f"{ref}{suffix}"
+            if not path.exists():
+                return None
+            value = reader(path)
+            # On-disk size is a close enough stand-in for the loaded size
+            self.cache.put(ref, value, path.stat().st_size)
+        return value
+
+    def content(self, message):
+        """Full answer text, reading it back from disk when only a preview is kept"""
+        if not message.content_ref:
+            return message.content
+        text = self._load(message.content_ref, ".txt", lambda p: p.read_text(encoding="utf-8"))
+        return message.content if text is None else text
+
+    def data(self, message):
+        if not message.data_ref:
+            return None
+        return self._load(message.data_ref, ".pkl", pd.read_pickle)
+
+    def figure(self, message):
+        if not message.figure_ref:
+            return None
+        return self._load(message.figure_ref, ".json", lambda p: pio.from_json(p.read_text()))
+
+    def clear(self):
+        self._messages = []
+        self.cache.clear()
+        for path in self.directory.iterdir():
+            path.unlink(missing_ok=True)
@@ -0,0 +1,780 @@
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+from sqlalchemy import inspect
+
+from direct_sql import classify_statement, open_readonly_stream, sql_parser
+from query_guard import (
+    SQLITE_LOOP, SQLITE_PROGRESS_STEPS, exec_sql, guard_settings, is_guarded, is_mariadb, reset_timeout, set_timeout,
+    sqlite_loop_rows, table_aliases, table_rows,
+)
+from result_stream import READ_ONLY_TRANSACTION_DIALECTS
+
+SCRATCH_ROOT = Path(tempfile.gettempdir()) / "sql_chat_cache" / "optimizer"
+# Full scans of tables at least this large are hot spots
+LARGE_TABLE_ROWS = 10_000
+# Sorts over more rows than this are likely to outgrow the sort memory and spill
+LARGE_SORT_ROWS = 100_000
+# Inner row visits of a nested loop (outer rows times rows read per pass) that make it a hot spot
+NESTED_LOOP_ROWS = 1_000_000
+# Actual rows this many times off the planner's estimate point at stale statistics
+MISESTIMATE_FACTOR = 10
+MISESTIMATE_MIN_ROWS = 1000
+MAX_INDEX_COLUMNS = 3
+MAX_CANDIDATES = 10
+# Databases larger than this are not copied for index trials
+MAX_SCRATCH_BYTES = 2 * 1024 ** 3
+TRIAL_RUNS = 3
+
+# Plan node kinds the hot-spot checks look at
+FULL_SCAN = "full scan"
+SORT = "sort"
+NESTED_LOOP = "nested loop"
+SPILL = "spill"
+MISESTIMATE = "row estimate"
+
+POSTGRES_SCANS = {"Seq Scan", "Parallel Seq Scan"}
+POSTGRES_SORTS = {"Sort", "Incremental Sort"}
+POSTGRES_DETAILS = (
+    "Index Cond", "Recheck Cond", "Hash Cond", "Merge Cond", "Join Filter", "Filter", "Rows Removed by Filter",
+    "Sort Key", "Sort Method", "Group Key", "Hash Batches",
+)
+MYSQL_TREE_LINE = re.compile(r"^(\s*)-> (.*)$")
+MYSQL_COST = re.compile(r"\s*\(cost=(?:[\d.e+]+\.\.)?([\d.e+]+) rows=([\d.e+]+)\)")
+MYSQL_ACTUAL = re.compile(r"\s*\(actual time=[\d.e+]+\.\.([\d.e+]+) rows=([\d.e+]+) loops=(\d+)\)")
+MYSQL_TABLE = re.compile(r"\bon (\w+)")
+RANGE_COMPARISONS = {
+    "COMPARE_LESSTHAN", "COMPARE_GREATERTHAN", "COMPARE_LESSTHANOREQUALTO", "COMPARE_GREATERTHANOREQUALTO",
+}
+
+
+@dataclass
+class PlanNode:
+    """One operator of a query plan; cost and rows are the planner's, actual_rows, loops and time_ms only after ANALYZE
+
+    rows and actual_rows are per loop, as the databases report them;
+    time_ms covers the node and everything under it over all loops.
+    """
+    label: str
+    kind: str = None
+    table: str = None
+    cost: float = None
+    rows: float = None
+    actual_rows: float = None
+    loops: int = None
+    time_ms: float = None
+    detail: str = ""
+    spilled: bool = False
+    children: list = field(default_factory=list)
+
+    def walk(self, depth=0):
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+    @property
+    def self_time_ms(self):
+        if self.time_ms is None:
+            return None
+        return max(self.time_ms - sum(child.time_ms or 0 for child in self.children), 0.0)
+
+    @property
+    def output_rows(self):
+        """Rows produced over all loops: measured when analyzed, else estimated"""
+        if self.actual_rows is not None:
+            return self.actual_rows * (self.loops or 1)
+        return self.rows
+
+
+@dataclass
+class HotSpot:
+    kind: str
+    node: str
+    message: str
+
+
+@dataclass
+class PlanReport:
+    """A statement's parsed plan and the hot spots found in it"""
+    sql: str
+    dialect: str
+    analyzed: bool = False
+    root: PlanNode = None
+    hotspots: list = field(default_factory=list)
+    duration: float = 0.0
+    note: str = None
+    error: str = None
+
+    def frame(self):
+        """Plan tree as a table, children indented under their parents"""
+        records = [{
+            "Node": "    " * depth + ("↳ " if depth else "") + node.label,
+            "Est. Cost": node.cost,
+            "Est. Rows": node.rows,
+            "Actual Rows": node.actual_rows,
+            "Loops": node.loops,
+            "Time (ms)": node.time_ms,
+            "Self (ms)": node.self_time_ms,
+            "Details": node.detail,
+        } for depth, node in self.root.walk()]
+        frame = pd.DataFrame.from_records(records)
+        # Estimates-only plans and SQLite's plans leave whole columns empty
+        return frame.dropna(axis=1, how="all")
+
+    def text(self):
+        """Indented plan with hot spots, for prompts and logs"""
+        lines = []
+        for depth, node in self.root.walk():
+            figures = [f"{name}={value:,.2f}".rstrip("0").rstrip(".") for name, value in (
+                ("cost", node.cost), ("rows", node.rows), ("actual_rows", node.actual_rows), ("time_ms", node.time_ms),
+            ) if value is not None]
+            suffix = f" ({' '.join(figures)})" if figures else ""
+            lines.append("  " * depth + "-> " + node.label + suffix + (f" [{node.detail}]" if node.detail else ""))
+        lines.extend(f"HOT SPOT {spot.kind}: {spot.node}: {spot.message}" for spot in self.hotspots)
+        return "\n".join(lines)
+
+
+def _number(value):
+    return float(value) if value is not None else None
+
+
+def _postgres_node(plan):
+    node_type = plan["Node Type"]
+    label = node_type
+    if plan.get("Join Type") and plan["Join Type"] != "Inner":
+        label += f" ({plan['Join Type']})"
+    if plan.get("Index Name"):
+        label += f" using {plan['Index Name']}"
+    if plan.get("Relation Name"):
+        alias = plan.get("Alias")
+        label += f" on {plan['Relation Name']}" + (f" {alias}" if alias and alias != plan["Relation Name"] else "")
+    details = []
+    for key in POSTGRES_DETAILS:
+        value = plan.get(key)
+        if value is not None:
+            details.append(f"{key}: {', '.join(value) if isinstance(value, list) else value}")
+    if plan.get("Sort Space Type"):
+        details.append(f"Sort Space: {plan.get('Sort Space Used')} kB {plan['Sort Space Type']}")
+    if plan.get("Shared Read Blocks") is not None:
+        details.append(f"Buffers: hit={plan.get('Shared Hit Blocks', 0)} read={plan['Shared Read Blocks']}")
+    kind = None
+    if node_type in POSTGRES_SCANS:
+        kind = FULL_SCAN
+    elif node_type in POSTGRES_SORTS:
+        kind = SORT
+    elif node_type == "Nested Loop":
+        kind = NESTED_LOOP
+    loops = plan.get("Actual Loops")
+    total = plan.get("Actual Total Time")
+    return PlanNode(
+        label,
+        kind=kind,
+        table=(plan.get("Relation Name") or "").lower() or None,
+        cost=_number(plan.get("Total Cost")),
+        rows=_number(plan.get("Plan Rows")),
+        actual_rows=_number(plan.get("Actual Rows")),
+        loops=loops,
+        time_ms=total * loops if total is not None and loops is not None else None,
+        detail="; ".join(details),
+        spilled=plan.get("Sort Space Type") == "Disk" or (plan.get("Hash Batches") or 1) > 1,
+        children=[_postgres_node(child) for child in plan.get("Plans", [])],
+    )
+
+
+def _postgres_plan(conn, sql, analyze):
+    options = "FORMAT JSON, ANALYZE, BUFFERS" if analyze else "FORMAT JSON"
+    plan = exec_sql(conn, f"EXPLAIN ({options}) {sql}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    note = None
+    if analyze:
+        note = f"Planning {plan[0].get('Planning Time', 0):.1f} ms, execution {plan[0].get('Execution Time', 0):.1f} ms"
+    return _postgres_node(plan[0]["Plan"]), note
+
+
+def _mysql_tree_node(body, aliases):
+    node = PlanNode(body)
+    cost = MYSQL_COST.search(body)
+    if cost:
+        node.cost, node.rows = float(cost.group(1)), float(cost.group(2))
+    actual = MYSQL_ACTUAL.search(body)
+    if actual:
+        node.loops = int(actual.group(3))
+        node.actual_rows = float(actual.group(2))
+        node.time_ms = float(actual.group(1)) * node.loops
+    elif "(never executed)" in body:
+        node.actual_rows, node.loops, node.time_ms = 0.0, 0, 0.0
+    node.label = MYSQL_ACTUAL.sub("", MYSQL_COST.sub("", body)).replace("(never executed)", "").strip()
+    table = MYSQL_TABLE.search(node.label)
+    if table:
+        node.table = aliases.get(table.group(1).lower(), table.group(1).lower())
+    if node.label.startswith("Table scan"):
+        node.kind = FULL_SCAN
+    elif node.label.startswith("Sort"):
+        node.kind = SORT
+    elif node.label.startswith("Nested loop"):
+        node.kind = NESTED_LOOP
+    return node
+
+
+def _mysql_tree(text, aliases):
+    """PlanNode tree from MySQL's FORMAT=TREE / EXPLAIN ANALYZE text, nested by indentation"""
+    root = PlanNode("Query")
+    stack = [(-1, root)]
+    for line in text.splitlines():
+        match = MYSQL_TREE_LINE.match(line)
+        if not match:
+            # Long conditions wrap onto lines of their own
+            if line.strip() and len(stack) > 1:
+                stack[-1][1].label += " " + line.strip()
+            continue
+        indent = len(match.group(1))
+        node = _mysql_tree_node(match.group(2), aliases)
+        while stack[-1][0] >= indent:
+            stack.pop()
+        stack[-1][1].children.append(node)
+        stack.append((indent, node))
+    return root.children[0] if len(root.children) == 1 else root
+
+
+def _mysql_table_plan(conn, sql, analyze, aliases):
+    """Tabular EXPLAIN (or MariaDB's ANALYZE): one row per table in join order, read as nested loops"""
+    result = exec_sql(conn, f"{'ANALYZE' if analyze else 'EXPLAIN'} {sql}")
+    columns = list(result.keys())
+    root = PlanNode("Query")
+    for values in result:
+        row = dict(zip(columns, values))
+        name = str(row.get("table") or "")
+        label = f"{row.get('type') or 'access'} on {name}" + (f" using {row['key']}" if row.get("key") else "")
+        extra = row.get("Extra") or ""
+        root.children.append(PlanNode(
+            label,
+            kind=FULL_SCAN if row.get("type") == "ALL" else (SORT if "filesort" in extra else None),
+            table=aliases.get(name.lower(), name.lower()) or None,
+            rows=_number(row.get("rows")),
+            actual_rows=_number(row.get("r_rows")),
+            detail=extra,
+        ))
+    if len(root.children) > 1:
+        root.kind = NESTED_LOOP
+    return root
+
+
+def _mysql_plan(conn, sql, analyze):
+    aliases = table_aliases(sql)
+    # MariaDB has neither tree plans nor EXPLAIN ANALYZE; its ANALYZE fills in the tabular plan
+    if not is_mariadb(conn):
+        try:
+            statement = f"EXPLAIN ANALYZE {sql}" if analyze else f"EXPLAIN FORMAT=TREE {sql}"
+            return _mysql_tree(exec_sql(conn, statement).scalar(), aliases), None
+        except Exception as e:
+            # Servers before 8.0.18 have no tree plans, only the tabular one
+            print(f"MySQL tree plan unavailable: {e}")
+            conn.rollback()
+            conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+            if analyze:
+                raise
+    return _mysql_table_plan(conn, sql, analyze, aliases), None
+
+
+def _sqlite_plan(conn, sql, rows_by_table):
+    """PlanNode tree from EXPLAIN QUERY PLAN, with the query guard's row assumptions
+
+    SQLite reports no costs or row estimates, so each loop gets the rows
+    the guard assumes it visits, and cost is the rows visited up to and
+    including that loop. A temp B-tree sorts the rows of its level.
+    """
+    aliases = table_aliases(sql)
+    root = PlanNode("QUERY PLAN")
+    nodes = {0: root}
+    for node_id, parent, _, detail in exec_sql(conn, f"EXPLAIN QUERY PLAN {sql}"):
+        node = PlanNode(detail)
+        match = SQLITE_LOOP.match(detail)
+        if match:
+            kind, name, rest = match.groups()
+            node.table = aliases.get(name.lower(), name.lower())
+            node.rows = float(max(sqlite_loop_rows(kind, node.table, rest, rows_by_table), 1))
+            node.kind = FULL_SCAN if kind == "SCAN" else None
+        elif detail.startswith("USE TEMP B-TREE"):
+            node.kind = SORT
+        nodes[node_id] = node
+        nodes.get(parent, root).children.append(node)
+    total = 0.0
+    for node in nodes.values():
+        loops = [child for child in node.children if child.table]
+        visited = 1.0
+        for loop in loops:
+            visited *= loop.rows
+            loop.cost = visited
+        if loops:
+            total += visited
+        if len(loops) > 1 and node.kind is None:
+            node.kind = NESTED_LOOP
+        for child in node.children:
+            if child.kind == SORT:
+                child.rows = math.prod(loop.rows for loop in loops) if loops else None
+    root.cost = total
+    return root
+
+
+@contextmanager
+def _plan_connection(db, timeout):
+    """Pooled connection in a read-only transaction, under timeout when given, rolled back afterwards"""
+    with db._engine.connect() as conn:
+        dialect = conn.dialect.name
+        if dialect in READ_ONLY_TRANSACTION_DIALECTS:
+            conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+        if timeout:
+            set_timeout(conn, dialect, timeout)
+        try:
+            yield conn
+        finally:
+            if timeout:
+                try:
+                    reset_timeout(conn, dialect)
+                except Exception:
+                    conn.invalidate()
+            conn.rollback()
+
+
+def _loop_visits(node, rows_by_table):
+    """Rows a nested loop reads: the outer input's rows times what each inner input reads per pass"""
+    # SQLite's temp B-trees sit beside the loops they sort but are not loops themselves
+    inputs = [child for child in node.children if child.rows is not None and (child.table or child.children)]
+    if len(inputs) < 2:
+        return 0.0
+    visits = inputs[0].output_rows or 1.0
+    for child in inputs[1:]:
+        if child.kind == FULL_SCAN and child.table in rows_by_table:
+            visits *= max(rows_by_table[child.table], 1)
+        else:
+            visits *= max(child.rows, 1.0)
+    return visits
+
+
+def find_hotspots(root, rows_by_table=None):
+    """Full scans of large tables, spilling or oversized sorts, nested loops over big inputs and misestimates"""
+    rows_by_table = rows_by_table or {}
+    spots = []
+    for _, node in root.walk():
+        if node.spilled:
+            spots.append(HotSpot(SPILL, node.label, f"Spilled to disk ({node.detail}); "
+                                 "give the operation more memory (work_mem) or feed it fewer rows"))
+        elif node.kind == SORT and (node.output_rows or 0) >= LARGE_SORT_ROWS:
+            spots.append(HotSpot(SORT, node.label, f"Sorts about {node.output_rows:,.0f} rows, enough to spill to disk; "
+                                 "an index in the sort order would avoid the sort"))
+        if node.kind == FULL_SCAN:
+            size = rows_by_table.get(node.table) or node.rows or 0
+            if size >= LARGE_TABLE_ROWS:
+                spots.append(HotSpot(FULL_SCAN, node.label, f"Reads all {size:,.0f} rows of {node.table}; "
+                                     "an index on the columns it filters or joins on would let it seek instead"))
+        elif node.kind == NESTED_LOOP:
+            visits = _loop_visits(node, rows_by_table)
+            if visits >= NESTED_LOOP_ROWS:
+                spots.append(HotSpot(NESTED_LOOP, node.label, f"Reads about {visits:,.0f} inner rows; "
+                                     "index the inner side's join column or give the planner a hash join"))
+        if node.actual_rows is not None and node.rows is not None:
+            high = max(node.actual_rows, node.rows)
+            low = max(min(node.actual_rows, node.rows), 1.0)
+            if high >= MISESTIMATE_MIN_ROWS and high / low >= MISESTIMATE_FACTOR:
+                spots.append(HotSpot(MISESTIMATE, node.label, f"Estimated {node.rows:,.0f} rows but produced "
+                                     f"{node.actual_rows:,.0f}; the table statistics may be stale (run ANALYZE)"))
+    return spots
+
+
+def explain(db, sql, analyze=False):
+    """PlanReport for one read-only SELECT; with analyze the statement runs and actual rows and times are filled in"""
+    check = classify_statement(sql)
+    if not check.read_only:
+        return PlanReport(sql, db.dialect, analyze, error=check.reason)
+    if not is_guarded(check.sql):
+        return PlanReport(check.sql, db.dialect, analyze, error="Only SELECT queries have a plan to optimize")
+    sql = check.sql
+    rows_by_table = table_rows(db)
+    timeout = guard_settings().timeout if analyze else 0
+    start = time.perf_counter()
+    try:
+        with _plan_connection(db, timeout) as conn:
+            dialect = conn.dialect.name
+            if dialect == "postgresql":
+                root, note = _postgres_plan(conn, sql, analyze)
+            elif dialect in ("mysql", "mariadb"):
+                root, note = _mysql_plan(conn, sql, analyze)
+            elif dialect == "sqlite":
+                root, note = _sqlite_plan(conn, sql, rows_by_table), None
+            else:
+                raise ValueError(f"Query plans are not supported for {dialect}")
+        if analyze and dialect == "sqlite":
+            # SQLite has no EXPLAIN ANALYZE; the statement is run and timed as a whole
+            stream = open_readonly_stream(db, sql)
+            for _ in stream.iter_chunks():
+                pass
+            if stream.error:
+                raise RuntimeError(stream.error)
+            root.time_ms = stream.duration * 1000
+            root.actual_rows = float(stream.row_count)
+            note = "SQLite times the whole statement; its plan has no per-operator times or row counts"
+    except Exception as e:
+        return PlanReport(sql, db.dialect, analyze, duration=time.perf_counter() - start, error=str(e))
+    return PlanReport(sql, dialect, analyze, root, find_hotspots(root, rows_by_table),
+                      time.perf_counter() - start, note)
+
+
+@dataclass
+class IndexCandidate:
+    """An index the recorded workload would use, with the runs and time of the statements that want it"""
+    table: str
+    columns: tuple
+    ddl: str = ""
+    table_rows: int = None
+    reasons: list = field(default_factory=list)
+    # {statement: [runs, seconds]} of the recorded statements that want the index
+    workload: dict = field(default_factory=dict)
+
+    @property
+    def runs(self):
+        return sum(runs for runs, _ in self.workload.values())
+
+    @property
+    def total_time(self):
+        return sum(seconds for _, seconds in self.workload.values())
+
+    @property
+    def statements(self):
+        """Statements that want the index, heaviest first"""
+        return sorted(self.workload, key=lambda statement: self.workload[statement][1], reverse=True)
+
+    def merge(self, other):
+        for statement, work in other.workload.items():
+            self.workload.setdefault(statement, work)
+        self.reasons += [reason for reason in other.reasons if reason not in self.reasons]
+
+    @property
+    def name(self):
+        return re.sub(r"\W", "_", "_".join(("idx", self.table) + self.columns))[:63]
+
+
+@dataclass
+class _TableUse:
+    equality: list = field(default_factory=list)
+    ranges: list = field(default_factory=list)
+    joins: list = field(default_factory=list)
+    order: list = field(default_factory=list)
+
+
+def _syntax_tree(sql):
+    """DuckDB's parse tree of sql as JSON, or None when it cannot parse the dialect"""
+    try:
+        with sql_parser() as parser:
+            tree = json.loads(parser.execute("SELECT json_serialize_sql(?)", [sql.replace("`", '"')]).fetchone()[0])
+    except duckdb.Error:
+        return None
+    return None if tree.get("error") else tree
+
+
+def _select_nodes(value):
+    if isinstance(value, dict):
+        if value.get("type") == "SELECT_NODE":
+            yield value
+        for child in value.values():
+            yield from _select_nodes(child)
+    elif isinstance(value, list):
+        for child in value:
+            yield from _select_nodes(child)
+
+
+def _scope(table_ref, scope):
+    """{alias or name: table} for the base tables joined in one FROM clause; subqueries are their own SELECT nodes"""
+    if not isinstance(table_ref, dict):
+        return scope
+    if table_ref.get("type") == "BASE_TABLE":
+        name = table_ref["table_name"].lower()
+        scope[(table_ref.get("alias") or name).lower()] = name
+    elif table_ref.get("type") == "JOIN":
+        _scope(table_ref.get("left"), scope)
+        _scope(table_ref.get("right"), scope)
+    return scope
+
+
+def _has_columns(expression):
+    if isinstance(expression, dict):
+        if expression.get("class") == "COLUMN_REF":
+            return True
+        if expression.get("class") == "SUBQUERY":
+            return False
+        return any(_has_columns(value) for value in expression.values())
+    if isinstance(expression, list):
+        return any(_has_columns(value) for value in expression)
+    return False
+
+
+class _Collector:
+    """Columns one SELECT filters, joins, groups and sorts on, resolved to their tables"""
+
+    def __init__(self, scope, columns):
+        self.scope = scope
+        self.columns = columns
+        self.uses = {}
+
+    def resolve(self, expression):
+        if not isinstance(expression, dict) or expression.get("class") != "COLUMN_REF":
+            return None
+        names = [name.lower() for name in expression["column_names"]]
+        column = names[-1]
+        if len(names) > 1:
+            table = self.scope.get(names[-2])
+        else:
+            owners = {table for table in self.scope.values() if column in self.columns.get(table, ())}
+            table = owners.pop() if len(owners) == 1 else None
+        if table is None or column not in self.columns.get(table, ()):
+            return None
+        return table, column
+
+    def add(self, kind, resolved):
+        if resolved is None:
+            return
+        table, column = resolved
+        found = getattr(self.uses.setdefault(table, _TableUse()), kind)
+        if column not in found:
+            found.append(column)
+
+    def predicate(self, expression):
+        if not isinstance(expression, dict):
+            return
+        kind, expression_type = expression.get("class"), expression.get("type")
+        if expression_type == "CONJUNCTION_AND":
+            for child in expression["children"]:
+                self.predicate(child)
+        elif kind == "COMPARISON" and (expression_type == "COMPARE_EQUAL" or expression_type in RANGE_COMPARISONS):
+            left, right = self.resolve(expression["left"]), self.resolve(expression["right"])
+            if left and right:
+                if left[0] != right[0]:
+                    self.add("joins", left)
+                    self.add("joins", right)
+                return
+            column = left or right
+            other = expression["right"] if left else expression["left"]
+            if column and not _has_columns(other):
+                self.add("equality" if expression_type == "COMPARE_EQUAL" else "ranges", column)
+        elif expression_type == "COMPARE_IN" and expression.get("children"):
+            self.add("equality", self.resolve(expression["children"][0]))
+        elif kind == "BETWEEN":
+            self.add("ranges", self.resolve(expression.get("input")))
+
+    def joins(self, table_ref):
+        if isinstance(table_ref, dict) and table_ref.get("type") == "JOIN":
+            self.predicate(table_ref.get("condition"))
+            self.joins(table_ref.get("left"))
+            self.joins(table_ref.get("right"))
+
+
+def _wanted_indexes(sql, columns):
+    """(table, columns, reason) for the indexes one statement could seek or sort with"""
+    tree = _syntax_tree(sql)
+    if tree is None:
+        return []
+    wanted = []
+    for node in _select_nodes(tree["statements"]):
+        collector = _Collector(_scope(node.get("from_table"), {}), columns)
+        collector.joins(node.get("from_table"))
+        collector.predicate(node.get("where_clause"))
+        sort_keys = [collector.resolve(expression) for expression in node.get("group_expressions", [])]
+        for modifier in node.get("modifiers", []):
+            if modifier.get("type") == "ORDER_MODIFIER":
+                sort_keys += [collector.resolve(order["expression"]) for order in modifier["orders"]]
+        sort_tables = {key[0] for key in sort_keys if key}
+        # Only a sort entirely on one table can be read in index order
+        if len(sort_tables) == 1 and all(sort_keys):
+            for key in sort_keys:
+                collector.add("order", key)
+        for table, use in collector.uses.items():
+            if use.equality or use.ranges:
+                key = use.equality + [column for column in use.ranges[:1] if column not in use.equality]
+                wanted.append((table, tuple(key[:MAX_INDEX_COLUMNS]), "filter"))
+            for column in use.joins:
+                wanted.append((table, (column,), "join"))
+            if use.order and not use.ranges:
+                key = use.equality + [column for column in use.order if column not in use.equality]
+                wanted.append((table, tuple(key[:MAX_INDEX_COLUMNS]), "sort"))
+    return wanted
+
+
+def _existing_indexes(inspector, schema, table):
+    """Column lists of table's indexes, primary key and unique constraints, lower-cased"""
+    found = []
+    try:
+        primary = inspector.get_pk_constraint(table, schema=schema).get("constrained_columns") or []
+        if primary:
+            found.append(primary)
+        found += [index["column_names"] for index in inspector.get_indexes(table, schema=schema)]
+        found += [unique["column_names"] for unique in inspector.get_unique_constraints(table, schema=schema)]
+    except Exception as e:
+        print(f"Error reading indexes of {table}: {e}")
+    return [tuple(str(column).lower() for column in columns if column) for columns in found]
+
+
+def suggest_indexes(db, workload, limit=MAX_CANDIDATES):
+    """Index candidates for the recorded workload, heaviest first
+
+    workload is history_store.workload rows: (sql, runs, total seconds).
+    Each recorded statement is parsed for the columns it filters on with
+    equality and ranges, joins on and sorts by; a candidate leads with the
+    equality columns. Candidates an existing index already covers as a
+    prefix are dropped, as are those a longer candidate covers.
+    """
+    inspector = inspect(db._engine)
+    schema = getattr(db, "_schema", None)
+    tables = {name.lower(): name for name in db.get_usable_table_names()}
+    columns = {
+        name.lower(): {col["name"].lower() for col in cols}
+        for (_, name), cols in inspector.get_multi_columns(schema=schema, filter_names=list(tables.values())).items()
+    }
+    found = {}
+    for recorded, runs, total_time in workload:
+        statements = [statement for statement in recorded.split(";\n") if is_guarded(statement)]
+        for statement in statements:
+            reasons = {}
+            for table, key, reason in _wanted_indexes(statement, columns):
+                reasons.setdefault((table, key), []).append(reason)
+            for (table, key), why in reasons.items():
+                candidate = found.setdefault((table, key), IndexCandidate(table, key))
+                work = candidate.workload.setdefault(statement, [0, 0.0])
+                work[0] += runs
+                # A question's time is shared by the statements it ran
+                work[1] += (total_time or 0.0) / len(statements)
+                candidate.reasons += [reason for reason in why if reason not in candidate.reasons]
+
+    existing = {table: _existing_indexes(inspector, schema, tables[table]) for table, _ in found}
+    # Longest first, so a shorter candidate folds into a longer one that is itself kept
+    for table, key in sorted(found, key=lambda item: len(item[1]), reverse=True):
+        candidate = found[(table, key)]
+        if any(columns[:len(key)] == key for columns in existing[table]):
+            del found[(table, key)]
+            continue
+        longer = [other for (other_table, other_key), other in found.items()
+                  if other_table == table and len(other_key) > len(key) and other_key[:len(key)] == key]
+        if longer:
+            longer[0].merge(candidate)
+            del found[(table, key)]
+
+    rows_by_table = table_rows(db)
+    quote = db._engine.dialect.identifier_preparer.quote
+    ranked = sorted(found.values(), key=lambda candidate: (candidate.total_time, candidate.runs), reverse=True)[:limit]
+    for candidate in ranked:
+        candidate.table_rows = rows_by_table.get(candidate.table)
+        candidate.ddl = (f"CREATE INDEX {quote(candidate.name)} ON {quote(tables[candidate.table])} "
+                         f"({', '.join(quote(column) for column in candidate.columns)})")
+    return ranked
+
+
+@dataclass
+class IndexTrial:
+    """Before and after timings of one statement on a scratch copy, without and with a candidate index"""
+    candidate: IndexCandidate
+    sql: str
+    before: float = None
+    after: float = None
+    rows: int = 0
+    before_plan: list = field(default_factory=list)
+    after_plan: list = field(default_factory=list)
+    error: str = None
+
+    @property
+    def speedup(self):
+        if self.before is None or not self.after:
+            return None
+        return self.before / self.after
+
+    @property
+    def used(self):
+        return any(self.candidate.name in line for line in self.after_plan)
+
+
+@contextmanager
+def scratch_copy(db):
+    """sqlite3 connection to a private copy of a SQLite database, deleted afterwards"""
+    if db.dialect != "sqlite":
+        raise ValueError("Index trials need a SQLite database")
+    SCRATCH_ROOT.mkdir(parents=True, exist_ok=True)
+    handle, path = tempfile.mkstemp(suffix=".db", dir=SCRATCH_ROOT)
+    os.close(handle)
+    copy = None
+    try:
+        with db._engine.connect() as conn:
+            size = conn.exec_driver_sql("PRAGMA page_count").scalar() * conn.exec_driver_sql("PRAGMA page_size").scalar()
+            if size > MAX_SCRATCH_BYTES:
+                raise ValueError(f"The database is {size / 1024 ** 3:.1f} GB, too large to copy for an index trial")
+            if shutil.disk_usage(SCRATCH_ROOT).free < 2 * size:
+                raise ValueError("Not enough free disk space for a scratch copy of the database")
+            copy = sqlite3.connect(path, check_same_thread=False)
+            # The backup API copies a consistent snapshot, even of a read-only upload
+            conn.connection.dbapi_connection.backup(copy)
+            conn.rollback()
+        yield copy
+    finally:
+        if copy is not None:
+            copy.close()
+        Path(path).unlink(missing_ok=True)
+
+
+def _plan_lines(conn, sql):
+    depths = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append("  " * depths[node_id] + detail)
+    return lines
+
+
+def _time_statement(conn, sql, runs, timeout):
+    """(median seconds to run sql and read every row, row count); seconds is None when a run exceeds timeout"""
+    deadline = None
+    conn.set_progress_handler(lambda: deadline is not None and time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+    timings, rows = [], 0
+    try:
+        for _ in range(runs):
+            deadline = time.monotonic() + timeout if timeout else None
+            start = time.perf_counter()
+            try:
+                rows = sum(1 for _ in conn.execute(sql))
+            except sqlite3.OperationalError as e:
+                if "interrupt" in str(e):
+                    return None, rows
+                raise
+            timings.append(time.perf_counter() - start)
+    finally:
+        conn.set_progress_handler(None, 0)
+    return statistics.median(timings), rows
+
+
+def trial_index(db, candidate, sql=None, runs=TRIAL_RUNS):
+    """IndexTrial of candidate on a scratch copy of a SQLite database, timing sql (or its heaviest statement)"""
+    sql = sql or candidate.statements[0]
+    check = classify_statement(sql)
+    trial = IndexTrial(candidate, check.sql)
+    if not check.read_only:
+        trial.error = check.reason
+        return trial
+    timeout = guard_settings().timeout
+    try:
+        with scratch_copy(db) as copy:
+            trial.before_plan = _plan_lines(copy, trial.sql)
+            trial.before, trial.rows = _time_statement(copy, trial.sql, runs, timeout)
+            copy.execute(candidate.ddl)
+            trial.after_plan = _plan_lines(copy, trial.sql)
+            trial.after, _ = _time_statement(copy, trial.sql, runs, timeout)
+    except Exception as e:
+        trial.error = str(e)
+    return trial
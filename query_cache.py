@@ -0,0 +1,185 @@
+import re
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from connections import database_identity
+from embeddings import EMBEDDING_MODEL, encode
+from schema_context import schema_fingerprint
+
+CACHE_PATH = Path(tempfile.gettempdir()) / "sql_chat_cache" / "query_cache.db"
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_SIMILARITY = 0.92
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_cache (
+    id INTEGER PRIMARY KEY,
+    db_identity TEXT NOT NULL,
+    schema_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    question TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    embedding BLOB,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (db_identity, schema_hash, model, normalized)
+);
+CREATE INDEX IF NOT EXISTS idx_query_cache_scope ON query_cache (db_identity, schema_hash, model);
+CREATE INDEX IF NOT EXISTS idx_query_cache_last_used ON query_cache (last_used);
+"""
+
+def normalize_question(question):
+    """Lowercase, strip punctuation and collapse whitespace"""
+    question = re.sub(r"[^\w\s'.-]", " ", question.lower())
+    question = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", question)
+    return " ".join(question.split())
+
+
+def _literals(question):
+    """Numbers and quoted values; near-duplicates must agree on these ("top 5" vs "top 10")"""
+    return sorted(re.findall(r"\d+(?:\.\d+)?|'[^']*'|\"[^\"]*\"", question.lower()))
+
+
+# Words that flip a comparison, a direction or a filter but barely move the embedding
+OPERATOR_WORDS = {
+    "above", "below", "over", "under", "more", "less", "fewer", "greater", "lower", "higher",
+    "most", "least", "max", "maximum", "min", "minimum", "highest", "lowest", "top", "bottom",
+    "first", "last", "before", "after", "earlier", "later", "older", "newer", "oldest", "newest",
+    "ascending", "descending", "asc", "desc", "increasing", "decreasing", "best", "worst",
+    "with", "without", "and", "or", "not", "no", "never", "none", "except", "excluding",
+    "only", "all", "any", "each", "every", "equal", "exactly", "between", "within", "outside",
+}
+
+
+def _operators(question):
+    """Comparison, ordering and negation words; near-duplicates must agree on these ("above" vs "below")"""
+    words = re.findall(r"[a-z]+", question.lower().replace("n't", " not"))
+    return sorted(word for word in words if word in OPERATOR_WORDS)
+
+
+@dataclass
+class CacheHit:
+    question: str
+    sql: str
+    answer: str
+    similarity: float
+    created_at: float
+
+
+class QueryCache:
+    """Persistent (database, question, model) -> SQL cache with embedding-based near-duplicate lookup"""
+
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 similarity=DEFAULT_SIMILARITY, embedding_model=EMBEDDING_MODEL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.embedding_model = embedding_model
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _embed(self, text):
+        """Normalized float32 embedding, or None when sentence-transformers is unavailable"""
+        vectors = encode([text], self.embedding_model)
+        return None if vectors is None else vectors[0]
+
+    def lookup(self, db, question, model):
+        """Return a CacheHit for an equal or near-identical question, else None"""
+        identity, schema_hash = database_identity(db), schema_fingerprint(db)
+        normalized = normalize_question(question)
+        embedding = self._embed(normalized)
+        cutoff = time.time() - self.ttl
+
+        with self._connect() as conn:
+            # The schema changed underneath these entries; they can never hit again
+            conn.execute("DELETE FROM query_cache WHERE db_identity = ? AND schema_hash != ?",
+                         (identity, schema_hash))
+            conn.execute("DELETE FROM query_cache WHERE created_at < ?", (cutoff,))
+
+            row = conn.execute(
+                "SELECT id, question, sql, answer, created_at FROM query_cache "
+                "WHERE db_identity = ? AND schema_hash = ? AND model = ? AND normalized = ?",
+                (identity, schema_hash, model, normalized),
+            ).fetchone()
+            similarity = 1.0
+
+            if row is None:
+                if embedding is None:
+                    return None
+                candidates = conn.execute(
+                    "SELECT id, question, sql, answer, created_at, embedding FROM query_cache "
+                    "WHERE db_identity = ? AND schema_hash = ? AND model = ? AND embedding IS NOT NULL",
+                    (identity, schema_hash, model),
+                ).fetchall()
+                if not candidates:
+                    return None
+                matrix = np.vstack([np.frombuffer(c[5], dtype=np.float32) for c in candidates])
+                scores = matrix @ embedding
+                literals, operators = _literals(question), _operators(question)
+                for index in np.argsort(-scores):
+                    if scores[index] < self.similarity:
+                        return None
+                    cached_question = candidates[index][1]
+                    if _literals(cached_question) == literals and _operators(cached_question) == operators:
+                        row, similarity = candidates[index][:5], float(scores[index])
+                        break
+                else:
+                    return None
+
+            conn.execute("UPDATE query_cache SET hits = hits + 1, last_used = ? WHERE id = ?",
+                         (time.time(), row[0]))
+        return CacheHit(row[1], row[2], row[3], similarity, row[4])
+
+    def store(self, db, question, model, sql, answer):
+        """Remember the SQL and answer generated for question"""
+        identity, schema_hash = database_identity(db), schema_fingerprint(db)
+        normalized = normalize_question(question)
+        embedding = self._embed(normalized)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO query_cache (db_identity, schema_hash, model, normalized, question, sql, answer, "
+                "embedding, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (db_identity, schema_hash, model, normalized) DO UPDATE SET "
+                "question = excluded.question, sql = excluded.sql, answer = excluded.answer, "
+                "embedding = excluded.embedding, created_at = excluded.created_at, last_used = excluded.last_used",
+                (identity, schema_hash, model, normalized, question, sql, answer,
+                 None if embedding is None else embedding.tobytes(), now, now),
+            )
+            # LRU eviction beyond max_entries
+            conn.execute(
+                "DELETE FROM query_cache WHERE id IN (SELECT id FROM query_cache "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self, db=None):
+        with self._connect() as conn:
+            if db is None:
+                conn.execute("DELETE FROM query_cache")
+            else:
+                conn.execute("DELETE FROM query_cache WHERE db_identity = ?", (database_identity(db),))
+
+
+query_cache = QueryCache()
@@ -0,0 +1,370 @@
+import contextvars
+import json
+import math
+import os
+import re
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from db_stats import stats_cache
+
+LIMIT = "limit"
+REFUSE = "refuse"
+
+# Results estimated above this many rows are limited (or refused) before they run
+DEFAULT_GUARD_ROWS = int(os.environ.get("SQL_CHAT_GUARD_MAX_ROWS", "100000"))
+# Per-statement time limit in seconds; 0 disables it
+DEFAULT_STATEMENT_TIMEOUT = float(os.environ.get("SQL_CHAT_STATEMENT_TIMEOUT", "30"))
+# Estimated work above which a statement is refused, in each dialect's own units:
+# planner cost for PostgreSQL and MySQL, rows visited for SQLite
+DEFAULT_MAX_COST = {
+    "postgresql": 10_000_000,
+    "mysql": 10_000_000,
+    "mariadb": 10_000_000,
+    "sqlite": 50_000_000,
+}
+# SQLite's planner assumes an indexed equality lookup finds about this many rows
+SQLITE_INDEX_ROWS = 10
+# Rows assumed for SQLite loops over something other than a table (subqueries, views)
+SQLITE_UNKNOWN_ROWS = 1000
+# Virtual machine steps between SQLite progress handler calls
+SQLITE_PROGRESS_STEPS = 10_000
+# MySQL and MariaDB error for a derived table with repeated column names
+MYSQL_DUPLICATE_COLUMN = 1060
+
+GUARDED_KEYWORDS = {"SELECT", "WITH"}
+SQL_KEYWORDS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL", "ON", "USING", "GROUP", "ORDER",
+    "LIMIT", "HAVING", "UNION", "EXCEPT", "INTERSECT", "WINDOW", "OFFSET", "FROM", "SELECT", "AS",
+}
+FIRST_KEYWORD = re.compile(r"^\s*(?:(?:--[^\n]*\n|/\*.*?\*/)\s*)*\(?\s*(\w+)", re.DOTALL)
+TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(\d+)\s*(?:OFFSET\s+\d+\s*)?;?\s*$", re.IGNORECASE)
+TABLE_ALIAS = re.compile(r"(?:\bFROM|\bJOIN|,)\s+[\"`\[]?([\w.]+)[\"`\]]?\s+(?:AS\s+)?([A-Za-z_]\w*)", re.IGNORECASE)
+SQLITE_LOOP = re.compile(r"^(SCAN|SEARCH) (\S+)(.*)$")
+AGGREGATE_CALL = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT|STRING_AGG)\s*\(", re.IGNORECASE)
+SELECT_LIST = re.compile(r"\bSELECT\b(.*?)\bFROM\b", re.IGNORECASE | re.DOTALL)
+COMPOUND = re.compile(r"\b(UNION|EXCEPT|INTERSECT)\b", re.IGNORECASE)
+
+
+class QueryRefused(Exception):
+    """A statement the guard will not run"""
+
+
+class QueryCancelled(Exception):
+    """A statement stopped because its question was cancelled"""
+
+
+@dataclass
+class GuardSettings:
+    enabled: bool = True
+    max_rows: int = DEFAULT_GUARD_ROWS
+    max_cost: float = None
+    action: str = LIMIT
+    timeout: float = DEFAULT_STATEMENT_TIMEOUT
+
+    def cost_limit(self, dialect):
+        return self.max_cost if self.max_cost is not None else DEFAULT_MAX_COST.get(dialect)
+
+
+@dataclass
+class CostEstimate:
+    rows: float
+    cost: float
+
+
+@dataclass
+class Verdict:
+    sql: str
+    estimate: CostEstimate = None
+    limit: int = None
+
+
+_current_settings = contextvars.ContextVar("sql_guard_settings", default=None)
+
+
+def guard_settings():
+    """Settings for statements run in the current context: the caller's, else the environment's defaults"""
+    return _current_settings.get() or GuardSettings()
+
+
+def use_guard_settings(settings):
+    """Guard statements run from the current context with settings; returns the token to reset it"""
+    return _current_settings.set(settings)
+
+
+@contextmanager
+def guard_scope(settings):
+    """Guard statements opened inside the block with settings; None keeps the caller's"""
+    token = _current_settings.set(settings or _current_settings.get())
+    try:
+        yield
+    finally:
+        _current_settings.reset(token)
+
+
+def is_guarded(sql):
+    match = FIRST_KEYWORD.match(sql)
+    return bool(match) and match.group(1).upper() in GUARDED_KEYWORDS
+
+
+def table_rows(db):
+    """Row counts by lower-cased table name from the cached statistics, for SQLite plans"""
+    try:
+        return {table.name.lower(): table.row_count for table in stats_cache.get(db).tables}
+    except Exception as e:
+        print(f"Query guard could not read table statistics: {e}")
+        return {}
+
+
+def table_aliases(sql):
+    """{alias: table} for the FROM and JOIN items of sql, lower-cased, so plan lines naming aliases map to tables"""
+    return {alias.lower(): table.split(".")[-1].lower()
+            for table, alias in TABLE_ALIAS.findall(sql) if alias.upper() not in SQL_KEYWORDS}
+
+
+def sqlite_loop_rows(kind, table, rest, rows_by_table):
+    """Rows one SQLite SCAN or SEARCH loop is assumed to visit per pass"""
+    if kind == "SEARCH":
+        return 1 if "INTEGER PRIMARY KEY" in rest else SQLITE_INDEX_ROWS
+    return rows_by_table.get(table, SQLITE_UNKNOWN_ROWS)
+
+
+def _postgres_estimate(conn, sql):
+    plan = exec_sql(conn, f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    return CostEstimate(float(root["Plan Rows"]), float(root["Total Cost"]))
+
+
+def _mysql_estimate(conn, sql):
+    plan = json.loads(exec_sql(conn, f"EXPLAIN FORMAT=JSON {sql}").scalar())
+    block = plan["query_block"]
+    produced = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            if "rows_produced_per_join" in node:
+                produced.append(float(node["rows_produced_per_join"]))
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(block)
+    # The last table of the join order produces the join's rows
+    rows = produced[-1] if produced else 0.0
+    return CostEstimate(rows, float(block.get("cost_info", {}).get("query_cost", 0)))
+
+
+def _top_level(sql):
+    """sql without comments, string literals or anything inside parentheses, so subqueries and arguments drop out"""
+    masked = re.sub(r"'(?:[^']|'')*'", "''", re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql, flags=re.DOTALL))
+    depth, kept = 0, []
+    for char in masked:
+        if char == "(":
+            if depth == 0:
+                kept.append(char)
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+            if depth == 0:
+                kept.append(char)
+        elif depth == 0:
+            kept.append(char)
+    return "".join(kept)
+
+
+def _result_rows(sql, visited, largest_loop):
+    """Rows the outermost SELECT returns when its loops visit visited rows
+
+    An aggregate without GROUP BY returns one row. GROUP BY and DISTINCT
+    return at most one row per row of the largest table they loop over.
+    """
+    top = _top_level(sql)
+    select_list = SELECT_LIST.search(top)
+    if select_list is None or COMPOUND.search(top):
+        return visited
+    if re.search(r"\bGROUP\s+BY\b", top, re.IGNORECASE) or re.match(r"\s*DISTINCT\b", select_list.group(1), re.IGNORECASE):
+        return min(visited, largest_loop)
+    # Window functions keep every row
+    if AGGREGATE_CALL.search(select_list.group(1)) and not re.search(r"\bOVER\b", select_list.group(1), re.IGNORECASE):
+        return 1
+    return visited
+
+
+def _sqlite_estimate(conn, sql, rows_by_table):
+    """Rows returned and rows visited by SQLite's nested loops, from EXPLAIN QUERY PLAN and table sizes
+
+    SQLite reports the loop structure but no row estimates, so each full
+    scan counts the table's rows and each indexed search SQLITE_INDEX_ROWS.
+    Loops under the same parent multiply; separate subqueries add up.
+    The visited rows are the cost; the rows returned are read from the
+    outermost SELECT's aggregates, GROUP BY, DISTINCT and LIMIT.
+    """
+    aliases = table_aliases(sql)
+    groups = {}
+    for _, parent, _, detail in exec_sql(conn, f"EXPLAIN QUERY PLAN {sql}"):
+        match = SQLITE_LOOP.match(detail)
+        if not match:
+            continue
+        kind, name, rest = match.groups()
+        rows = sqlite_loop_rows(kind, aliases.get(name.lower(), name.lower()), rest, rows_by_table)
+        groups.setdefault(parent, []).append(max(rows, 1))
+    if not groups:
+        return None
+    products = {parent: math.prod(loops) for parent, loops in groups.items()}
+    # Compound selects put every loop under a COMPOUND QUERY node; their rows add up
+    visited = products[0] if 0 in products else sum(products.values())
+    rows = _result_rows(sql, visited, max(groups.get(0, [visited])))
+    limit = TRAILING_LIMIT.search(sql)
+    if limit:
+        rows = min(rows, int(limit.group(1)))
+    return CostEstimate(float(rows), float(sum(products.values())))
+
+
+def estimate(conn, dialect, sql, rows_by_table=None):
+    """CostEstimate from the dialect's EXPLAIN, or None when the planner cannot tell"""
+    try:
+        if dialect == "postgresql":
+            return _postgres_estimate(conn, sql)
+        if dialect in ("mysql", "mariadb"):
+            return _mysql_estimate(conn, sql)
+        if dialect == "sqlite":
+            return _sqlite_estimate(conn, sql, rows_by_table or {})
+    except Exception as e:
+        # Statements the planner rejects fail the same way when run, with the database's own message
+        print(f"Query guard could not estimate the query: {e}")
+    return None
+
+
+def _strip_trailing(sql):
+    """sql without trailing comments, semicolons and whitespace, which would swallow a closing parenthesis"""
+    masked = re.sub(r"'(?:[^']|'')*'", lambda match: "_" * len(match.group()), sql)
+    masked = re.sub(r"--[^\n]*|/\*.*?\*/", lambda match: " " * len(match.group()), masked, flags=re.DOTALL)
+    return sql[:re.search(r"[\s;]*$", masked).start()]
+
+
+def with_limit(sql, limit):
+    """sql wrapped so the database returns at most limit rows"""
+    return f"SELECT * FROM ({_strip_trailing(sql)}) AS guarded_query LIMIT {int(limit)}"
+
+
+def exec_sql(conn, sql):
+    """Run sql as written; without a parameter set pyformat drivers (psycopg2, pymysql) leave its % alone"""
+    return conn.execution_options(no_parameters=True).exec_driver_sql(sql)
+
+
+def is_duplicate_column_error(error):
+    """True when MySQL refused with_limit's derived table because the SELECT repeats a column name"""
+    orig = getattr(error, "orig", error)
+    return bool(getattr(orig, "args", None)) and orig.args[0] == MYSQL_DUPLICATE_COLUMN
+
+
+def check(conn, dialect, sql, settings, rows_by_table=None):
+    """Verdict for sql under settings; raises QueryRefused when it should not run"""
+    if not settings.enabled or not is_guarded(sql):
+        return Verdict(sql)
+    found = estimate(conn, dialect, sql, rows_by_table)
+    if found is None:
+        return Verdict(sql)
+    max_cost = settings.cost_limit(dialect)
+    if max_cost and found.cost > max_cost:
+        raise QueryRefused(
+            f"Query refused: estimated cost {found.cost:,.0f} exceeds the limit of {max_cost:,.0f}. "
+            "Add filters or join conditions, or aggregate instead of returning rows."
+        )
+    if settings.max_rows and found.rows > settings.max_rows:
+        if settings.action == REFUSE:
+            raise QueryRefused(
+                f"Query refused: about {found.rows:,.0f} rows estimated, more than the limit of {settings.max_rows:,}. "
+                "Add filters, aggregates or a LIMIT."
+            )
+        return Verdict(with_limit(sql, settings.max_rows), found, settings.max_rows)
+    return Verdict(sql, found)
+
+
+def is_mariadb(conn):
+    """True for a MariaDB server, which a mysql+pymysql URL still reports as dialect "mysql" """
+    return conn.dialect.name == "mariadb" or bool(getattr(conn.dialect, "is_mariadb", False))
+
+
+def set_timeout(conn, dialect, seconds):
+    """Server-side time limit for the statements that follow on conn; SQLite uses a progress handler instead"""
+    if dialect == "postgresql":
+        # LOCAL: reverted when the stream's transaction is rolled back
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(seconds * 1000)}")
+    elif dialect in ("mysql", "mariadb"):
+        if is_mariadb(conn):
+            # MariaDB has no MAX_EXECUTION_TIME; its limit is in seconds
+            conn.exec_driver_sql(f"SET SESSION max_statement_time = {float(seconds)}")
+        else:
+            conn.exec_driver_sql(f"SET SESSION MAX_EXECUTION_TIME = {int(seconds * 1000)}")
+
+
+def reset_timeout(conn, dialect):
+    """Undo set_timeout's session settings before conn goes back to the pool"""
+    if dialect in ("mysql", "mariadb"):
+        if is_mariadb(conn):
+            conn.exec_driver_sql("SET SESSION max_statement_time = 0")
+        else:
+            conn.exec_driver_sql("SET SESSION MAX_EXECUTION_TIME = 0")
+
+
+def cancel_backend(engine, dialect, dbapi_connection):
+    """Stop whatever dbapi_connection is running on the server; callable from any thread"""
+    if dialect == "sqlite":
+        dbapi_connection.interrupt()
+    elif dialect == "postgresql":
+        dbapi_connection.cancel()
+    elif dialect in ("mysql", "mariadb"):
+        # The busy connection cannot take another command, so the kill goes over a second one
+        with engine.connect() as conn:
+            conn.exec_driver_sql(f"KILL QUERY {int(dbapi_connection.thread_id())}")
+
+
+class CancelScope:
+    """Statements running on behalf of one question, so cancelling it also stops them on the server"""
+
+    def __init__(self):
+        self.cancelled = False
+        self._streams = set()
+        self._lock = threading.Lock()
+
+    def add(self, stream):
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._streams.add(stream)
+            return True
+
+    def discard(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            streams = list(self._streams)
+        for stream in streams:
+            stream.cancel()
+
+
+_current_scope = contextvars.ContextVar("sql_cancel_scope", default=None)
+
+
+@contextmanager
+def cancel_scope(scope=None):
+    """Register statements opened inside the block, including on worker threads, with scope"""
+    scope = scope or CancelScope()
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def current_scope():
+    return _current_scope.get()
@@ -0,0 +1,332 @@
+import contextvars
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import bindparam, text
+
+from connections import database_identity
+from query_guard import is_guarded
+
+RESULT_CACHE_ROOT = Path(tempfile.gettempdir()) / "sql_chat_cache" / "results"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Results larger than this in memory are not worth writing to disk
+MAX_ENTRY_BYTES = 64 * 1024 * 1024
+PARQUET_COMPRESSION = "zstd"
+# Parquet metadata holding the original column labels of a frame stored with positional ones
+COLUMNS_METADATA = b"sql_chat_columns"
+# Statements whose answer changes without any table changing
+VOLATILE_PATTERN = re.compile(
+    r"\b(RANDOM|RAND|NOW|CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|LOCALTIME|LOCALTIMESTAMP|SYSDATE|"
+    r"UUID|GEN_RANDOM_UUID|CLOCK_TIMESTAMP|NEXTVAL|LAST_INSERT_ID)\b|'now'",
+    re.IGNORECASE,
+)
+WRITE_PATTERN = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|CREATE|ALTER|DROP|TRUNCATE|INTO|FOR\s+UPDATE)\b", re.IGNORECASE)
+
+POSTGRES_TOKENS_SQL = text("""
+    SELECT relname,
+           n_tup_ins || ':' || n_tup_upd || ':' || n_tup_del || ':' || pg_relation_filenode(relid)
+      FROM pg_stat_user_tables
+     WHERE lower(relname) IN :tables
+       AND schemaname = COALESCE(:schema, current_schema())
+""").bindparams(bindparam("tables", expanding=True))
+
+MYSQL_TOKENS_SQL = text("""
+    SELECT TABLE_NAME, CONCAT_WS(':', COALESCE(UPDATE_TIME, ''), CREATE_TIME, TABLE_ROWS),
+           COALESCE(UPDATE_TIME >= NOW() - INTERVAL 1 SECOND, 0)
+      FROM information_schema.TABLES
+     WHERE TABLE_SCHEMA = COALESCE(:schema, DATABASE())
+       AND LOWER(TABLE_NAME) IN :tables
+""").bindparams(bindparam("tables", expanding=True))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    db_identity TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    tokens TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_result_cache_last_used ON result_cache (last_used);
+"""
+
+_parser = None
+_parser_lock = threading.Lock()
+# Off for callers that must measure the database itself, such as benchmark.py
+_caching = contextvars.ContextVar("result_caching", default=True)
+
+
+def caching_enabled():
+    """Whether the caller reads and writes the result and query caches"""
+    return _caching.get()
+
+
+@contextmanager
+def caching_scope(enabled):
+    token = _caching.set(enabled)
+    try:
+        yield
+    finally:
+        _caching.reset(token)
+
+
+def normalize_sql(sql):
+    """sql without comments, trailing semicolons and whitespace differences outside string literals"""
+    sql = re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql, flags=re.DOTALL)
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    return "".join(part if i % 2 else " ".join(part.split()) for i, part in enumerate(parts)).strip().rstrip(";").strip()
+
+
+def cacheable(sql):
+    return is_guarded(sql) and not WRITE_PATTERN.search(sql) and not VOLATILE_PATTERN.search(sql)
+
+
+def referenced_tables(db, sql):
+    """Lower-cased tables sql reads, from DuckDB's parser; every table when it cannot parse the dialect"""
+    global _parser
+    try:
+        with _parser_lock:
+            if _parser is None:
+                _parser = duckdb.connect(config={
+                    "enable_external_access": False,
+                    "autoinstall_known_extensions": False,
+                    "autoload_known_extensions": False,
+                })
+            names = _parser.get_table_names(sql.replace("`", '"'))
+        if names:
+            return sorted(name.split(".")[-1].lower() for name in names)
+    except duckdb.Error:
+        pass
+    return sorted(name.lower() for name in db.get_usable_table_names())
+
+
+def _sqlite_tokens(conn, db, tables):
+    """SQLite has no per-table counters, so every table shares the database files' size and mtime
+
+    PRAGMA data_version only reports commits made by other connections to
+    the one asking, which cannot be compared across pooled connections.
+    """
+    files = [row[2] for row in conn.exec_driver_sql("PRAGMA database_list") if row[2]]
+    if not files:
+        return None
+    stamps = []
+    for name in files:
+        for path in (Path(name), Path(name + "-wal")):
+            if path.exists():
+                stat = path.stat()
+                stamps.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+    token = "|".join(stamps)
+    return {table: token for table in tables}
+
+
+def _postgres_tokens(conn, db, tables):
+    """Row insert, update and delete counters plus the relation's file node, which TRUNCATE replaces
+
+    The counters are reported when the writing transaction ends, so a
+    write may take up to a second to show up in them.
+    """
+    return {name.lower(): token for name, token in
+            conn.execute(POSTGRES_TOKENS_SQL, {"tables": tables, "schema": getattr(db, "_schema", None)})}
+
+
+def _mysql_tokens(conn, db, tables):
+    try:
+        # MySQL 8 otherwise serves UPDATE_TIME from a cache refreshed once a day
+        conn.exec_driver_sql("SET SESSION information_schema_stats_expiry = 0")
+    except Exception:
+        conn.rollback()
+    rows = conn.execute(MYSQL_TOKENS_SQL, {"tables": tables, "schema": getattr(db, "_schema", None)}).fetchall()
+    # UPDATE_TIME has one-second resolution: a write later in the same second would leave it unchanged
+    if any(recent for _, _, recent in rows):
+        return None
+    return {name.lower(): token for name, token, _ in rows}
+
+
+TOKEN_PROVIDERS = {
+    "sqlite": _sqlite_tokens,
+    "postgresql": _postgres_tokens,
+    "mysql": _mysql_tokens,
+    "mariadb": _mysql_tokens,
+}
+
+
+def change_tokens(db, tables):
+    """{table: token} that changes whenever the table's data does, or None when that cannot be told"""
+    provider = TOKEN_PROVIDERS.get(db.dialect)
+    if provider is None or not tables:
+        return None
+    try:
+        with db._engine.connect() as conn:
+            tokens = provider(conn, db, tables)
+    except Exception as e:
+        print(f"Error reading table change tokens: {e}")
+        return None
+    # Views and tables the catalog does not track cannot be invalidated
+    if tokens is None or any(table not in tokens for table in tables):
+        return None
+    return {table: tokens[table] for table in tables}
+
+
+@dataclass
+class Probe:
+    """One statement's cache key and the change tokens read before it runs"""
+    key: str
+    identity: str
+    sql: str
+    tokens: dict
+
+
+class ResultCache:
+    """Results of read-only statements kept as zstd Parquet files, valid while their tables are unchanged
+
+    Entries are keyed on the database, its schema and the normalized SQL,
+    and remember a change token for every table the statement reads. A
+    lookup whose current tokens differ drops the entry. The files are
+    bounded by total size, least recently used first.
+    """
+
+    def __init__(self, root=RESULT_CACHE_ROOT, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.root / "index.db", timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _path(self, key):
+        return self.root / f"{key}.parquet"
+
+    def _drop(self, conn, keys):
+        for key in keys:
+            conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+            self._path(key).unlink(missing_ok=True)
+
+    def probe(self, db, sql):
+        """Probe for sql, or None when its result cannot be cached or its tables' changes cannot be tracked"""
+        # Imported here because schema_context depends on result_capture, which uses this module
+        from schema_context import schema_fingerprint
+
+        if not cacheable(sql):
+            return None
+        normalized = normalize_sql(sql)
+        identity = database_identity(db)
+        tokens = change_tokens(db, referenced_tables(db, normalized))
+        if tokens is None:
+            return None
+        key = hashlib.sha256(f"{identity}\n{schema_fingerprint(db)}\n{normalized}".encode()).hexdigest()
+        return Probe(key, identity, normalized, tokens)
+
+    def lookup(self, probe):
+        """Cached frame for probe when its tables have not changed since it was stored, else None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT tokens FROM result_cache WHERE key = ?", (probe.key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if json.loads(row[0]) != probe.tokens:
+                self._drop(conn, [probe.key])
+                self.invalidated += 1
+                self.misses += 1
+                return None
+            try:
+                table = pq.read_table(self._path(probe.key))
+                frame = table.to_pandas()
+                labels = (table.schema.metadata or {}).get(COLUMNS_METADATA)
+                if labels:
+                    frame.columns = json.loads(labels)
+            except Exception as e:
+                print(f"Error reading cached result: {e}")
+                self._drop(conn, [probe.key])
+                self.misses += 1
+                return None
+            conn.execute("UPDATE result_cache SET hits = hits + 1, last_used = ? WHERE key = ?", (time.time(), probe.key))
+        self.hits += 1
+        return frame
+
+    def store(self, probe, frame):
+        """Write frame for probe, evicting least recently used entries beyond max_bytes"""
+        if frame is None or frame.memory_usage(deep=True).sum() > MAX_ENTRY_BYTES:
+            return
+        path = self._path(probe.key)
+        # Written aside and renamed, so a concurrent reader never sees half a file
+        partial = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            labels = list(frame.columns)
+            if len(set(labels)) < len(labels):
+                # Arrow refuses duplicate names ("SELECT a.id, b.id"); store positional ones and restore on read
+                frame = frame.set_axis([f"_{i}" for i in range(len(labels))], axis=1)
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if frame.columns.tolist() != labels:
+                table = table.replace_schema_metadata({**table.schema.metadata, COLUMNS_METADATA: json.dumps(labels, default=str).encode()})
+            pq.write_table(table, partial, compression=PARQUET_COMPRESSION)
+            os.replace(partial, path)
+        except Exception as e:
+            # Mixed-type object columns have no Arrow type; such results are simply not cached
+            print(f"Error caching result: {e}")
+            partial.unlink(missing_ok=True)
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, db_identity, sql, tokens, size_bytes, row_count, "
+                "created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (probe.key, probe.identity, probe.sql, json.dumps(probe.tokens), path.stat().st_size, len(frame), now, now),
+            )
+            total = 0
+            stale = []
+            for key, size in conn.execute("SELECT key, size_bytes FROM result_cache ORDER BY last_used DESC"):
+                total += size
+                if total > self.max_bytes:
+                    stale.append(key)
+            self._drop(conn, stale)
+
+    def stats(self, db=None):
+        """Entry count, bytes on disk and hit counters, for one database or all of them"""
+        with self._connect() as conn:
+            if db is None:
+                entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM result_cache").fetchone()
+            else:
+                entries, size = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM result_cache WHERE db_identity = ?",
+                    (database_identity(db),),
+                ).fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses, "invalidated": self.invalidated}
+
+    def clear(self, db=None):
+        with self._connect() as conn:
+            if db is None:
+                keys = [row[0] for row in conn.execute("SELECT key FROM result_cache")]
+            else:
+                keys = [row[0] for row in conn.execute(
+                    "SELECT key FROM result_cache WHERE db_identity = ?", (database_identity(db),))]
+            self._drop(conn, keys)
+
+
+result_cache = ResultCache()
@@ -0,0 +1,192 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import pandas as pd
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
+from langchain_community.utilities.sql_database import truncate_word
+
+from accelerator import acceleration_settings, accelerator_for
+from result_cache import caching_enabled, result_cache
+from result_stream import open_stream
+from tracing import trace_span
+
+# The agent sees at most this many rows of a result; the full frame stays in the capture
+LLM_MAX_ROWS = 50
+
+_current_capture = contextvars.ContextVar("sql_result_capture", default=None)
+
+
+@dataclass
+class QueryResult:
+    sql: str
+    frame: pd.DataFrame = None
+    duration: float = 0.0
+    error: str = None
+    truncated: bool = False
+    cached: bool = False
+    accelerated: bool = False
+
+    @property
+    def row_count(self):
+        return 0 if self.frame is None else len(self.frame)
+
+
+@dataclass
+class ResultCapture:
+    """SQL statements executed by the agent during one question, with their result sets"""
+    results: list = field(default_factory=list)
+
+    @property
+    def statements(self):
+        return [result.sql for result in self.results]
+
+    @property
+    def last_result(self):
+        """Most recent successful statement that returned rows"""
+        for result in reversed(self.results):
+            if result.error is None and result.row_count:
+                return result
+        return None
+
+
+@contextmanager
+def capture_results():
+    """Record every sql_db_query execution made inside the block"""
+    capture = ResultCapture()
+    token = _current_capture.set(capture)
+    try:
+        yield capture
+    finally:
+        _current_capture.reset(token)
+
+
+def _llm_value(value, db):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    return truncate_word(value, length=db._max_string_length)
+
+
+def _format_for_llm(db, result, max_rows=LLM_MAX_ROWS):
+    """Rows in the shape SQLDatabase.run() returns, capped at max_rows with a compact summary"""
+    frame = result.frame
+    head = frame.head(max_rows).astype(object)
+    res = [tuple(_llm_value(value, db) for value in row) for row in head.itertuples(index=False, name=None)]
+    text = str(res) if res else ""
+    if len(frame) <= max_rows and not result.truncated:
+        return text
+
+    total = f"more than {len(frame):,}" if result.truncated else f"{len(frame):,}"
+    lines = [text, f"({total} rows in total, only the first {max_rows} are shown. Columns: {', '.join(map(str, frame.columns))}.)"]
+    for column in frame.select_dtypes(include=['number']).columns:
+        values = frame[column]
+        lines.append(f"{column}: min {values.min()}, max {values.max()}, mean {values.mean():.4g}")
+    lines.append("Use aggregates, filters or LIMIT to look at specific rows.")
+    return "\n".join(lines)
+
+
+def _accelerated(db, sql):
+    """QueryResult from the DuckDB snapshot when the caller turned acceleration on and sql qualifies, else None"""
+    settings = acceleration_settings()
+    accelerator = accelerator_for(db) if settings is not None else None
+    if accelerator is None:
+        return None
+    with trace_span("sql", "duckdb", sql=sql[:1000]) as span:
+        routed = accelerator.execute(sql, settings)
+        if routed is None:
+            if span is not None:
+                span.attributes["routed"] = False
+            return None
+        frame, duration, truncated = routed
+        if span is not None:
+            span.rows = len(frame)
+    return QueryResult(sql, frame, duration, truncated=truncated, accelerated=True)
+
+
+def _cached(db, sql):
+    """(QueryResult from the result cache or None, Probe to store a fresh result under or None)"""
+    if not caching_enabled():
+        return None, None
+    with trace_span("cache", "result", sql=sql[:1000]) as span:
+        started = time.perf_counter()
+        try:
+            probe = result_cache.probe(db, sql)
+            frame = result_cache.lookup(probe) if probe is not None else None
+        except Exception as e:
+            print(f"Result cache lookup failed: {e}")
+            return None, None
+        if span is not None:
+            span.attributes["hit"] = frame is not None
+    if frame is None:
+        return None, probe
+    return QueryResult(sql, frame, time.perf_counter() - started, cached=True), None
+
+
+def _execute(db, sql, read_only=False):
+    result, probe = _cached(db, sql)
+    if result is None:
+        result = _run(db, sql, read_only)
+        # Snapshot rows can lag the source, so they must not be stored under the source's change tokens
+        if probe is not None and result.error is None and not result.truncated and not result.accelerated:
+            try:
+                result_cache.store(probe, result.frame)
+            except Exception as e:
+                print(f"Result cache store failed: {e}")
+    return result
+
+
+def _run(db, sql, read_only=False):
+    result = _accelerated(db, sql)
+    if result is not None:
+        return result
+    with trace_span("sql", "query", sql=sql[:1000]) as span:
+        stream = open_stream(db, sql, read_only=read_only).fetch_all()
+        if span is not None:
+            span.rows, span.error = stream.row_count, stream.error
+            if stream.estimate is not None:
+                span.attributes.update(estimated_rows=stream.estimate.rows, estimated_cost=stream.estimate.cost)
+            if stream.limit is not None:
+                span.attributes["guard_limit"] = stream.limit
+    return QueryResult(sql, stream.frame() if stream.error is None else None, stream.duration,
+                       stream.error, stream.truncated)
+
+
+def execute_query(db, sql, read_only=False):
+    """Run sql outside the agent and return it as a QueryResult"""
+    return _execute(db, sql, read_only)
+
+
+def capture_query(db, sql, read_only=False):
+    """execute_query() that is also recorded in the active ResultCapture"""
+    result = execute_query(db, sql, read_only)
+    capture = _current_capture.get()
+    if capture is not None:
+        capture.results.append(result)
+    return result
+
+
+class CapturingQueryTool(QuerySQLDatabaseTool):
+    """sql_db_query that streams the result into a typed DataFrame, records it and gives the LLM a compact view"""
+
+    def _run(self, query, run_manager=None):
+        result = _execute(self.db, query)
+        capture = _current_capture.get()
+        if capture is not None:
+            capture.results.append(result)
+        if result.error is not None:
+            return f"Error: {result.error}"
+        return _format_for_llm(self.db, result)
+
+
+class CapturingSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """SQLDatabaseToolkit whose query tool feeds the active ResultCapture"""
+
+    def get_tools(self):
+        tools = super().get_tools()
+        return [
+            CapturingQueryTool(db=self.db, description=tool.description)
+            if isinstance(tool, QuerySQLDatabaseTool) else tool
+            for tool in tools
+        ]
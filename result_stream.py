@@ -0,0 +1,299 @@
+import decimal
+import threading
+import time
+import weakref
+
+import pandas as pd
+
+from query_guard import (
+    SQLITE_PROGRESS_STEPS, QueryCancelled, cancel_backend, check, current_scope, guard_settings,
+    is_duplicate_column_error, reset_timeout, set_timeout, table_rows,
+)
+
+DEFAULT_MAX_ROWS = 1_000_000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+FETCH_CHUNK_ROWS = 5000
+# Streams left open by an abandoned page give their connection back after this long
+IDLE_TIMEOUT = 300
+# Dialects that accept SET TRANSACTION READ ONLY as the first statement of a transaction
+READ_ONLY_TRANSACTION_DIALECTS = {"postgresql", "mysql", "mariadb"}
+
+_open_streams = weakref.WeakSet()
+_streams_lock = threading.Lock()
+
+
+def _to_frame(rows, columns=None):
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    for column in frame.columns:
+        values = frame[column].dropna()
+        # NUMERIC columns arrive as Decimal objects; keep them numeric
+        if len(values) and all(isinstance(value, decimal.Decimal) for value in values):
+            frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame.infer_objects()
+
+
+class ResultStream:
+    """Chunked, memory-bounded reader over one statement's result set
+
+    Uses SQLAlchemy's stream_results, which maps to a psycopg2 named cursor,
+    an unbuffered MySQL cursor, or plain stepping on SQLite, so rows are only
+    pulled from the server as pages are requested. Fetched rows are kept as
+    typed DataFrame chunks; fetching stops once max_rows or max_bytes is
+    reached, at which point the stream is marked truncated.
+
+    Before running, the query guard estimates the statement with EXPLAIN
+    and may limit or refuse it; while running, a server-side statement
+    timeout applies to opening and to each fetch, and cancel() stops the
+    statement on the server.
+    """
+
+    def __init__(self, db, sql, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES,
+                 chunk_size=FETCH_CHUNK_ROWS, read_only=False, error=None):
+        self.db = db
+        self.sql = sql
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.read_only = read_only
+        self.columns = []
+        # DB-API type code per column, as the driver reports it in cursor.description
+        self.type_codes = []
+        self.chunks = []
+        self.row_count = 0
+        self.memory_bytes = 0
+        self.exhausted = False
+        self.truncated = False
+        self.error = error
+        self.duration = 0.0
+        self.last_used = time.time()
+        self._conn = None
+        self._result = None
+        self._dialect = None
+        self._dbapi = None
+        self._lock = threading.Lock()
+        self._cancel_lock = threading.Lock()
+        self._cancelled = False
+        self._deadline = None
+        self._scope = None
+        self.estimate = None
+        self.limit = None
+        self.timeout = 0
+        if error is None:
+            self._open()
+        else:
+            self.exhausted = True
+
+    def _open(self):
+        start = time.perf_counter()
+        settings = guard_settings()
+        # Gathered before connecting: a cold statistics cache needs a connection of its own
+        rows_by_table = table_rows(self.db) if settings.enabled and self.db.dialect == "sqlite" else None
+        self._scope = current_scope()
+        try:
+            if self._scope is not None and not self._scope.add(self):
+                raise QueryCancelled("Query cancelled")
+            self._conn = self.db._engine.connect()
+            self._dialect = self._conn.dialect.name
+            with self._cancel_lock:
+                self._dbapi = self._conn.connection.dbapi_connection
+            if self.read_only and self._dialect in READ_ONLY_TRANSACTION_DIALECTS:
+                self._conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+            elif self.read_only and self._dialect == "sqlite":
+                self._conn.exec_driver_sql("PRAGMA query_only = ON")
+            self.timeout = settings.timeout
+            if self.timeout:
+                set_timeout(self._conn, self._dialect, self.timeout)
+            if self._dialect == "sqlite":
+                self._dbapi.set_progress_handler(self._interrupted, SQLITE_PROGRESS_STEPS)
+            self._arm()
+            verdict = check(self._conn, self._dialect, self.sql, settings, rows_by_table)
+            self.estimate, self.limit = verdict.estimate, verdict.limit
+            result = self._execute(verdict)
+            if result.returns_rows:
+                self.columns = list(result.keys())
+                self.type_codes = [column[1] for column in result.cursor.description or []]
+                self._result = result
+            else:
+                result.close()
+                self.exhausted = True
+                self._release()
+        except Exception as e:
+            self._fail(e)
+        self._deadline = None
+        self.duration += time.perf_counter() - start
+        with _streams_lock:
+            _open_streams.add(self)
+
+    def _execute(self, verdict):
+        # no_parameters: pyformat drivers would otherwise read the % in LIKE '%x%' as a placeholder
+        conn = self._conn.execution_options(stream_results=True, max_row_buffer=self.chunk_size, no_parameters=True)
+        try:
+            return conn.exec_driver_sql(verdict.sql)
+        except Exception as e:
+            if verdict.limit is None or not is_duplicate_column_error(e):
+                raise
+            # MySQL will not wrap a SELECT with repeated column names, so it runs as written and the fetch is capped
+            self.max_rows = min(self.max_rows, verdict.limit)
+            return conn.exec_driver_sql(self.sql)
+
+    def _arm(self):
+        """Start the clock for the SQLite progress handler; server dialects time statements themselves"""
+        self._deadline = time.monotonic() + self.timeout if self.timeout else None
+
+    def _interrupted(self):
+        return self._cancelled or (self._deadline is not None and time.monotonic() > self._deadline)
+
+    def _fail(self, error):
+        """Record why the stream stopped, in words rather than the driver's"""
+        if self._cancelled:
+            self.error = "Query cancelled"
+        elif self.timeout and self._deadline is not None and time.monotonic() >= self._deadline - 0.05:
+            self.error = f"Query exceeded the {self.timeout:g} second statement timeout"
+        else:
+            self.error = str(error)
+        self.exhausted = True
+        self._release()
+
+    def cancel(self):
+        """Stop the running statement on the server; safe to call from any thread"""
+        self._cancelled = True
+        with self._cancel_lock:
+            if self._dbapi is None:
+                return
+            try:
+                cancel_backend(self.db._engine, self._dialect, self._dbapi)
+            except Exception as e:
+                print(f"Error cancelling query: {e}")
+
+    def _release(self):
+        """Close the cursor and hand the connection back to the pool"""
+        result, conn = self._result, self._conn
+        self._result = self._conn = None
+        with self._cancel_lock:
+            dbapi, self._dbapi = self._dbapi, None
+        if self._scope is not None:
+            self._scope.discard(self)
+        try:
+            if result is not None:
+                result.close()
+            if conn is not None:
+                if self._dialect == "sqlite" and dbapi is not None:
+                    dbapi.set_progress_handler(None, 0)
+                if self.read_only and self._dialect == "sqlite":
+                    conn.exec_driver_sql("PRAGMA query_only = OFF")
+                if self.timeout:
+                    try:
+                        reset_timeout(conn, self._dialect)
+                    except Exception:
+                        # A connection still carrying the session time limit must not go back to the pool
+                        conn.invalidate()
+                conn.rollback()
+                conn.close()
+        except Exception as e:
+            print(f"Error closing result stream: {e}")
+
+    def _fetch_chunk(self):
+        rows = self._result.fetchmany(min(self.chunk_size, self.max_rows - self.row_count))
+        if not rows:
+            # A guard-injected LIMIT that was reached hides the rest of the result
+            self.truncated = self.limit is not None and self.row_count >= self.limit
+            self.exhausted = True
+            self._release()
+            return
+        frame = _to_frame([tuple(row) for row in rows], self.columns)
+        self.chunks.append(frame)
+        self.row_count += len(frame)
+        self.memory_bytes += int(frame.memory_usage(deep=True).sum())
+        if self.row_count >= self.max_rows or self.memory_bytes >= self.max_bytes:
+            self.truncated = self._result.fetchone() is not None
+            self.exhausted = True
+            self._release()
+
+    def fetch_until(self, rows):
+        """Pull chunks until at least rows rows are buffered or the stream ends"""
+        with self._lock:
+            start = time.perf_counter()
+            self._arm()
+            try:
+                while self.row_count < rows and self._result is not None:
+                    self._fetch_chunk()
+            except Exception as e:
+                self._fail(e)
+            self._deadline = None
+            self.duration += time.perf_counter() - start
+            self.last_used = time.time()
+
+    def fetch_all(self):
+        self.fetch_until(self.max_rows)
+        return self
+
+    def iter_chunks(self):
+        """Yield each chunk once and drop it, so a consumer can stream more than the memory budget"""
+        while True:
+            with self._lock:
+                if not self.chunks and self._result is not None:
+                    start = time.perf_counter()
+                    self._arm()
+                    try:
+                        self._fetch_chunk()
+                    except Exception as e:
+                        self._fail(e)
+                    self._deadline = None
+                    self.duration += time.perf_counter() - start
+                    self.last_used = time.time()
+                if not self.chunks:
+                    return
+                chunk = self.chunks.pop(0)
+                self.memory_bytes -= int(chunk.memory_usage(deep=True).sum())
+            yield chunk
+
+    def rows(self, first, last):
+        """Rows first..last-1 as one DataFrame, fetching lazily as needed"""
+        self.fetch_until(last)
+        pieces, offset = [], 0
+        for chunk in self.chunks:
+            end = offset + len(chunk)
+            if end > first and offset < last:
+                pieces.append(chunk.iloc[max(first - offset, 0):last - offset])
+            offset = end
+            if offset >= last:
+                break
+        if not pieces:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(pieces, ignore_index=True) if len(pieces) > 1 else pieces[0]
+
+    def page(self, number, size):
+        """Zero-based page of size rows"""
+        return self.rows(number * size, (number + 1) * size)
+
+    def frame(self):
+        """Everything buffered so far"""
+        if not self.chunks:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(self.chunks, ignore_index=True) if len(self.chunks) > 1 else self.chunks[0]
+
+    @property
+    def is_open(self):
+        return self._result is not None
+
+    def close(self):
+        with self._lock:
+            self._release()
+            self.exhausted = True
+
+
+def close_idle_streams(timeout=IDLE_TIMEOUT):
+    """Release connections held by streams nobody has read from recently"""
+    now = time.time()
+    with _streams_lock:
+        streams = list(_open_streams)
+    for stream in streams:
+        if stream.is_open and now - stream.last_used > timeout:
+            stream.close()
+
+
+def open_stream(db, sql, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES,
+                chunk_size=FETCH_CHUNK_ROWS, read_only=False):
+    """Start executing sql and return a ResultStream positioned before the first row"""
+    close_idle_streams()
+    return ResultStream(db, sql, max_rows, max_bytes, chunk_size, read_only)
@@ -0,0 +1,261 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+from datetime import date
+from pathlib import Path
+
+# Bump whenever the schema or the generated data changes so cached files are rebuilt
+SAMPLE_DB_VERSION = 2
+DEFAULT_SEED = 42
+SCALE_FACTORS = [1, 10, 100, 1000]
+BASE_STUDENTS = 50
+
+_build_lock = threading.Lock()
+
+SCHEMA = [
+    '''
+    CREATE TABLE students (
+        student_id INTEGER PRIMARY KEY,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        email TEXT UNIQUE,
+        phone TEXT,
+        date_of_birth DATE,
+        enrollment_date DATE,
+        gpa REAL,
+        major TEXT,
+        year_level INTEGER,
+        status TEXT DEFAULT 'Active',
+        address TEXT,
+        city TEXT,
+        state TEXT,
+        zip_code TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE courses (
+        course_id INTEGER PRIMARY KEY,
+        course_code TEXT UNIQUE NOT NULL,
+        course_name TEXT NOT NULL,
+        department TEXT,
+        credits INTEGER,
+        instructor_id INTEGER,
+        semester TEXT,
+        year INTEGER,
+        capacity INTEGER,
+        enrolled_count INTEGER DEFAULT 0,
+        course_fee REAL
+    )
+    ''',
+    '''
+    CREATE TABLE instructors (
+        instructor_id INTEGER PRIMARY KEY,
+        first_name TEXT NOT NULL,
+        last_name TEXT NOT NULL,
+        email TEXT UNIQUE,
+        department TEXT,
+        hire_date DATE,
+        salary REAL,
+        office_location TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE enrollments (
+        enrollment_id INTEGER PRIMARY KEY,
+        student_id INTEGER,
+        course_id INTEGER,
+        enrollment_date DATE,
+        grade TEXT,
+        points REAL,
+        status TEXT DEFAULT 'Enrolled',
+        FOREIGN KEY (student_id) REFERENCES students (student_id),
+        FOREIGN KEY (course_id) REFERENCES courses (course_id)
+    )
+    ''',
+    '''
+    CREATE TABLE payments (
+        payment_id INTEGER PRIMARY KEY,
+        student_id INTEGER,
+        amount REAL,
+        payment_date DATE,
+        payment_method TEXT,
+        semester TEXT,
+        year INTEGER,
+        status TEXT DEFAULT 'Completed',
+        FOREIGN KEY (student_id) REFERENCES students (student_id)
+    )
+    ''',
+]
+
+INSTRUCTORS = [
+    (1, 'Dr. Sarah', 'Johnson', 'sarah.johnson@university.edu', 'Computer Science', '2018-08-15', 75000, 'CS-201'),
+    (2, 'Prof. Michael', 'Brown', 'michael.brown@university.edu', 'Mathematics', '2015-01-10', 68000, 'MATH-105'),
+    (3, 'Dr. Emily', 'Davis', 'emily.davis@university.edu', 'Physics', '2019-09-01', 72000, 'PHYS-301'),
+    (4, 'Prof. James', 'Wilson', 'james.wilson@university.edu', 'Chemistry', '2016-03-20', 70000, 'CHEM-202'),
+    (5, 'Dr. Lisa', 'Anderson', 'lisa.anderson@university.edu', 'English', '2017-08-25', 65000, 'ENG-101'),
+]
+
+COURSES = [
+    (1, 'CS101', 'Introduction to Programming', 'Computer Science', 3, 1, 'Fall', 2024, 30, 25, 1200),
+    (2, 'MATH201', 'Calculus II', 'Mathematics', 4, 2, 'Fall', 2024, 25, 20, 800),
+    (3, 'PHYS301', 'Quantum Physics', 'Physics', 3, 3, 'Spring', 2024, 20, 15, 1000),
+    (4, 'CHEM202', 'Organic Chemistry', 'Chemistry', 4, 4, 'Fall', 2024, 28, 22, 1100),
+    (5, 'ENG101', 'English Composition', 'English', 3, 5, 'Fall', 2024, 35, 30, 600),
+    (6, 'CS301', 'Data Structures', 'Computer Science', 3, 1, 'Spring', 2024, 25, 18, 1200),
+    (7, 'MATH301', 'Linear Algebra', 'Mathematics', 3, 2, 'Spring', 2024, 20, 16, 800),
+    (8, 'PHYS201', 'Classical Mechanics', 'Physics', 4, 3, 'Fall', 2024, 22, 19, 1000),
+]
+
+MAJORS = ['Computer Science', 'Mathematics', 'Physics', 'Chemistry', 'English', 'Biology', 'Economics', 'Psychology']
+STATES = ['CA', 'NY', 'TX', 'FL', 'IL', 'PA', 'OH', 'GA', 'NC', 'MI']
+FIRST_NAMES = ['Alice', 'Bob', 'Carol', 'David', 'Eve', 'Frank', 'Grace', 'Henry', 'Iris', 'Jack']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez']
+STREETS = ['Main', 'Oak', 'Pine', 'Elm']
+CITIES = ['Springfield', 'Riverside', 'Franklin', 'Georgetown', 'Madison']
+GRADE_POINTS = {'A': 4.0, 'A-': 3.7, 'B+': 3.3, 'B': 3.0, 'B-': 2.7, 'C+': 2.3, 'C': 2.0, 'C-': 1.7, 'D+': 1.3, 'D': 1.0}
+PAYMENT_METHODS = ['Credit Card', 'Bank Transfer', 'Cash', 'Check', 'Financial Aid']
+SEMESTERS = ['Fall', 'Spring', 'Summer']
+
+
+def sample_db_path(scale=1, directory=None):
+    """Location of the sample database for a given scale factor"""
+    directory = Path(directory or tempfile.gettempdir())
+    name = "enhanced_sample.db" if scale == 1 else f"enhanced_sample_x{scale}.db"
+    return directory / name
+
+
+def _generate_students(rng, count):
+    for student_id in range(1, count + 1):
+        first_name = rng.choice(FIRST_NAMES) + str(student_id)
+        last_name = rng.choice(LAST_NAMES)
+        yield (
+            student_id,
+            first_name,
+            last_name,
+            f"{first_name.lower()}.{last_name.lower()}@student.edu",
+            f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}",
+            date(2000 + rng.randint(-2, 2), rng.randint(1, 12), rng.randint(1, 28)).isoformat(),
+            date(2020 + rng.randint(0, 4), rng.choice([1, 8]), rng.randint(15, 30)).isoformat(),
+            round(rng.uniform(2.0, 4.0), 2),
+            rng.choice(MAJORS),
+            rng.randint(1, 4),
+            'Active',
+            f"{rng.randint(100, 9999)} {rng.choice(STREETS)} St",
+            rng.choice(CITIES),
+            rng.choice(STATES),
+            f"{rng.randint(10000, 99999)}",
+        )
+
+
+def _generate_enrollments(rng, student_count):
+    course_ids = [course[0] for course in COURSES]
+    grades = list(GRADE_POINTS)
+    enrollment_id = 1
+    for student_id in range(1, student_count + 1):
+        for course_id in rng.sample(course_ids, rng.randint(3, 5)):
+            grade = rng.choice(grades)
+            yield (
+                enrollment_id,
+                student_id,
+                course_id,
+                date(2024, rng.choice([1, 8]), rng.randint(10, 20)).isoformat(),
+                grade,
+                GRADE_POINTS[grade],
+                'Completed',
+            )
+            enrollment_id += 1
+
+
+def _generate_payments(rng, student_count):
+    payment_id = 1
+    for student_id in range(1, student_count + 1):
+        for _ in range(rng.randint(2, 4)):
+            yield (
+                payment_id,
+                student_id,
+                rng.uniform(500, 2000),
+                date(2024, rng.randint(1, 12), rng.randint(1, 28)).isoformat(),
+                rng.choice(PAYMENT_METHODS),
+                rng.choice(SEMESTERS),
+                2024,
+                'Completed',
+            )
+            payment_id += 1
+
+
+def _populate(conn, scale, seed):
+    student_count = BASE_STUDENTS * scale
+    # Each table gets its own generator so the base rows are identical at every scale
+    student_rng = random.Random(f"{seed}:students")
+    enrollment_rng = random.Random(f"{seed}:enrollments")
+    payment_rng = random.Random(f"{seed}:payments")
+
+    cursor = conn.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cursor.executemany('INSERT INTO instructors VALUES (?, ?, ?, ?, ?, ?, ?, ?)', INSTRUCTORS)
+    cursor.executemany('INSERT INTO courses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', COURSES)
+    cursor.executemany('INSERT INTO students VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       _generate_students(student_rng, student_count))
+    cursor.executemany('INSERT INTO enrollments VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       _generate_enrollments(enrollment_rng, student_count))
+    cursor.executemany('INSERT INTO payments VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       _generate_payments(payment_rng, student_count))
+    cursor.execute(f"PRAGMA user_version = {SAMPLE_DB_VERSION}")
+    cursor.execute(f"PRAGMA application_id = {int(seed)}")
+
+
+def _current_build(path):
+    """(schema version, seed) recorded in an existing sample file"""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            seed = conn.execute("PRAGMA application_id").fetchone()[0]
+            return version, seed
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+
+
+def build_sample_db(scale=1, seed=DEFAULT_SEED, directory=None, force=False):
+    """Materialize the sample database once per (version, scale) and return its path"""
+    if scale < 1:
+        raise ValueError("Scale factor must be at least 1")
+    path = sample_db_path(scale, directory)
+
+    with _build_lock:
+        if not force and path.exists() and _current_build(path) == (SAMPLE_DB_VERSION, seed):
+            return path
+
+        # Build next to the target and swap it in so readers never see a partial file
+        fd, tmp_name = tempfile.mkstemp(prefix=path.stem + "_", suffix=".building", dir=path.parent)
+        os.close(fd)
+        conn = sqlite3.connect(tmp_name, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("BEGIN")
+            _populate(conn, scale, seed)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.close()
+            os.unlink(tmp_name)
+            raise
+        conn.close()
+        os.replace(tmp_name, path)
+        return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the enhanced sample SQLite database")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplier for students, enrollments and payments")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--dir", default=None, help="Output directory (defaults to the system temp dir)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if an up-to-date file exists")
+    args = parser.parse_args()
+    print(build_sample_db(args.scale, args.seed, args.dir, args.force))
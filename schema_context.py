@@ -0,0 +1,302 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+
+from sqlalchemy import column, inspect, select, table
+
+from direct_sql import classify_statement
+from result_capture import QueryResult, capture_query
+from schema_index import relevant_tables
+from tracing import trace_span
+
+SCHEMA_FINGERPRINT_TTL = 60
+SAMPLE_ROWS = 3
+MAX_CONTEXT_TABLES = 8
+MAX_CONTEXT_CHARS = 6000
+MAX_SAMPLE_VALUE_CHARS = 40
+
+AGENT_PREFIX = """You are an agent designed to interact with a SQL database.
+Given an input question, create a syntactically correct {dialect} query to run, then look at the results of the query and return the answer.
+Unless the user specifies a specific number of examples they wish to obtain, always limit your query to at most {top_k} results.
+You can order the results by a relevant column to return the most interesting examples in the database.
+Never query for all the columns from a specific table, only ask for the relevant columns given the question.
+Each question comes with the schema of the tables most relevant to it, including sample rows, so you normally do not need to list tables or fetch their schema.
+Only use the below tools. If you get an error while executing a query, rewrite the query and try again.
+
+DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the database.
+
+If the question does not seem related to the database, just return "I don't know" as the answer.
+"""
+
+AGENT_SUFFIX = """Begin!
+
+Question: {input}
+Thought: The relevant tables and columns are listed with the question, so I can write the query directly and only inspect other tables if it fails.
+{agent_scratchpad}"""
+
+SINGLE_SHOT_PROMPT = """You are an expert {dialect} analyst. Write one syntactically correct {dialect} SELECT query that answers the question.
+Unless the question asks for a specific number of rows, limit the result to at most {top_k} rows.
+Only select the columns needed to answer the question. Never write INSERT, UPDATE, DELETE, DROP or other DML/DDL.
+
+Schema:
+{schema}
+
+Question: {question}
+{error}
+Respond with only the SQL query, no explanation."""
+
+_snapshots = weakref.WeakKeyDictionary()
+_fingerprints = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _tokens(text):
+    """Lowercase word stems used to match questions against table and column names"""
+    words = re.findall(r"[a-z0-9]+", re.sub(r"([a-z])([A-Z])", r"\1 \2", text).lower().replace("_", " "))
+    stems = set()
+    for word in words:
+        stems.add(word)
+        for suffix in ("ies", "es", "s"):
+            if word.endswith(suffix) and len(word) > len(suffix) + 2:
+                stems.add(word[:-len(suffix)] + ("y" if suffix == "ies" else ""))
+                break
+    return stems
+
+
+def _reflect_columns(db):
+    inspector = inspect(db._engine)
+    schema = getattr(db, '_schema', None)
+    tables = sorted(db.get_usable_table_names())
+    return inspector, schema, tables, inspector.get_multi_columns(schema=schema, filter_names=tables)
+
+
+def _fingerprint(columns):
+    layout = {
+        name: [(col['name'], str(col['type'])) for col in cols]
+        for (_, name), cols in sorted(columns.items())
+    }
+    return hashlib.sha256(json.dumps(layout, sort_keys=True).encode()).hexdigest()
+
+
+def schema_fingerprint(db):
+    """Hash of table names, columns and types; recomputed at most once a minute per engine"""
+    engine = db._engine
+    with _lock:
+        cached = _fingerprints.get(engine)
+        if cached and time.time() - cached[1] < SCHEMA_FINGERPRINT_TTL:
+            return cached[0]
+
+    _, _, _, columns = _reflect_columns(db)
+    fingerprint = _fingerprint(columns)
+    with _lock:
+        _fingerprints[engine] = (fingerprint, time.time())
+    return fingerprint
+
+
+@dataclass
+class TableSchema:
+    name: str
+    columns: list
+    primary_key: list = field(default_factory=list)
+    foreign_keys: list = field(default_factory=list)
+    sample_rows: list = field(default_factory=list)
+
+    @property
+    def tokens(self):
+        return _tokens(self.name)
+
+    @property
+    def column_tokens(self):
+        tokens = set()
+        for name, _ in self.columns:
+            tokens |= _tokens(name)
+        return tokens
+
+    def render(self, samples=True):
+        """Compact one-table description for prompts"""
+        cols = ", ".join(
+            f"{name} {col_type}{' PK' if name in self.primary_key else ''}"
+            for name, col_type in self.columns
+        )
+        lines = [f"{self.name}({cols})"]
+        for cols_from, ref_table, cols_to in self.foreign_keys:
+            lines.append(f"  FK ({', '.join(cols_from)}) -> {ref_table}({', '.join(cols_to)})")
+        if samples and self.sample_rows:
+            lines.append("  sample rows:")
+            lines.extend(f"    {row}" for row in self.sample_rows)
+        return "\n".join(lines)
+
+
+@dataclass
+class SchemaSnapshot:
+    dialect: str
+    tables: dict
+    fingerprint: str
+    built_at: float
+    build_seconds: float
+
+    def neighbours(self, name):
+        """Tables linked to name by a foreign key in either direction"""
+        linked = {ref for _, ref, _ in self.tables[name].foreign_keys}
+        linked |= {
+            other.name for other in self.tables.values()
+            if any(ref == name for _, ref, _ in other.foreign_keys)
+        }
+        return linked & set(self.tables)
+
+    def rank_tables(self, question, limit=MAX_CONTEXT_TABLES):
+        """Tables ordered by overlap with the question, pulling in FK neighbours of the best matches"""
+        if len(self.tables) <= limit:
+            return list(self.tables)
+        words = _tokens(question)
+        scores = {
+            name: 3 * len(words & info.tokens) + len(words & info.column_tokens)
+            for name, info in self.tables.items()
+        }
+        for name, score in list(scores.items()):
+            if score >= 3:
+                for other in self.neighbours(name):
+                    scores[other] += 1
+        ranked = sorted(self.tables, key=lambda name: (-scores[name], name))
+        return ranked[:limit]
+
+    def render(self, tables=None, max_chars=MAX_CONTEXT_CHARS):
+        """Prompt text for the given tables, dropping sample rows and then tables to fit max_chars"""
+        names = list(tables if tables is not None else self.tables)
+        for samples in (True, False):
+            parts, size = [], 0
+            for name in names:
+                part = self.tables[name].render(samples)
+                if size + len(part) > max_chars and parts:
+                    break
+                parts.append(part)
+                size += len(part) + 2
+            if len(parts) == len(names):
+                break
+        text = "\n\n".join(parts)
+        omitted = len(self.tables) - len(parts)
+        if omitted:
+            text += f"\n\n({omitted} other tables not shown)"
+        return text
+
+    def context_for(self, question, limit=MAX_CONTEXT_TABLES, max_chars=MAX_CONTEXT_CHARS, tables=None):
+        return self.render(tables or self.rank_tables(question, limit), max_chars)
+
+
+def _sample_rows(conn, schema, info, limit):
+    stmt = select(*[column(name) for name, _ in info.columns]).select_from(
+        table(info.name, schema=schema)
+    ).limit(limit)
+    rows = []
+    for row in conn.execute(stmt):
+        rows.append(tuple(
+            value[:MAX_SAMPLE_VALUE_CHARS] if isinstance(value, str) else value
+            for value in row
+        ))
+    return rows
+
+
+def build_schema_snapshot(db, sample_rows=SAMPLE_ROWS):
+    """Reflect tables, columns, keys and a few sample rows in one pass"""
+    with trace_span("schema", "build_schema_snapshot"):
+        return _build_schema_snapshot(db, sample_rows)
+
+
+def _build_schema_snapshot(db, sample_rows):
+    start = time.perf_counter()
+    inspector, schema, names, columns = _reflect_columns(db)
+    primary_keys = inspector.get_multi_pk_constraint(schema=schema, filter_names=names)
+    foreign_keys = inspector.get_multi_foreign_keys(schema=schema, filter_names=names)
+
+    tables = {}
+    for (_, name), cols in sorted(columns.items()):
+        tables[name] = TableSchema(
+            name,
+            [(col['name'], str(col['type'])) for col in cols],
+            primary_keys.get((schema, name), {}).get('constrained_columns') or [],
+            [
+                (fk['constrained_columns'], fk['referred_table'], fk['referred_columns'])
+                for fk in foreign_keys.get((schema, name), [])
+            ],
+        )
+
+    if sample_rows:
+        with db._engine.connect() as conn:
+            for info in tables.values():
+                try:
+                    info.sample_rows = _sample_rows(conn, schema, info, sample_rows)
+                except Exception as e:
+                    print(f"Could not sample rows from {info.name}: {e}")
+
+    return SchemaSnapshot(db.dialect, tables, _fingerprint(columns), time.time(), time.perf_counter() - start)
+
+
+def get_schema_snapshot(db):
+    """Snapshot for db, rebuilt only when its schema fingerprint changes"""
+    engine = db._engine
+    fingerprint = schema_fingerprint(db)
+    with _lock:
+        snapshot = _snapshots.get(engine)
+    if snapshot is None or snapshot.fingerprint != fingerprint:
+        snapshot = build_schema_snapshot(db)
+        with _lock:
+            _snapshots[engine] = snapshot
+    return snapshot
+
+
+def context_for_question(db, snapshot, question):
+    """Schema text for the tables most relevant to question"""
+    with trace_span("schema", "context_for_question") as span:
+        tables = relevant_tables(db, snapshot, question, MAX_CONTEXT_TABLES)
+        if span is not None:
+            span.attributes["tables"] = len(tables)
+        return snapshot.context_for(question, tables=tables)
+
+
+def question_with_context(db, snapshot, question):
+    """Agent input carrying the pruned schema alongside the user's question"""
+    return f"{question}\n\nRelevant schema:\n{context_for_question(db, snapshot, question)}"
+
+
+def extract_sql(text):
+    """Pull the SQL statement out of an LLM reply"""
+    match = re.search(r"```(?:sql)?\s*(.*?)```", text, re.DOTALL | re.IGNORECASE)
+    sql = match.group(1) if match else text
+    sql = re.sub(r"^\s*(SQLQuery|SQL)\s*:\s*", "", sql.strip(), flags=re.IGNORECASE)
+    return sql.strip().rstrip(";").strip()
+
+
+def summarize_result(result):
+    """Short answer built from the result set itself, without another LLM call"""
+    frame = result.frame
+    if frame is None or frame.empty:
+        return "The query returned no rows."
+    if frame.shape == (1, 1):
+        return f"**{frame.columns[0]}:** {frame.iat[0, 0]}"
+    if len(frame) == 1:
+        return "\n".join(f"- **{col}:** {frame.iat[0, i]}" for i, col in enumerate(frame.columns))
+    return f"The query returned {len(frame):,} rows with columns {', '.join(map(str, frame.columns))}."
+
+
+def answer_single_shot(llm, db, question, top_k=10, retries=1):
+    """Question -> SQL in one LLM call, then one database query; retries once on SQL errors"""
+    snapshot = get_schema_snapshot(db)
+    context = context_for_question(db, snapshot, question)
+    error = ""
+    for _ in range(retries + 1):
+        prompt = SINGLE_SHOT_PROMPT.format(
+            dialect=snapshot.dialect, top_k=top_k, schema=context, question=question, error=error
+        )
+        reply = llm.invoke(prompt)
+        sql = extract_sql(getattr(reply, "content", reply))
+        # Written by the LLM, so held to the same read-only rules as Direct SQL
+        check = classify_statement(sql)
+        result = capture_query(db, check.sql, read_only=True) if check.read_only else QueryResult(sql, error=check.reason)
+        if result.error is None:
+            return summarize_result(result)
+        error = f"\nA previous attempt failed.\nQuery: {sql}\nError: {result.error}\nFix the query."
+    return f"❌ Could not produce a working query: {result.error}"
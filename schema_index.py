@@ -0,0 +1,184 @@
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+from pathlib import Path
+
+from connections import database_identity
+from embeddings import EMBEDDING_MODEL, LocalEmbeddings, get_sentence_encoder
+
+INDEX_ROOT = Path(tempfile.gettempdir()) / "sql_chat_cache" / "schema_index"
+# Below this many tables the whole schema fits in the prompt and no index is built
+MIN_TABLES_FOR_INDEX = 12
+DEFAULT_TOP_K = 8
+MANIFEST = "manifest.json"
+# Retrieved tables bring at most this many FK neighbours each, so joins stay possible
+MAX_NEIGHBOURS = 3
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def private_root(root=INDEX_ROOT):
+    """root as a directory only this user can read or write, or None when that cannot be ensured
+
+    Saved indexes are unpickled on load, so a directory another local user
+    could write to (it lives under the shared temp directory) must not be used.
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True, mode=0o700)
+    if not hasattr(os, "getuid"):
+        return root  # Windows temp directories are already per user
+    info = os.lstat(root)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        print(f"Not using schema index directory {root}: it is not a directory owned by this user")
+        return None
+    if info.st_mode & 0o077:
+        os.chmod(root, 0o700)
+    return root
+
+
+def schema_documents(snapshot):
+    """One description per table and per column, keyed by a stable document id"""
+    documents = {}
+    for table in snapshot.tables.values():
+        columns = ", ".join(name for name, _ in table.columns)
+        links = "; ".join(f"references {ref}" for _, ref, _ in table.foreign_keys)
+        documents[f"table:{table.name}"] = (
+            f"Table {table.name} with columns {columns}. {links}".strip(),
+            table.name,
+        )
+        for name, col_type in table.columns:
+            documents[f"column:{table.name}.{name}"] = (f"Column {name} ({col_type}) of table {table.name}", table.name)
+    return documents
+
+
+class SchemaIndex:
+    """FAISS index over table and column descriptions, persisted per database"""
+
+    def __init__(self, directory, model_name=EMBEDDING_MODEL):
+        self.directory = Path(directory)
+        self.model_name = model_name
+        self.embeddings = LocalEmbeddings(model_name)
+        self.store = None
+        self.manifest = {}
+        self.fingerprint = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        from langchain_community.vectorstores import FAISS
+
+        manifest_path = self.directory / MANIFEST
+        if not manifest_path.exists():
+            return
+        try:
+            data = json.loads(manifest_path.read_text())
+            if data.get("model") != self.model_name:
+                return
+            self.store = FAISS.load_local(
+                str(self.directory), self.embeddings, allow_dangerous_deserialization=True
+            )
+            self.manifest = data["documents"]
+            self.fingerprint = data.get("fingerprint")
+        except Exception as e:
+            print(f"Discarding unreadable schema index in {self.directory}: {e}")
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.store, self.manifest, self.fingerprint = None, {}, None
+
+    def _save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.store.save_local(str(self.directory))
+        (self.directory / MANIFEST).write_text(json.dumps({
+            "model": self.model_name,
+            "fingerprint": self.fingerprint,
+            "documents": self.manifest,
+        }))
+
+    def sync(self, snapshot):
+        """Embed only documents that are new or changed since the last sync; returns how many"""
+        from langchain_community.vectorstores import FAISS
+
+        with self._lock:
+            if self.fingerprint == snapshot.fingerprint and self.store is not None:
+                return 0
+            documents = schema_documents(snapshot)
+            wanted = {doc_id: _digest(text) for doc_id, (text, _) in documents.items()}
+            stale = [doc_id for doc_id, digest in self.manifest.items() if wanted.get(doc_id) != digest]
+            fresh = [doc_id for doc_id, digest in wanted.items() if self.manifest.get(doc_id) != digest]
+
+            if self.store is not None and stale:
+                self.store.delete(stale)
+            if fresh:
+                texts = [documents[doc_id][0] for doc_id in fresh]
+                metadatas = [{"table": documents[doc_id][1]} for doc_id in fresh]
+                if self.store is None:
+                    self.store = FAISS.from_texts(texts, self.embeddings, metadatas=metadatas, ids=fresh)
+                else:
+                    self.store.add_texts(texts, metadatas=metadatas, ids=fresh)
+
+            self.manifest = wanted
+            self.fingerprint = snapshot.fingerprint
+            if self.store is not None:
+                self._save()
+            return len(fresh)
+
+    def search(self, question, k=DEFAULT_TOP_K):
+        """Top-k table names for question, scoring each table by its best matching document"""
+        with self._lock:
+            if self.store is None:
+                return []
+            hits = self.store.similarity_search_with_score(question, k=k * 4)
+        # FAISS returns L2 distances on unit vectors: smaller is closer
+        best = {}
+        for document, distance in hits:
+            table = document.metadata["table"]
+            best[table] = min(distance, best.get(table, float("inf")))
+        return sorted(best, key=best.get)[:k]
+
+
+def get_schema_index(db, snapshot):
+    """Synced index for db, or None when the schema is small or embeddings are unavailable"""
+    if len(snapshot.tables) < MIN_TABLES_FOR_INDEX:
+        return None
+    if importlib.util.find_spec("faiss") is None:
+        return None
+    if get_sentence_encoder() is None:
+        return None
+    identity = database_identity(db)
+    with _lock:
+        index = _indexes.get(identity)
+        if index is None:
+            root = private_root()
+            if root is None:
+                return None
+            index = SchemaIndex(root / identity[:32])
+            _indexes[identity] = index
+    index.sync(snapshot)
+    return index
+
+
+def relevant_tables(db, snapshot, question, k=DEFAULT_TOP_K):
+    """Tables to show the LLM for question: vector retrieval on wide schemas, keyword ranking otherwise"""
+    try:
+        index = get_schema_index(db, snapshot)
+        if index is not None:
+            tables = index.search(question, k)
+            if tables:
+                # Join partners of the matched tables come along even when retrieval filled k
+                extra = []
+                for table in tables:
+                    partners = [t for t in sorted(snapshot.neighbours(table)) if t not in tables and t not in extra]
+                    extra.extend(partners[:MAX_NEIGHBOURS])
+                return tables + extra
+    except Exception as e:
+        print(f"Schema retrieval failed, falling back to keyword ranking: {e}")
+    return snapshot.rank_tables(question, k)
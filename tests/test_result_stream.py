@@ -0,0 +1,85 @@
+import re
+import sqlite3
+import unittest
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from query_guard import GuardSettings, exec_sql, guard_scope
+from result_stream import open_stream
+
+PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+
+
+class PyformatCursor:
+    """sqlite3 cursor that formats like psycopg2 / pymysql: any parameter set, even an empty one, %-formats the SQL"""
+
+    def __init__(self, cursor, strict):
+        self._cursor = cursor
+        self._strict = strict
+
+    def execute(self, sql, parameters=None):
+        if parameters is None:
+            return self._cursor.execute(sql)
+        if self._strict:
+            # A lone % is a format error for the driver, as with LIKE '%an%'
+            if "%" in PLACEHOLDER.sub("", sql).replace("%%", ""):
+                raise TypeError("dict is not a sequence")
+            sql = sql.replace("%%", "%")
+        return self._cursor.execute(PLACEHOLDER.sub(r":\1", sql), parameters)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PyformatConnection:
+    # Off while SQLDatabase reflects, since the SQLite dialect's own catalog queries contain %
+    strict = False
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return PyformatCursor(self._conn.cursor(), PyformatConnection.strict)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def pyformat_db():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.executescript("""
+        CREATE TABLE students (id INTEGER PRIMARY KEY, name TEXT);
+        INSERT INTO students (name) VALUES ('Dana'), ('Ann'), ('Bob');
+    """)
+    engine = create_engine("sqlite://", creator=lambda: PyformatConnection(conn),
+                           paramstyle="pyformat", poolclass=StaticPool)
+    return SQLDatabase(engine)
+
+
+class PercentLiteralTest(unittest.TestCase):
+    """A % inside the SQL text must reach pyformat drivers untouched"""
+
+    def setUp(self):
+        self.db = pyformat_db()
+        PyformatConnection.strict = True
+
+    def tearDown(self):
+        PyformatConnection.strict = False
+
+    def test_like_pattern_streams(self):
+        for settings in (GuardSettings(), GuardSettings(enabled=False)):
+            with guard_scope(settings):
+                stream = open_stream(self.db, "SELECT name FROM students WHERE name LIKE '%an%' ORDER BY name").fetch_all()
+            self.assertIsNone(stream.error)
+            self.assertEqual(stream.frame()["name"].tolist(), ["Ann", "Dana"])
+
+    def test_explain_keeps_percent(self):
+        with self.db._engine.connect() as conn:
+            plan = exec_sql(conn, "EXPLAIN QUERY PLAN SELECT name FROM students WHERE name LIKE '%x%'").fetchall()
+        self.assertTrue(plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,462 @@
+import contextvars
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import pandas as pd
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_PATH = Path(tempfile.gettempdir()) / "sql_chat_cache" / "traces.db"
+# Percentiles are computed over at most this many recent traces
+PERCENTILE_WINDOW = 5000
+# Retention: traces older than this or beyond the newest max_traces are pruned with their spans
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+DEFAULT_MAX_TRACES = 20000
+PHASES = ["llm", "tool", "sql", "schema", "cache"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS traces (
+    trace_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    db_identity TEXT NOT NULL DEFAULT '',
+    question TEXT NOT NULL,
+    mode TEXT NOT NULL DEFAULT '',
+    duration REAL NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_traces_db_created ON traces (db_identity, created_at);
+CREATE INDEX IF NOT EXISTS idx_traces_created ON traces (created_at);
+CREATE TABLE IF NOT EXISTS spans (
+    span_id TEXT PRIMARY KEY,
+    trace_id TEXT NOT NULL REFERENCES traces (trace_id) ON DELETE CASCADE,
+    parent_id TEXT,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    start REAL NOT NULL,
+    duration REAL NOT NULL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    ttft REAL,
+    rows INTEGER,
+    error TEXT,
+    attributes TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_spans_trace ON spans (trace_id);
+"""
+
+_current_trace = contextvars.ContextVar("sql_trace", default=None)
+_current_span = contextvars.ContextVar("sql_trace_span", default=None)
+
+
+@dataclass
+class Span:
+    kind: str
+    name: str
+    start: float
+    parent_id: str = None
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    duration: float = 0.0
+    prompt_tokens: int = None
+    completion_tokens: int = None
+    ttft: float = None
+    rows: int = None
+    error: str = None
+    attributes: dict = field(default_factory=dict)
+
+
+@dataclass
+class Trace:
+    """Spans recorded while answering one question"""
+    question: str
+    tags: dict = field(default_factory=dict)
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    start: float = field(default_factory=time.time)
+    duration: float = 0.0
+    status: str = "running"
+    spans: list = field(default_factory=list)
+    # False for traces only the caller reads (benchmark runs), which stay out of traces.db
+    persist: bool = True
+
+    def add(self, span):
+        self.spans.append(span)
+        return span
+
+    def phase_totals(self):
+        """Seconds spent per span kind; LLM and tool spans overlap SQL spans run by tools"""
+        totals = dict.fromkeys(PHASES, 0.0)
+        for span in self.spans:
+            totals[span.kind] = totals.get(span.kind, 0.0) + span.duration
+        return totals
+
+    def tokens(self):
+        prompt = sum(span.prompt_tokens or 0 for span in self.spans)
+        completion = sum(span.completion_tokens or 0 for span in self.spans)
+        return prompt, completion
+
+    def summary(self):
+        """One line for the chat: where the time went"""
+        totals = self.phase_totals()
+        llm_calls = sum(1 for span in self.spans if span.kind == "llm")
+        prompt, completion = self.tokens()
+        parts = []
+        if llm_calls:
+            parts.append(f"LLM {totals['llm']:.2f}s ({llm_calls} calls, {prompt + completion:,} tokens)")
+        for kind, label in (("sql", "SQL"), ("schema", "schema"), ("cache", "cache")):
+            if totals[kind]:
+                parts.append(f"{label} {totals[kind]:.2f}s")
+        return " · ".join(parts)
+
+
+@contextmanager
+def start_trace(question, trace=None, **tags):
+    """Make a new Trace, or continue an earlier one, the active trace for the block"""
+    if trace is None:
+        trace = Trace(question, tags)
+    else:
+        trace.tags.update(tags)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+        trace.status = "ok"
+    except BaseException as e:
+        trace.status = type(e).__name__
+        raise
+    finally:
+        trace.duration = time.time() - trace.start
+        _current_trace.reset(token)
+
+
+@contextmanager
+def trace_span(kind, name, **attributes):
+    """Record a span in the active trace; a no-op yielding None when nothing is being traced"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    span = Span(kind, name, time.time(), parent.span_id if parent else None, attributes=attributes)
+    token = _current_span.set(span)
+    started = time.perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        span.error = str(e)
+        raise
+    finally:
+        span.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        trace.add(span)
+
+
+def _token_usage(response):
+    """(prompt, completion) tokens from an LLMResult, wherever the provider reported them"""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Turns LangChain LLM and tool callbacks into spans of the active trace"""
+
+    run_inline = True
+
+    def __init__(self):
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, parent_run_id, kind, name, **attributes):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        with self._lock:
+            parent = self._open.get(parent_run_id)
+        parent_id = parent[1].span_id if parent else (_current_span.get().span_id if _current_span.get() else None)
+        span = Span(kind, name, time.time(), parent_id, attributes=attributes)
+        with self._lock:
+            self._open[run_id] = (trace, span, time.perf_counter())
+
+    def _end(self, run_id, error=None):
+        with self._lock:
+            opened = self._open.pop(run_id, None)
+        if opened is None:
+            return None
+        trace, span, started = opened
+        span.duration = time.perf_counter() - started
+        if error is not None:
+            span.error = str(error)
+        trace.add(span)
+        return span
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or "llm"
+        self._start(run_id, parent_run_id, "llm", name, prompt_chars=sum(len(p) for p in prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or "chat_model"
+        chars = sum(len(str(m.content)) for batch in messages for m in batch)
+        self._start(run_id, parent_run_id, "llm", name, prompt_chars=chars)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            opened = self._open.get(run_id)
+        if opened is not None:
+            span = opened[1]
+            if span.ttft is None:
+                span.ttft = time.perf_counter() - opened[2]
+            span.attributes["streamed_tokens"] = span.attributes.get("streamed_tokens", 0) + 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._end(run_id)
+        if span is not None:
+            span.prompt_tokens, span.completion_tokens = _token_usage(response)
+            if span.completion_tokens is None:
+                span.completion_tokens = span.attributes.get("streamed_tokens")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or "tool"
+        self._start(run_id, parent_run_id, "tool", name, input=str(input_str)[:500])
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+tracing_handler = TracingCallbackHandler()
+
+
+def _otlp_attributes(values):
+    attributes = []
+    for key, value in values.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            attributes.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            attributes.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            attributes.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            attributes.append({"key": key, "value": {"stringValue": str(value)}})
+    return attributes
+
+
+def to_otlp_json(traces, service_name="sql-chat"):
+    """Traces in the OTLP/JSON trace format, accepted by OpenTelemetry collectors"""
+    spans = []
+    for trace in traces:
+        root_id = trace.trace_id[:16]
+        start_ns = int(trace.start * 1e9)
+        spans.append({
+            "traceId": trace.trace_id,
+            "spanId": root_id,
+            "name": "question",
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(trace.duration * 1e9)),
+            "attributes": _otlp_attributes({"question": trace.question, "status": trace.status, **trace.tags}),
+        })
+        for span in trace.spans:
+            span_start = int(span.start * 1e9)
+            spans.append({
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or root_id,
+                "name": f"{span.kind}:{span.name}",
+                "kind": 3 if span.kind == "llm" else 1,
+                "startTimeUnixNano": str(span_start),
+                "endTimeUnixNano": str(span_start + int(span.duration * 1e9)),
+                "attributes": _otlp_attributes({
+                    "sql_chat.kind": span.kind,
+                    "gen_ai.usage.input_tokens": span.prompt_tokens,
+                    "gen_ai.usage.output_tokens": span.completion_tokens,
+                    "sql_chat.ttft": span.ttft,
+                    "db.response.returned_rows": span.rows,
+                    "error": span.error,
+                    **span.attributes,
+                }),
+            })
+    return json.dumps({"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": service_name})},
+        "scopeSpans": [{"scope": {"name": "sql_chat.tracing"}, "spans": spans}],
+    }]})
+
+
+def export_to_otel(trace):
+    """Send a finished trace through the OpenTelemetry SDK when it is installed and configured"""
+    if not os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return
+    try:
+        from opentelemetry import trace as otel_trace
+    except ImportError:
+        return
+    tracer = otel_trace.get_tracer("sql_chat.tracing")
+    start_ns = int(trace.start * 1e9)
+    root = tracer.start_span("question", start_time=start_ns, attributes={"question": trace.question, **trace.tags})
+    context = otel_trace.set_span_in_context(root)
+    for span in trace.spans:
+        span_start = int(span.start * 1e9)
+        child = tracer.start_span(f"{span.kind}:{span.name}", context=context, start_time=span_start)
+        for key, value in (("input_tokens", span.prompt_tokens), ("output_tokens", span.completion_tokens),
+                           ("ttft", span.ttft), ("rows", span.rows), ("error", span.error)):
+            if value is not None:
+                child.set_attribute(key, value)
+        child.end(end_time=span_start + int(span.duration * 1e9))
+    root.end(end_time=start_ns + int(trace.duration * 1e9))
+
+
+class TraceStore:
+    """Finished traces and their spans in a local SQLite file"""
+
+    def __init__(self, path=TRACE_PATH, max_age=DEFAULT_MAX_AGE, max_traces=DEFAULT_MAX_TRACES):
+        self.path = Path(path)
+        self.max_age = max_age
+        self.max_traces = max_traces
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save(self, trace):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO traces (trace_id, created_at, db_identity, question, mode, duration, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (trace.trace_id, trace.start, trace.tags.get("db_identity", ""), trace.question,
+                 trace.tags.get("mode", ""), trace.duration, trace.status),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO spans (span_id, trace_id, parent_id, kind, name, start, duration, "
+                "prompt_tokens, completion_tokens, ttft, rows, error, attributes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(s.span_id, trace.trace_id, s.parent_id, s.kind, s.name, s.start, s.duration, s.prompt_tokens,
+                  s.completion_tokens, s.ttft, s.rows, s.error, json.dumps(s.attributes, default=str))
+                 for s in trace.spans],
+            )
+            # Spans go with their trace through ON DELETE CASCADE
+            conn.execute("DELETE FROM traces WHERE created_at < ?", (time.time() - self.max_age,))
+            conn.execute(
+                "DELETE FROM traces WHERE trace_id IN (SELECT trace_id FROM traces "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_traces,),
+            )
+
+    def traces(self, db_identity=None, limit=PERCENTILE_WINDOW):
+        """Most recent traces with per-phase totals and token counts, one row per trace"""
+        where, params = ("WHERE t.db_identity = ?", [db_identity]) if db_identity else ("", [])
+        with self._connect() as conn:
+            frame = pd.read_sql_query(
+                "SELECT t.trace_id, t.created_at, t.question, t.mode, t.duration, t.status, s.kind, "
+                "SUM(s.duration) AS seconds, COUNT(s.span_id) AS spans, "
+                "SUM(s.prompt_tokens) AS prompt_tokens, SUM(s.completion_tokens) AS completion_tokens, "
+                "AVG(s.ttft) AS ttft "
+                f"FROM (SELECT * FROM traces t {where} ORDER BY created_at DESC LIMIT ?) t "
+                "LEFT JOIN spans s ON s.trace_id = t.trace_id "
+                "GROUP BY t.trace_id, s.kind",
+                conn, params=params + [limit],
+            )
+        return frame
+
+    def spans(self, db_identity=None, limit=PERCENTILE_WINDOW):
+        """Individual spans of the most recent traces"""
+        where, params = ("WHERE db_identity = ?", [db_identity]) if db_identity else ("", [])
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT s.* FROM spans s JOIN "
+                f"(SELECT trace_id FROM traces {where} ORDER BY created_at DESC LIMIT ?) t "
+                "ON s.trace_id = t.trace_id",
+                conn, params=params + [limit],
+            )
+
+    def percentiles(self, db_identity=None, limit=PERCENTILE_WINDOW):
+        """p50/p95/p99 seconds for whole questions and for each span kind"""
+        traces = self.traces(db_identity, limit)
+        if traces.empty:
+            return pd.DataFrame()
+        rows = []
+        questions = traces.drop_duplicates("trace_id")["duration"]
+        rows.append(("question", questions))
+        spans = self.spans(db_identity, limit)
+        for kind in PHASES:
+            durations = spans.loc[spans["kind"] == kind, "duration"]
+            if len(durations):
+                rows.append((kind, durations))
+        ttft = spans["ttft"].dropna()
+        if len(ttft):
+            rows.append(("time to first token", ttft))
+        return pd.DataFrame([{
+            "Phase": name,
+            "Count": len(values),
+            "p50": values.quantile(0.50),
+            "p95": values.quantile(0.95),
+            "p99": values.quantile(0.99),
+        } for name, values in rows])
+
+    def breakdown(self, db_identity=None, limit=20):
+        """Seconds per phase for each of the last limit questions, oldest first"""
+        traces = self.traces(db_identity, limit)
+        if traces.empty:
+            return pd.DataFrame()
+        table = traces.pivot_table(index=["trace_id", "created_at", "question", "duration"], columns="kind",
+                                   values="seconds", aggfunc="sum", fill_value=0.0).reset_index()
+        return table.sort_values("created_at")
+
+    def load(self, db_identity=None, limit=100):
+        """Trace objects for export"""
+        where, params = ("WHERE db_identity = ?", [db_identity]) if db_identity else ("", [])
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT trace_id, created_at, db_identity, question, mode, duration, status FROM traces {where} "
+                "ORDER BY created_at DESC LIMIT ?",
+                params + [limit],
+            ).fetchall()
+            traces = []
+            for trace_id, created_at, identity, question, mode, duration, status in rows:
+                trace = Trace(question, {"db_identity": identity, "mode": mode}, trace_id, created_at, duration, status)
+                for row in conn.execute(
+                    "SELECT kind, name, start, parent_id, span_id, duration, prompt_tokens, completion_tokens, "
+                    "ttft, rows, error, attributes FROM spans WHERE trace_id = ? ORDER BY start",
+                    (trace_id,),
+                ):
+                    trace.add(Span(*row[:-1], attributes=json.loads(row[-1])))
+                traces.append(trace)
+        return traces
+
+
+trace_store = TraceStore()
+
+
+def record_trace(trace):
+    """Persist a finished trace and forward it to OpenTelemetry when configured"""
+    if not trace.persist:
+        return
+    try:
+        trace_store.save(trace)
+        export_to_otel(trace)
+    except Exception as e:
+        print(f"Error saving trace: {e}")
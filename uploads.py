@@ -0,0 +1,109 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+from connections import connection_key, registry
+
+UPLOAD_DIR = Path(tempfile.gettempdir()) / "sql_chat_uploads"
+CHUNK_SIZE = 1024 * 1024
+# Keep at most this much uploaded data on disk; least recently used copies go first
+DEFAULT_BUDGET_BYTES = 2 * 1024 ** 3
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+_lock = threading.Lock()
+# Streamlit upload id -> stored path, so reruns skip re-hashing the same upload
+_stored_uploads = {}
+
+
+def _touch(path):
+    os.utime(path, None)
+
+
+def store_upload(uploaded_file, directory=UPLOAD_DIR, chunk_size=CHUNK_SIZE):
+    """Stream an uploaded SQLite file to disk under its content hash and return the path"""
+    upload_id = getattr(uploaded_file, "file_id", None)
+    with _lock:
+        cached = _stored_uploads.get(upload_id)
+    if cached and cached.exists():
+        _touch(cached)
+        return cached
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    uploaded_file.seek(0)
+
+    fd, tmp_name = tempfile.mkstemp(suffix=".part", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            header = uploaded_file.read(len(SQLITE_HEADER))
+            if header != SQLITE_HEADER:
+                raise ValueError("Uploaded file is not a SQLite database")
+            digest.update(header)
+            out.write(header)
+            for chunk in iter(lambda: uploaded_file.read(chunk_size), b""):
+                digest.update(chunk)
+                out.write(chunk)
+
+        path = directory / f"{digest.hexdigest()}.sqlite"
+        if path.exists():
+            # Same content uploaded before (possibly by another session)
+            os.unlink(tmp_name)
+            _touch(path)
+        else:
+            os.replace(tmp_name, path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+    finally:
+        uploaded_file.seek(0)
+
+    with _lock:
+        if upload_id is not None:
+            _stored_uploads[upload_id] = path
+    collect_garbage(directory, keep=path)
+    return path
+
+
+def readonly_creator(path):
+    """Connection factory that opens a stored upload read-only and immutable"""
+    uri = f"file:{path}?mode=ro&immutable=1"
+    return lambda: sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+
+def _in_use(path):
+    """A session is connected to the upload at path (keyed as in engine.connect_database)"""
+    return registry.in_use(connection_key(url="sqlite:///", path=str(path)))
+
+
+def collect_garbage(directory=UPLOAD_DIR, budget_bytes=DEFAULT_BUDGET_BYTES, keep=None):
+    """Delete least recently used uploads, except ones still connected, until the directory fits in budget_bytes"""
+    directory = Path(directory)
+    if not directory.exists():
+        return []
+    files = sorted(directory.glob("*.sqlite"), key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in files)
+    removed = []
+    for path in files:
+        if total <= budget_bytes:
+            break
+        if (keep is not None and path == Path(keep)) or _in_use(path):
+            continue
+        size = path.stat().st_size
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+        removed.append(path)
+
+    if removed:
+        with _lock:
+            for upload_id, stored in list(_stored_uploads.items()):
+                if stored in removed:
+                    del _stored_uploads[upload_id]
+    return removed
@@ -0,0 +1,218 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+# Scatter and line charts never carry more points than this; larger results are downsampled
+POINT_BUDGET = 5000
+# Above this many points traces switch to WebGL (scattergl)
+WEBGL_THRESHOLD = 1000
+# Bar charts show the largest categories and fold the rest into "Other"
+MAX_CATEGORIES = 30
+HISTOGRAM_BINS = 50
+FIGURE_CACHE_SIZE = 64
+DATE_SAMPLE_ROWS = 50
+
+_figure_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def result_hash(df):
+    """Content hash of a result set: columns, dtypes and every value"""
+    digest = hashlib.sha1()
+    digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def _is_identifier(name):
+    name = str(name).lower()
+    return name == "id" or name.endswith("_id")
+
+
+def _looks_like_dates(values):
+    """String columns holding ISO dates, as SQLite returns DATE columns"""
+    sample = values.dropna().head(DATE_SAMPLE_ROWS)
+    if sample.empty or not sample.map(lambda v: isinstance(v, str) and len(v) >= 8 and v[:4].isdigit()).all():
+        return False
+    return pd.to_datetime(sample, format="ISO8601", errors="coerce").notna().all()
+
+
+def classify_columns(df):
+    """(datetime, measure, categorical) column names from the frame's dtypes
+
+    Integer columns named like keys (id, student_id) are treated as
+    categories rather than measures so they are not averaged or binned.
+    """
+    datetimes, measures, categories, identifiers = [], [], [], []
+    for column, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            categories.append(column)
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            datetimes.append(column)
+        elif pd.api.types.is_numeric_dtype(dtype):
+            (identifiers if _is_identifier(column) else measures).append(column)
+        elif _looks_like_dates(df[column]):
+            datetimes.append(column)
+        else:
+            categories.append(column)
+    # Keys are the least informative axis, so named categories come first
+    return datetimes, measures, categories + identifiers
+
+
+def lttb(x, y, threshold):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling
+
+    x must be sorted. The first and last points are always kept; every
+    bucket in between contributes the point forming the largest triangle
+    with the previously kept point and the average of the next bucket.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    kept = np.empty(threshold, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        kept[i + 1] = a
+    return kept
+
+
+def _points_note(total, shown):
+    return f" ({shown:,} of {total:,} points)" if shown < total else ""
+
+
+def _line_chart(df, x, y):
+    data = df[[x, y]].dropna()
+    if not pd.api.types.is_datetime64_any_dtype(data[x]):
+        data[x] = pd.to_datetime(data[x], format="ISO8601", errors="coerce")
+        data = data.dropna()
+    if data[x].duplicated().any():
+        # Several rows per timestamp: plot the total per point in time
+        data = data.groupby(x, as_index=False)[y].sum()
+        title = f"Total {y} over {x}"
+    else:
+        data = data.sort_values(x)
+        title = f"{y} over {x}"
+    total = len(data)
+    if total > POINT_BUDGET:
+        data = data.iloc[lttb(data[x].astype("int64"), data[y], POINT_BUDGET)]
+    trace = go.Scattergl if len(data) > WEBGL_THRESHOLD else go.Scatter
+    fig = go.Figure(trace(x=data[x], y=data[y], mode="lines", name=str(y)))
+    fig.update_layout(title=title + _points_note(total, len(data)), xaxis_title=str(x), yaxis_title=str(y))
+    return fig
+
+
+def _bar_chart(df, category, measure):
+    data = df[[category, measure]].dropna()
+    title = f"{measure} by {category}"
+    if data[category].duplicated().any():
+        data = data.groupby(category, as_index=False, observed=True)[measure].mean()
+        title = f"Average {measure} by {category}"
+    total = len(data)
+    if total > MAX_CATEGORIES:
+        data = data.nlargest(MAX_CATEGORIES, measure)
+        title += f" (top {MAX_CATEGORIES} of {total:,})"
+    fig = px.bar(data, x=category, y=measure, title=title)
+    fig.update_xaxes(type="category")
+    fig.update_layout(xaxis_tickangle=45 if len(data) > 5 else 0)
+    return fig
+
+
+def _count_chart(df, category):
+    counts = df[category].value_counts()
+    total = len(counts)
+    title = f"Count of {category}"
+    if total > MAX_CATEGORIES:
+        other = counts.iloc[MAX_CATEGORIES:].sum()
+        counts = pd.concat([counts.iloc[:MAX_CATEGORIES], pd.Series({"Other": other})])
+        title += f" (top {MAX_CATEGORIES} of {total:,})"
+    fig = px.bar(x=counts.index.astype(str), y=counts.values, title=title)
+    fig.update_xaxes(type="category")
+    fig.update_layout(
+        xaxis_tickangle=45 if len(counts) > 5 else 0,
+        xaxis_title=str(category),
+        yaxis_title="Count"
+    )
+    return fig
+
+
+def _scatter_chart(df, x, y):
+    data = df[[x, y]].dropna()
+    total = len(data)
+    if total > POINT_BUDGET:
+        if data[x].is_monotonic_increasing:
+            data = data.iloc[lttb(data[x], data[y], POINT_BUDGET)]
+        else:
+            # Unordered clouds have no line shape to preserve; a fixed-seed sample keeps reruns stable
+            data = data.sample(POINT_BUDGET, random_state=0)
+    fig = px.scatter(data, x=x, y=y, title=f"{y} vs {x}" + _points_note(total, len(data)),
+                     render_mode="webgl" if len(data) > WEBGL_THRESHOLD else "svg")
+    return fig
+
+
+def _histogram(df, column):
+    """Histogram binned here, so the figure holds bin counts instead of every value"""
+    values = df[column].dropna().astype(float)
+    counts, edges = np.histogram(values, bins=min(HISTOGRAM_BINS, max(values.nunique(), 1)))
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), name=str(column)))
+    fig.update_layout(title=f"Distribution of {column}", xaxis_title=str(column), yaxis_title="Count", bargap=0)
+    return fig
+
+
+def _choose_chart(df):
+    datetimes, measures, categories = classify_columns(df)
+    if datetimes and measures:
+        return _line_chart(df, datetimes[0], measures[0])
+    if categories and measures:
+        return _bar_chart(df, categories[0], measures[0])
+    if len(measures) >= 2:
+        return _scatter_chart(df, measures[0], measures[1])
+    if measures:
+        return _histogram(df, measures[0])
+    if categories:
+        return _count_chart(df, categories[0])
+    return None
+
+
+def build_visualization(df, query_text):
+    """Pick a chart for a result set from its column types
+
+    Large results are aggregated, binned or downsampled so the figure stays
+    small, and figures are cached by the content hash of the result.
+    """
+    if df is None or df.empty:
+        return None
+
+    try:
+        key = result_hash(df)
+        with _cache_lock:
+            if key in _figure_cache:
+                _figure_cache.move_to_end(key)
+                return _figure_cache[key]
+
+        fig = _choose_chart(df)
+        if fig is not None:
+            fig.update_layout(height=400, showlegend=True)
+
+        with _cache_lock:
+            _figure_cache[key] = fig
+            while len(_figure_cache) > FIGURE_CACHE_SIZE:
+                _figure_cache.popitem(last=False)
+        return fig
+
+    except Exception as e:
+        print(f"Error creating visualization: {e}")
+        return None